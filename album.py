@@ -0,0 +1,42 @@
+import asyncio
+import logging
+from config import ALBUM_WINDOW
+from media_type_detection import get_media_type
+from workers import enqueue_download
+
+logger = logging.getLogger(__name__)
+
+# Album messages waiting for the rest of their media group, by (chat_id, media_group_id)
+_pending = {}
+
+def collect_album_message(message):
+    """
+    Buffers a message that belongs to a media group. Telegram delivers the items
+    of an album as separate updates; ALBUM_WINDOW seconds after the last one
+    arrives, the whole group is queued as a single "album" job.
+    """
+    key = (message.chat.id, message.media_group_id)
+    entry = _pending.get(key)
+    if entry is None:
+        entry = _pending[key] = {"messages": [], "timer": None}
+    else:
+        entry["timer"].cancel()
+    entry["messages"].append(message)
+    entry["timer"] = asyncio.get_running_loop().call_later(ALBUM_WINDOW, _flush, key)
+
+def _flush(key):
+    messages = sorted(_pending.pop(key)["messages"], key=lambda m: m.id)
+    asyncio.create_task(_enqueue_album(messages))
+
+async def _enqueue_album(messages):
+    media = [info for info in map(get_media_type, messages) if info]
+    payload = {
+        "message_ids": [message.id for message in messages],
+        "file_unique_ids": [info.file_unique_id for info in media],
+        "media_group_id": messages[0].media_group_id
+    }
+    try:
+        enqueue_download("album", payload, messages[0], sum(info.file_size for info in media))
+    except Exception as e:
+        logger.error(f"Could not queue album {messages[0].media_group_id}: {e}")
+        await messages[0].reply(f"Error queueing album: {str(e)}")
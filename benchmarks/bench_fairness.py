@@ -0,0 +1,82 @@
+"""
+Compares how long light chats wait while one chat forwards a large album,
+with and without per-chat fair queuing in the job queue.
+
+Time is simulated and each worker downloads at a fixed rate; the real
+JobQueue decides which job runs next.
+
+Usage: python benchmarks/bench_fairness.py [album size]
+"""
+import os
+import sys
+import heapq
+import random
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import DOWNLOAD_WORKERS
+from job_queue import JobQueue
+
+MB = 1024 * 1024
+WORKER_RATE = 2 * MB  # Bytes per second per worker
+HEAVY_CHAT = 1
+LIGHT_CHATS = 30  # Chats sending a few photos each while the album downloads
+LIGHT_WINDOW = 60  # Seconds over which the light chats send
+
+def make_workload(album, seed=1):
+    """Returns [(arrival time, chat_id, size)]: the album at t=0, then the light chats."""
+    rng = random.Random(seed)
+    photo = lambda: rng.randint(100 * 1024, 5 * MB)
+    workload = [(0.0, HEAVY_CHAT, photo()) for _ in range(album)]
+    for chat_id in range(2, LIGHT_CHATS + 2):
+        now = rng.uniform(1, LIGHT_WINDOW)
+        workload += [(now, chat_id, photo()) for _ in range(rng.randint(1, 3))]
+    return sorted(workload, key=lambda job: job[0])
+
+def simulate(workload, fair, workers=DOWNLOAD_WORKERS):
+    """Returns the completion latencies of the heavy chat's jobs and the light chats' jobs."""
+    latencies = {"heavy": [], "light": []}
+    now = 0.0
+    with tempfile.TemporaryDirectory() as tmp:
+        queue = JobQueue(os.path.join(tmp, "jobs.db"), fair=fair, clock=lambda: now)
+        arrivals = {}
+        running = []
+        idle = workers
+        next_arrival = 0
+        while next_arrival < len(workload) or running:
+            arrival_time = workload[next_arrival][0] if next_arrival < len(workload) else float("inf")
+            if not running or arrival_time <= running[0][0]:
+                now, chat_id, size = workload[next_arrival]
+                job_id = queue.enqueue("telegram", {}, chat_id, size)
+                arrivals[job_id] = (now, chat_id, size)
+                next_arrival += 1
+            else:
+                now, job_id = heapq.heappop(running)
+                queue.complete(job_id)
+                arrived, chat_id, size = arrivals.pop(job_id)
+                latencies["heavy" if chat_id == HEAVY_CHAT else "light"].append(now - arrived)
+                idle += 1
+            while idle and (job := queue.claim()) is not None:
+                idle -= 1
+                heapq.heappush(running, (now + arrivals[job.id][2] / WORKER_RATE, job.id))
+        queue.close()
+    return latencies
+
+def report(name, latencies):
+    print(name)
+    for label, values in latencies.items():
+        p95 = statistics.quantiles(values, n=20)[-1]
+        print(f"  {label:5}  median {statistics.median(values):7.1f}s  p95 {p95:7.1f}s  "
+              f"max {max(values):7.1f}s  ({len(values)} jobs)")
+
+def main(album):
+    workload = make_workload(album)
+    print(f"Album of {album} photos plus {LIGHT_CHATS} light chats, "
+          f"{DOWNLOAD_WORKERS} workers at {WORKER_RATE // MB} MB/s")
+    report("Shortest first only", simulate(workload, fair=False))
+    report("Fair per chat", simulate(workload, fair=True))
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
@@ -0,0 +1,88 @@
+"""
+Measures event-loop stall time while saving a download, with blocking
+writes on the loop (old behaviour) versus the off-loop FileWriter.
+
+The disk is simulated as DISK_RATE bytes/s by sleeping inside write(), and
+the network as a reader yielding CHUNK_SIZE chunks. A ticker task records
+how late each of its 5 ms sleeps wakes up.
+
+Usage: python benchmarks/bench_file_writer.py [chunks]
+"""
+import os
+import sys
+import time
+import asyncio
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import file_writer
+from config import CHUNK_SIZE
+from file_writer import FileWriter
+
+DISK_RATE = 1024 * 1024 * 200  # 200 MB/s
+TICK = 0.005
+
+class SlowFile:
+    def __init__(self, path, mode):
+        self._file = open(path, mode)
+
+    def write(self, data):
+        time.sleep(len(data) / DISK_RATE)
+        return self._file.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._file.close()
+
+async def network(chunks):
+    chunk = b"\0" * CHUNK_SIZE
+    for _ in range(chunks):
+        await asyncio.sleep(0)
+        yield chunk
+
+async def measure(save, file_path, chunks):
+    lags = []
+    stop = False
+
+    async def ticker():
+        while not stop:
+            start = time.perf_counter()
+            await asyncio.sleep(TICK)
+            lags.append(time.perf_counter() - start - TICK)
+
+    task = asyncio.create_task(ticker())
+    start = time.perf_counter()
+    await save(file_path, chunks)
+    elapsed = time.perf_counter() - start
+    stop = True
+    await task
+    return elapsed, max(lags), sum(lag for lag in lags if lag > TICK)
+
+async def save_blocking(file_path, chunks):
+    with SlowFile(file_path, "wb") as f:
+        async for chunk in network(chunks):
+            f.write(chunk)
+
+async def save_offloop(file_path, chunks):
+    async with FileWriter(file_path, "wb") as writer:
+        async for chunk in network(chunks):
+            await writer.write(chunk)
+
+async def main(chunks):
+    file_writer.open = SlowFile
+    with tempfile.TemporaryDirectory() as tmp:
+        file_path = os.path.join(tmp, "file.bin")
+        size_mb = chunks * CHUNK_SIZE / 1024 / 1024
+        print(f"{size_mb:.0f} MB in {CHUNK_SIZE // 1024 // 1024} MB chunks, simulated disk {DISK_RATE / 1024 / 1024:.0f} MB/s")
+        for name, save in (("Blocking writes", save_blocking), ("FileWriter", save_offloop)):
+            elapsed, max_lag, stalled = await measure(save, file_path, chunks)
+            print(f"{name:16} total {elapsed:5.2f}s  max loop stall {max_lag * 1000:7.1f} ms  time stalled {stalled:5.2f}s")
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 40))
@@ -0,0 +1,264 @@
+"""
+Load generator for the message handlers, against benchmarks/fake_telegram.py.
+
+Replays a burst of forwarded messages through the real handler
+(handlers.process_forwarded_message), album collector, job queue, workers,
+progress dashboard and outbound limiter; only Telegram itself is faked. Like
+Pyrogram's dispatcher, app.workers tasks take updates off one queue.
+
+Scenarios:
+  albums     albums of 2-10 photos from 5 chats
+  forwards   --rate forwards per minute into one private chat
+  multichat  --rate forwards per minute spread over --chats private chats, 10% albums
+  soak       multichat for 10 minutes, finished files deleted as they land
+
+Reports handler latency (and the wait for a free handler), job queue wait,
+time until the download finished, Bot API calls per completed download,
+FloodWaits and RSS growth. After the load ends the run continues until the
+queue drains or --drain-timeout passes; what didn't finish is reported.
+Everything runs in a temporary HOME.
+
+Usage: python benchmarks/bench_handlers.py SCENARIO [--duration S] [--rate N] [--chats N]
+                                                    [--flood-rate P] [--flood-seconds S]
+                                                    [--drain-timeout S] [--json results.json]
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import asyncio
+import logging
+import argparse
+import tempfile
+import contextlib
+from collections import defaultdict
+
+# Point config at a throwaway home before anything imports it
+_home = tempfile.mkdtemp(prefix="bench_handlers_")
+os.environ["HOME"] = _home
+
+import psutil
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import BASE_DOWNLOAD_FOLDER
+import album
+import workers
+from handlers import app, process_forwarded_message
+from fake_telegram import FakeClient, MB
+
+KB = 1024
+RSS_INTERVAL = 5  # Seconds between RSS samples
+ALBUM_ITEM_GAP = 0.05  # Seconds between the updates of one album
+
+# name: (default duration, chats, share of albums, updates per minute); None means the command-line value
+SCENARIOS = {
+    "albums": (20, 5, 1.0, 30),
+    "forwards": (60, 1, 0.0, None),
+    "multichat": (60, None, 0.1, None),
+    "soak": (600, None, 0.1, None),
+}
+
+class Stats:
+    def __init__(self):
+        self.arrived = {}
+        self.submitted = {}
+        self.dispatch_wait = []
+        self.handler_latency = []
+        self.queue_wait = defaultdict(list)
+        self.end_to_end = []
+        self.handling = 0
+        self.completed = 0
+        self.failed = 0
+        self.rss = []
+
+def percentiles(values):
+    if not values:
+        return {"p50": None, "p95": None, "max": None}
+    values = sorted(values)
+    pick = lambda p: round(values[min(len(values) - 1, int(p * len(values)))] * 1000, 1)
+    return {"p50": pick(0.5), "p95": pick(0.95), "max": round(values[-1] * 1000, 1)}
+
+def schedule(client, rng, duration, rate, chats, album_share):
+    """Returns [(arrival offset, message)] for duration seconds of load."""
+    chat_ids = [1000 + i for i in range(chats)]
+    updates = []
+    interval = 60 / rate
+    for n in range(int(duration / interval)):
+        at = n * interval
+        chat_id = rng.choice(chat_ids)
+        if rng.random() < album_share:
+            group = f"g{n}"
+            for item in range(rng.randint(2, 10)):
+                message = client.new_message(chat_id, "photo", rng.randint(100 * KB, 5 * MB), media_group_id=group)
+                updates.append((at + item * ALBUM_ITEM_GAP, message))
+        elif rng.random() < 0.05:
+            updates.append((at, client.new_message(chat_id, "video", rng.randint(20 * MB, 100 * MB))))
+        else:
+            updates.append((at, client.new_message(chat_id, "photo", rng.randint(100 * KB, 5 * MB))))
+    return sorted(updates, key=lambda update: update[0])
+
+def instrument(stats):
+    """Times job submission and the job runners, without changing what they do."""
+    submit = workers.submit
+
+    def timed_submit(kind, payload, message, size=None):
+        job_id = submit(kind, payload, message, size)
+        stats.submitted[job_id] = time.monotonic()
+        return job_id
+
+    def timed(runner):
+        async def run(client, job, message):
+            started = time.monotonic()
+            stats.queue_wait[job.kind].append(started - stats.submitted.get(job.id, started))
+            result = await runner(client, job, message)
+            finished = time.monotonic()
+            message_ids = job.payload.get("message_ids", [job.payload["message_id"]])
+            if result is False:
+                stats.failed += len(message_ids)
+            else:
+                stats.completed += len(message_ids)
+            arrived = min(stats.arrived.get((job.chat_id, m), finished) for m in message_ids)
+            stats.end_to_end.append(finished - arrived)
+            return result
+        return run
+
+    workers.submit = timed_submit
+    for kind, runner in list(workers.JOB_RUNNERS.items()):
+        workers.JOB_RUNNERS[kind] = timed(runner)
+
+async def dispatcher(client, updates, stats):
+    """Runs handlers like Pyrogram's dispatcher: app.workers tasks sharing one update queue."""
+    while True:
+        arrived, message = await updates.get()
+        stats.handling += 1
+        started = time.monotonic()
+        stats.dispatch_wait.append(started - arrived)
+        try:
+            await process_forwarded_message(client, message)
+        finally:
+            stats.handler_latency.append(time.monotonic() - started)
+            stats.handling -= 1
+
+async def feed(updates, load, stats):
+    start = time.monotonic()
+    for at, message in load:
+        delay = start + at - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        now = time.monotonic()
+        stats.arrived[(message.chat.id, message.id)] = now
+        updates.put_nowait((now, message))
+
+async def sample_rss(stats, clean):
+    process = psutil.Process()
+    while True:
+        stats.rss.append(process.memory_info().rss)
+        if clean:
+            # Keep the disk from filling up during long runs; .partial holds unfinished downloads
+            for entry in os.scandir(BASE_DOWNLOAD_FOLDER):
+                if entry.is_file():
+                    os.remove(entry.path)
+        await asyncio.sleep(RSS_INTERVAL)
+
+def busy(updates, stats):
+    counts = workers.job_queue.counts()
+    return updates.qsize() or stats.handling or album._pending or counts.get("queued") or counts.get("running")
+
+async def main(args):
+    duration, chats, album_share, rate = SCENARIOS[args.scenario]
+    duration = args.duration or duration
+    chats = chats or args.chats
+    rate = rate or args.rate
+
+    client = FakeClient(flood_rate=args.flood_rate, flood_seconds=args.flood_seconds)
+    stats = Stats()
+    instrument(stats)
+    load = schedule(client, random.Random(1), duration, rate, chats, album_share)
+    updates = asyncio.Queue()
+
+    workers.start_workers(client)
+    handlers = [asyncio.create_task(dispatcher(client, updates, stats)) for _ in range(app.workers)]
+    sampler = asyncio.create_task(sample_rss(stats, clean=args.scenario == "soak"))
+    start = time.monotonic()
+    await feed(updates, load, stats)
+    load_end = time.monotonic()
+    while busy(updates, stats) and time.monotonic() - load_end < args.drain_timeout:
+        await asyncio.sleep(0.5)
+    elapsed = time.monotonic() - start
+    drained = not busy(updates, stats)
+    stats.rss.append(psutil.Process().memory_info().rss)
+
+    counts = workers.job_queue.counts()
+    for task in handlers + [sampler]:
+        task.cancel()
+    await asyncio.gather(*handlers, sampler, return_exceptions=True)
+    await workers.stop_workers()
+
+    sent = sum(client.calls[name] for name in ("SendMessage", "EditMessage"))
+    return {
+        "scenario": args.scenario,
+        "updates": len(load),
+        "duration_s": duration,
+        "elapsed_s": round(elapsed, 1),
+        "drained": drained,
+        "completed_files": stats.completed,
+        "failed_files": stats.failed,
+        "jobs_left": {status: n for status, n in counts.items() if status != "done"},
+        "dispatch_wait_ms": percentiles(stats.dispatch_wait),
+        "handler_latency_ms": percentiles(stats.handler_latency),
+        "queue_wait_ms": {kind: percentiles(values) for kind, values in stats.queue_wait.items()},
+        "end_to_end_ms": percentiles(stats.end_to_end),
+        "api_calls": dict(client.calls),
+        "api_calls_per_download": round(sent / stats.completed, 2) if stats.completed else None,
+        "flood_waits": client.flood_waits,
+        "downloaded_mb": round(client.bytes_sent / MB, 1),
+        "rss_mb": {
+            "start": round(stats.rss[0] / MB, 1),
+            "peak": round(max(stats.rss) / MB, 1),
+            "end": round(stats.rss[-1] / MB, 1),
+            "growth": round((stats.rss[-1] - stats.rss[0]) / MB, 1),
+        },
+    }
+
+def print_results(r):
+    print(f"Scenario {r['scenario']}: {r['updates']} updates over {r['duration_s']}s, "
+          f"finished after {r['elapsed_s']}s{'' if r['drained'] else ' (drain timeout)'}")
+    print(f"Downloads: {r['completed_files']} completed, {r['failed_files']} failed, "
+          f"{r['downloaded_mb']} MB; jobs left: {r['jobs_left'] or 'none'}")
+    print(f"{'latency (ms)':<22} {'p50':>9} {'p95':>9} {'max':>9}")
+    rows = [("wait for handler", r["dispatch_wait_ms"]), ("handler", r["handler_latency_ms"])]
+    rows += [(f"queue wait ({kind})", values) for kind, values in r["queue_wait_ms"].items()]
+    rows.append(("arrival to finished", r["end_to_end_ms"]))
+    for name, values in rows:
+        print(f"{name:<22} " + " ".join(f"{values[p] if values[p] is not None else '-':>9}" for p in ("p50", "p95", "max")))
+    print(f"Bot API calls: {r['api_calls']}, {r['api_calls_per_download']} sends/edits per download, "
+          f"{r['flood_waits']} FloodWaits")
+    rss = r["rss_mb"]
+    print(f"RSS: {rss['start']} MB at start, {rss['peak']} MB peak, {rss['end']} MB at end ({rss['growth']:+} MB)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test of the message handlers against a fake Telegram")
+    parser.add_argument("scenario", choices=SCENARIOS)
+    parser.add_argument("--duration", type=float, help="seconds of load (default depends on the scenario)")
+    parser.add_argument("--rate", type=float, default=1000, help="forwards per minute (default 1000)")
+    parser.add_argument("--chats", type=int, default=20, help="chats for multichat and soak (default 20)")
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="share of Bot API calls answered with FloodWait")
+    parser.add_argument("--flood-seconds", type=int, default=3, help="length of injected FloodWaits")
+    parser.add_argument("--drain-timeout", type=float, default=300, help="seconds to wait for the queue to drain")
+    parser.add_argument("--json", metavar="PATH", help="write machine-readable results")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    try:
+        # download.py prints debug lines per download
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            results = asyncio.run(main(args))
+    finally:
+        shutil.rmtree(_home, ignore_errors=True)
+    print_results(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
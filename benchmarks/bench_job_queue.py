@@ -0,0 +1,37 @@
+"""
+Measures enqueue/claim/complete throughput of the durable SQLite job queue.
+
+Usage: python benchmarks/bench_job_queue.py [jobs]
+"""
+import os
+import sys
+import time
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from job_queue import JobQueue
+
+def main(jobs):
+    with tempfile.TemporaryDirectory() as tmp:
+        queue = JobQueue(os.path.join(tmp, "jobs.db"))
+        payload = {"media_type": "photo", "file_unique_id": "AQADxxxxxxxxxxxx", "chat_id": 123456789, "message_id": 1}
+
+        start = time.perf_counter()
+        for _ in range(jobs):
+            queue.enqueue("telegram", payload, 123456789)
+        enqueue_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        while (job := queue.claim()) is not None:
+            queue.complete(job.id)
+        drain_time = time.perf_counter() - start
+
+        queue.close()
+
+    print(f"{jobs} jobs")
+    print(f"Enqueue:          {enqueue_time:6.2f}s  {jobs / enqueue_time:8.0f} jobs/s")
+    print(f"Claim + complete: {drain_time:6.2f}s  {jobs / drain_time:8.0f} jobs/s")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,95 @@
+"""
+Benchmarks the segmented Range downloader against a single stream.
+
+Starts a local range-capable aiohttp server that caps every connection at
+STREAM_RATE bytes/s (simulating a high-latency mirror where one TCP stream
+can't fill the link) and downloads the same file both ways.
+
+Usage: python benchmarks/bench_range_download.py [size_mb] [segments]
+"""
+import os
+import sys
+import time
+import asyncio
+import tempfile
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from http_session import get_session, close_session
+from range_download import download_ranges, split_ranges
+
+STREAM_RATE = 1024 * 1024 * 8  # 8 MB/s per connection
+BLOCK_SIZE = 256 * 1024
+
+async def serve_file(request):
+    data = request.app["data"]
+    total = len(data)
+    start, end = 0, total - 1
+    status = 200
+    if request.http_range.start is not None or request.http_range.stop is not None:
+        rng = request.http_range
+        start = rng.start or 0
+        end = (rng.stop or total) - 1
+        status = 206
+
+    response = web.StreamResponse(status=status)
+    response.headers["Accept-Ranges"] = "bytes"
+    response.headers["ETag"] = '"bench"'
+    response.content_length = end - start + 1
+    if status == 206:
+        response.headers["Content-Range"] = f"bytes {start}-{end}/{total}"
+    await response.prepare(request)
+    position = start
+    while position <= end:
+        block = data[position:min(position + BLOCK_SIZE, end + 1)]
+        await response.write(block)
+        position += len(block)
+        await asyncio.sleep(len(block) / STREAM_RATE)
+    return response
+
+async def single_stream(url, file_path):
+    async with get_session().get(url) as response:
+        with open(file_path, "wb") as f:
+            async for chunk in response.content.iter_chunked(1024 * 1024):
+                f.write(chunk)
+
+async def main(size_mb, segments):
+    app = web.Application()
+    app["data"] = os.urandom(size_mb * 1024 * 1024)
+    app.router.add_get("/file", serve_file)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    url = f"http://127.0.0.1:{port}/file"
+    total = len(app["data"])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        file_path = os.path.join(tmp, "file.bin")
+
+        start = time.perf_counter()
+        await single_stream(url, file_path)
+        single_time = time.perf_counter() - start
+
+        with open(file_path, "wb") as f:
+            f.truncate(total)
+        start = time.perf_counter()
+        await download_ranges(url, file_path, split_ranges(total, segments), '"bench"')
+        ranged_time = time.perf_counter() - start
+
+        with open(file_path, "rb") as f:
+            assert f.read() == app["data"], "segmented download corrupted the file"
+
+    await close_session()
+    await runner.cleanup()
+
+    print(f"File size: {size_mb} MB, per-connection cap: {STREAM_RATE / 1024 / 1024:.0f} MB/s")
+    print(f"Single stream:      {single_time:6.2f}s  {size_mb / single_time:7.1f} MB/s")
+    print(f"{segments} range segments: {ranged_time:6.2f}s  {size_mb / ranged_time:7.1f} MB/s")
+
+if __name__ == "__main__":
+    size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    segments = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    asyncio.run(main(size_mb, segments))
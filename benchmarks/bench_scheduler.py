@@ -0,0 +1,90 @@
+"""
+Compares completion latency of FIFO scheduling with the size-aware job queue
+(shortest first with aging, plus a capped large-file lane). The simulated user forwards batches of media every ten minutes:
+mostly photos, a few large videos, in random order.
+
+Each worker downloads at a fixed rate; time is simulated, the real JobQueue
+decides which job runs next. FIFO is the same queue in arrival order with
+every worker allowed to take large jobs.
+
+Usage: python benchmarks/bench_scheduler.py [jobs]
+"""
+import os
+import sys
+import heapq
+import random
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import DOWNLOAD_WORKERS, LARGE_LANE_SLOTS
+from job_queue import JobQueue
+
+MB = 1024 * 1024
+WORKER_RATE = 10 * MB  # Bytes per second per worker
+LARGE_SHARE = 0.06  # Fraction of jobs that are large videos
+BATCH_SIZE = 200  # Jobs forwarded at once
+BATCH_INTERVAL = 600  # Seconds between batches
+
+def make_workload(jobs, seed=1):
+    """Returns [(arrival time, size)]; each batch arrives over 30 seconds."""
+    rng = random.Random(seed)
+    workload = []
+    for i in range(jobs):
+        now = (i // BATCH_SIZE) * BATCH_INTERVAL + rng.uniform(0, 30)
+        if rng.random() < LARGE_SHARE:
+            size = rng.randint(500 * MB, 4096 * MB)
+        else:
+            size = rng.randint(100 * 1024, 5 * MB)
+        workload.append((now, size))
+    return sorted(workload)
+
+def simulate(workload, workers=DOWNLOAD_WORKERS, **policy):
+    """Returns the completion latencies of the small and large jobs."""
+    latencies = {"small": [], "large": []}
+    now = 0.0
+    with tempfile.TemporaryDirectory() as tmp:
+        queue = JobQueue(os.path.join(tmp, "jobs.db"), clock=lambda: now, **policy)
+        arrivals = {}
+        running = []
+        idle = workers
+        next_arrival = 0
+        while next_arrival < len(workload) or running:
+            arrival_time = workload[next_arrival][0] if next_arrival < len(workload) else float("inf")
+            if not running or arrival_time <= running[0][0]:
+                now, size = workload[next_arrival]
+                job_id = queue.enqueue("telegram", {}, size=size)
+                arrivals[job_id] = (now, size)
+                next_arrival += 1
+            else:
+                now, job_id = heapq.heappop(running)
+                queue.complete(job_id)
+                arrived, size = arrivals.pop(job_id)
+                latencies[queue.lane_for(size)].append(now - arrived)
+                idle += 1
+            while idle and (job := queue.claim()) is not None:
+                idle -= 1
+                heapq.heappush(running, (now + arrivals[job.id][1] / WORKER_RATE, job.id))
+        queue.close()
+    return latencies
+
+def p95(values):
+    return statistics.quantiles(values, n=20)[-1]
+
+def report(name, latencies):
+    every = latencies["small"] + latencies["large"]
+    print(f"{name}")
+    for label, values in (("all", every), ("small", latencies["small"]), ("large", latencies["large"])):
+        print(f"  {label:5}  median {statistics.median(values):8.1f}s  p95 {p95(values):8.1f}s  ({len(values)} jobs)")
+
+def main(jobs):
+    workload = make_workload(jobs)
+    print(f"{jobs} jobs, {DOWNLOAD_WORKERS} workers at {WORKER_RATE // MB} MB/s, "
+          f"{LARGE_SHARE:.0%} large, batches of {BATCH_SIZE} every {BATCH_INTERVAL}s")
+    report("FIFO", simulate(workload, large_lane_slots=DOWNLOAD_WORKERS, shortest_first=False))
+    report("Shortest first", simulate(workload, large_lane_slots=DOWNLOAD_WORKERS))
+    report(f"Shortest first + {LARGE_LANE_SLOTS} large slots", simulate(workload))
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,74 @@
+"""
+Benchmarks parallel Telegram offset ranges against a single stream_media transfer.
+
+The fake client answers stream_media like Pyrogram: one upload.GetFile request
+per 1 MB chunk, each costing a round trip plus the chunk's transfer time on its
+own connection, with at most MAX_TRANSMISSIONS transfers at once. A single
+transfer therefore can't fill the link, as with a real DC far away.
+
+Usage: python benchmarks/bench_telegram_ranges.py [size_mb] [segments]
+"""
+import os
+import sys
+import time
+import asyncio
+import hashlib
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import TELEGRAM_CHUNK_SIZE, MAX_CONCURRENT_TRANSMISSIONS
+from range_download import split_ranges
+from telegram_ranges import download_telegram_ranges
+
+ROUND_TRIP = 0.03  # Seconds per GetFile request
+CONNECTION_RATE = 1024 * 1024 * 20  # 20 MB/s per MTProto connection
+
+def chunk_data(index):
+    """Deterministic content of chunk index, so the result can be checked."""
+    return hashlib.sha256(str(index).encode()).digest() * (TELEGRAM_CHUNK_SIZE // 32)
+
+class FakeClient:
+    def __init__(self, file_size, transmissions=MAX_CONCURRENT_TRANSMISSIONS):
+        self.file_size = file_size
+        self.semaphore = asyncio.Semaphore(transmissions)
+
+    async def stream_media(self, media, limit=0, offset=0):
+        chunks = -(-self.file_size // TELEGRAM_CHUNK_SIZE)
+        last = min(chunks, offset + limit) if limit else chunks
+        async with self.semaphore:
+            for index in range(offset, last):
+                data = chunk_data(index)[:self.file_size - index * TELEGRAM_CHUNK_SIZE]
+                await asyncio.sleep(ROUND_TRIP + len(data) / CONNECTION_RATE)
+                yield data
+
+async def timed_download(client, file_path, ranges):
+    with open(file_path, "wb") as f:
+        f.truncate(client.file_size)
+    start = time.perf_counter()
+    await download_telegram_ranges(client, "file_id", file_path, ranges)
+    return time.perf_counter() - start
+
+async def main(size_mb, segments):
+    total = size_mb * 1024 * 1024
+    client = FakeClient(total)
+    expected = hashlib.sha256(b"".join(
+        chunk_data(i) for i in range(-(-total // TELEGRAM_CHUNK_SIZE))
+    )[:total]).hexdigest()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        file_path = os.path.join(tmp, "file.bin")
+        single_time = await timed_download(client, file_path, [[0, total - 1]])
+        ranged_time = await timed_download(client, file_path, split_ranges(total, segments))
+        with open(file_path, "rb") as f:
+            assert hashlib.sha256(f.read()).hexdigest() == expected, "segmented download corrupted the file"
+
+    print(f"File size: {size_mb} MB, {ROUND_TRIP * 1000:.0f} ms per request, "
+          f"{CONNECTION_RATE / 1024 / 1024:.0f} MB/s per connection")
+    print(f"Single stream:      {single_time:6.2f}s  {size_mb / single_time:7.1f} MB/s")
+    print(f"{segments} range segments: {ranged_time:6.2f}s  {size_mb / ranged_time:7.1f} MB/s")
+
+if __name__ == "__main__":
+    size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 128
+    segments = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    asyncio.run(main(size_mb, segments))
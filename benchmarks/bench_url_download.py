@@ -0,0 +1,325 @@
+"""
+Offline benchmark of the URL download path (download.download_from_url).
+
+A local aiohttp server, running in its own thread so it doesn't show up as
+event-loop lag, serves synthetic content:
+  /file/<name>?size=N[&chunked=1][&rate=B]  generated bytes, range-capable unless
+                                             chunked (no Content-Length); rate caps
+                                             each response at B bytes/s
+  /flaky/<name>?size=N                       drops the connection a third of the way
+                                             into the first response for each range
+  /gallery/<name>?n=N&size=S                 HTML page with N <img> links
+  /telegra.ph/<name>?n=N&size=S              Telegra.ph-shaped article page
+
+Each scenario drives download_from_url with a fake message and reports
+throughput, time to first byte, peak RSS, event-loop lag and request count.
+Downloads go to a temporary HOME, so nothing touches the real download folder.
+
+Usage: python benchmarks/bench_url_download.py [--full] [--only NAME ...]
+                                               [--json results.json] [--compare baseline.json]
+--full adds the 1 GB and 5 GB files. --json writes machine-readable results;
+--compare prints the change against results saved from another version.
+"""
+import os
+import sys
+import json
+import time
+import zlib
+import shutil
+import logging
+import asyncio
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+
+# Point config at a throwaway home before anything imports it
+_home = tempfile.mkdtemp(prefix="bench_url_")
+os.environ["HOME"] = _home
+
+import psutil
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import BASE_DOWNLOAD_FOLDER, PARTIAL_FOLDER
+from download import download_from_url
+from http_session import close_session
+
+KB = 1024
+MB = 1024 * KB
+PATTERN = os.urandom(MB)
+WRITE_SIZE = 256 * KB
+LAG_INTERVAL = 0.01  # Seconds between event-loop lag probes
+
+# (name, path, expected files) -- sizes in the query string
+SCENARIOS = [
+    ("file_1k", "/file/f1k.bin?size=1024", 1),
+    ("file_1m", "/file/f1m.bin?size=1048576", 1),
+    ("file_100m", "/file/f100m.bin?size=104857600", 1),
+    ("file_100m_chunked", "/file/f100mc.bin?size=104857600&chunked=1", 1),
+    ("slow_8m", "/file/slow.bin?size=8388608&rate=4194304", 1),
+    ("flaky_100m", "/flaky/flaky.bin?size=104857600", 1),
+    ("gallery_50", "/gallery/g50.html?n=50&size=204800", 50),
+    ("telegraph_20", "/telegra.ph/t20?n=20&size=1048576", 20)
+]
+FULL_SCENARIOS = [
+    ("file_1g", "/file/f1g.bin?size=1073741824", 1),
+    ("file_5g", "/file/f5g.bin?size=5368709120", 1)
+]
+
+class Stats:
+    """Server-side counters, reset for every scenario."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.requests = 0
+        self.first_byte = None
+        self.flaky_dropped = set()
+
+def content(name, start, end):
+    """Yields the bytes [start, end] of synthetic file name; different names differ, so dedup never merges them."""
+    shift = zlib.crc32(name.encode()) % len(PATTERN)
+    position = start
+    while position <= end:
+        offset = (position + shift) % len(PATTERN)
+        size = min(WRITE_SIZE, end + 1 - position, len(PATTERN) - offset)
+        yield PATTERN[offset:offset + size]
+        position += size
+
+async def send_file(request, name, size, chunked=False, rate=None, drop_at=None):
+    stats = request.app["stats"]
+    start, end, status = 0, size - 1, 200
+    if not chunked and (request.http_range.start is not None or request.http_range.stop is not None):
+        start = request.http_range.start or 0
+        end = (request.http_range.stop or size) - 1
+        status = 206
+    response = web.StreamResponse(status=status)
+    response.content_type = "application/octet-stream"
+    if chunked:
+        response.enable_chunked_encoding()
+    else:
+        response.headers["Accept-Ranges"] = "bytes"
+        response.headers["ETag"] = f'"{name}-{size}"'
+        response.content_length = end - start + 1
+        if status == 206:
+            response.headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    await response.prepare(request)
+    sent = 0
+    for block in content(name, start, end):
+        if stats.first_byte is None:
+            stats.first_byte = time.perf_counter()
+        if drop_at is not None and sent >= drop_at:
+            request.transport.close()
+            return response
+        await response.write(block)
+        sent += len(block)
+        if rate:
+            await asyncio.sleep(len(block) / rate)
+    return response
+
+async def serve_file(request):
+    query = request.query
+    return await send_file(
+        request, request.match_info["name"], int(query["size"]),
+        chunked=query.get("chunked") == "1", rate=float(query["rate"]) if "rate" in query else None
+    )
+
+async def serve_flaky(request):
+    name = request.match_info["name"]
+    size = int(request.query["size"])
+    # Once per segment: a retry resumes the same segment, so it keeps its end
+    end = request.http_range.stop
+    drop_at = None
+    if (name, end) not in request.app["stats"].flaky_dropped:
+        request.app["stats"].flaky_dropped.add((name, end))
+        drop_at = ((end or size) - (request.http_range.start or 0)) // 3
+    return await send_file(request, name, size, drop_at=drop_at)
+
+async def serve_gallery(request, telegraph=False):
+    stats = request.app["stats"]
+    if stats.first_byte is None:
+        stats.first_byte = time.perf_counter()
+    name = request.match_info["name"]
+    count, size = int(request.query["n"]), int(request.query["size"])
+    base = f"http://{request.host}"
+    images = [f"{base}/file/{name}_{i}.jpg?size={size}" for i in range(count)]
+    if telegraph:
+        body = "".join(f'<figure><img src="{src}"><figcaption></figcaption></figure>' for src in images)
+        html = f"<html><head><title>{name}</title></head><body><article class=\"tl_article_content\"><h1>{name}</h1>{body}</article></body></html>"
+    else:
+        html = "<html><body>" + "".join(f'<p><img src="{src}"></p>' for src in images) + "</body></html>"
+    return web.Response(text=html, content_type="text/html")
+
+@web.middleware
+async def count_requests(request, handler):
+    request.app["stats"].requests += 1
+    return await handler(request)
+
+def start_server():
+    """Runs the test server on its own thread and loop. Returns (base url, stats)."""
+    # Dropped connections are the point of some scenarios; don't log them as server errors
+    logging.getLogger("aiohttp.server").setLevel(logging.CRITICAL)
+    stats = Stats()
+    ready = threading.Event()
+    address = {}
+
+    def run():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        app = web.Application(middlewares=[count_requests])
+        app["stats"] = stats
+        app.router.add_get("/file/{name}", serve_file)
+        app.router.add_get("/flaky/{name}", serve_flaky)
+        app.router.add_get("/gallery/{name}", serve_gallery)
+        app.router.add_get("/telegra.ph/{name}", lambda request: serve_gallery(request, telegraph=True))
+        runner = web.AppRunner(app)
+        loop.run_until_complete(runner.setup())
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        loop.run_until_complete(site.start())
+        address["port"] = site._server.sockets[0].getsockname()[1]
+        ready.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    ready.wait()
+    return f"http://127.0.0.1:{address['port']}", stats
+
+class FakeChat:
+    id = 1
+
+class FakeMessage:
+    """Stands in for a Pyrogram message: records what the bot would have sent."""
+
+    def __init__(self, log):
+        self.log = log
+        self.chat = FakeChat()
+        self.id = len(log) + 1
+
+    async def reply(self, text, **kwargs):
+        self.log.append(text)
+        return FakeMessage(self.log)
+
+    async def edit_text(self, text, **kwargs):
+        self.log.append(text)
+        return self
+
+async def monitor(samples):
+    """Samples event-loop lag and RSS until cancelled."""
+    process = psutil.Process()
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(LAG_INTERVAL)
+        samples["lag"].append(max(0.0, time.perf_counter() - start - LAG_INTERVAL))
+        samples["rss"] = max(samples["rss"], process.memory_info().rss)
+
+def downloaded_bytes():
+    total = files = 0
+    for root, dirs, names in os.walk(BASE_DOWNLOAD_FOLDER):
+        if root == BASE_DOWNLOAD_FOLDER and os.path.basename(PARTIAL_FOLDER) in dirs:
+            dirs.remove(os.path.basename(PARTIAL_FOLDER))
+        for name in names:
+            total += os.path.getsize(os.path.join(root, name))
+            files += 1
+    return total, files
+
+def clear_downloads():
+    for name in os.listdir(BASE_DOWNLOAD_FOLDER):
+        path = os.path.join(BASE_DOWNLOAD_FOLDER, name)
+        if path != PARTIAL_FOLDER:
+            shutil.rmtree(path) if os.path.isdir(path) else os.remove(path)
+
+async def run_scenario(base_url, stats, name, path, expected_files):
+    clear_downloads()
+    stats.reset()
+    samples = {"lag": [], "rss": psutil.Process().memory_info().rss}
+    log = []
+    monitor_task = asyncio.create_task(monitor(samples))
+    start = time.perf_counter()
+    await download_from_url(FakeMessage(log), base_url + path)
+    elapsed = time.perf_counter() - start
+    monitor_task.cancel()
+    size, files = downloaded_bytes()
+    lag = sorted(samples["lag"]) or [0.0]
+    return {
+        "scenario": name,
+        "ok": files == expected_files,
+        "files": files,
+        "bytes": size,
+        "seconds": round(elapsed, 3),
+        "throughput_mb_s": round(size / MB / elapsed, 2),
+        "ttfb_ms": round((stats.first_byte - start) * 1000, 1) if stats.first_byte else None,
+        "peak_rss_mb": round(samples["rss"] / MB, 1),
+        "loop_lag_max_ms": round(lag[-1] * 1000, 2),
+        "loop_lag_p99_ms": round(lag[min(len(lag) - 1, int(len(lag) * 0.99))] * 1000, 2),
+        "requests": stats.requests,
+        "last_message": log[-1].splitlines()[0] if log else None
+    }
+
+def version():
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+def print_results(results):
+    print(f"{'scenario':20} {'ok':3} {'MB/s':>8} {'TTFB ms':>8} {'RSS MB':>7} {'lag max':>8} {'lag p99':>8} {'reqs':>5}")
+    for r in results:
+        print(f"{r['scenario']:20} {'yes' if r['ok'] else 'NO':3} {r['throughput_mb_s']:8.1f} "
+              f"{r['ttfb_ms'] if r['ttfb_ms'] is not None else '-':>8} {r['peak_rss_mb']:7.1f} "
+              f"{r['loop_lag_max_ms']:8.2f} {r['loop_lag_p99_ms']:8.2f} {r['requests']:5}")
+
+def print_comparison(results, baseline_path):
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {r["scenario"]: r for r in json.load(f)["results"]}
+    print(f"\nChange against {baseline_path}:")
+    for r in results:
+        old = baseline.get(r["scenario"])
+        if not old:
+            continue
+        changes = []
+        for key in ("throughput_mb_s", "peak_rss_mb", "loop_lag_p99_ms", "requests"):
+            if old[key]:
+                changes.append(f"{key} {(r[key] - old[key]) / old[key] * 100:+.0f}%")
+        print(f"  {r['scenario']:20} " + "  ".join(changes))
+
+async def main(args):
+    base_url, stats = start_server()
+    scenarios = SCENARIOS + (FULL_SCENARIOS if args.full else [])
+    if args.only:
+        scenarios = [s for s in scenarios if s[0] in args.only]
+    results = []
+    try:
+        for scenario in scenarios:
+            results.append(await run_scenario(base_url, stats, *scenario))
+            print(f"  {scenario[0]}: {results[-1]['seconds']}s", file=sys.stderr)
+    finally:
+        await close_session()
+    print_results(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({
+                "version": version(),
+                "python": platform.python_version(),
+                "timestamp": time.time(),
+                "results": results
+            }, f, indent=2)
+    if args.compare:
+        print_comparison(results, args.compare)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmark of URL downloads")
+    parser.add_argument("--full", action="store_true", help="also download the 1 GB and 5 GB files")
+    parser.add_argument("--only", nargs="+", metavar="NAME", help="run only these scenarios")
+    parser.add_argument("--json", metavar="PATH", help="write machine-readable results")
+    parser.add_argument("--compare", metavar="PATH", help="compare with results from --json")
+    try:
+        asyncio.run(main(parser.parse_args()))
+    finally:
+        shutil.rmtree(_home, ignore_errors=True)
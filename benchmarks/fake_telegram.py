@@ -0,0 +1,208 @@
+"""
+In-process fake of the Pyrogram surface the bot uses, for benchmarks.
+
+FakeClient answers Bot API calls and file downloads from memory, with simulated
+latency and bandwidth, and can inject FloodWait. It subclasses the bot's
+RateLimitedClient, so every reply and edit_text still goes through the real
+outbound limiter (priorities, merged edits, FloodWait pauses) and Pyrogram's own
+Client.invoke and Session.invoke, including the sleep_threshold check that
+decides whether a FloodWait is slept through or raised. Only Session.send, the
+network round trip at the bottom, is faked.
+
+FakeMessage covers what handlers.py, message_handler.py and download.py read
+and call: chat, id, text, photo/video/document, media_group_id, forward_date,
+from_user, reply, edit_text and download.
+"""
+import os
+import time
+import zlib
+import random
+import asyncio
+import itertools
+from collections import Counter
+from pyrogram import errors, raw
+from pyrogram.session import Session
+
+from config import BASE_DOWNLOAD_FOLDER, TELEGRAM_CHUNK_SIZE
+from rate_limit import RateLimitedClient
+
+MB = 1024 * 1024
+PATTERN = os.urandom(TELEGRAM_CHUNK_SIZE)
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+
+class FakeChat:
+    def __init__(self, chat_id):
+        self.id = chat_id
+        self.type = "private" if chat_id > 0 else "group"
+
+class FakeMedia:
+    """A photo, video or document as Pyrogram describes it."""
+
+    def __init__(self, file_id, size, file_name=None, mime_type=None):
+        self.file_id = file_id
+        self.file_unique_id = f"u{file_id}"
+        self.file_size = size
+        self.file_name = file_name
+        self.mime_type = mime_type
+        self.width = 1280
+        self.height = 720
+
+class FakeMessage:
+    def __init__(self, client, chat_id, message_id, text=None, photo=None, video=None, document=None,
+                 media_group_id=None, forwarded=False):
+        self._client = client
+        self.chat = FakeChat(chat_id)
+        self.from_user = FakeUser(abs(chat_id))
+        self.id = message_id
+        self.text = text
+        self.caption = None
+        self.photo = photo
+        self.video = video
+        self.document = document
+        self.audio = None
+        self.media_group_id = media_group_id
+        self.forward_date = time.time() if forwarded else None
+        self.forward_from = self.from_user if forwarded else None
+        self.forward_from_chat = None
+        self.empty = False
+
+    async def reply(self, text, quote=None, **kwargs):
+        return await self._client.send_text(self.chat.id, text)
+
+    async def edit_text(self, text, **kwargs):
+        await self._client.edit_text(self.chat.id, self.id, text)
+        self.text = text
+        return self
+
+    async def download(self, file_name=None, **kwargs):
+        media = self.video or self.document or self.photo
+        path = file_name or os.path.join(BASE_DOWNLOAD_FOLDER, media.file_name or media.file_id)
+        with open(path, "wb") as f:
+            async for chunk in self._client.stream_media(self):
+                f.write(chunk)
+        return path
+
+class _FakeSession(Session):
+    """A connected Session whose send() answers from memory: latency, counters and injected FloodWait."""
+
+    def __init__(self, client):
+        # Session.invoke only needs these; nothing is connected
+        self.client = client
+        self.is_started = asyncio.Event()
+        self.is_started.set()
+
+    async def send(self, query, wait_response=True, timeout=Session.WAIT_TIMEOUT):
+        client = self.client
+        if isinstance(query, raw.functions.InvokeWithoutUpdates):
+            query = query.query
+        client.calls[type(query).__name__] += 1
+        await asyncio.sleep(client.api_latency)
+        peer = getattr(query, "peer", None)
+        chat_id = getattr(peer, "user_id", None) or -getattr(peer, "chat_id", 0)
+        flood = client._floods.pop(chat_id, None)
+        if flood is None and client.flood_rate and client._random.random() < client.flood_rate:
+            flood = client.flood_seconds
+        if flood:
+            client.flood_waits += 1
+            raise errors.FloodWait(value=flood)
+        return True
+
+class FakeClient(RateLimitedClient):
+    """
+    api_latency: seconds per Bot API call.
+    bandwidth / chunk_latency: bytes per second and extra seconds per 1 MB
+    chunk of one file transfer (like one upload.GetFile request each).
+    flood_rate: probability that a Bot API call fails with FloodWait of
+    flood_seconds; flood_next() forces one in a given chat.
+    """
+
+    def __init__(self, api_latency=0.05, bandwidth=10 * MB, chunk_latency=0.03,
+                 flood_rate=0.0, flood_seconds=5, seed=1):
+        super().__init__("fake", api_id=1, api_hash="fake", in_memory=True, no_updates=True)
+        self.session = _FakeSession(self)
+        self.is_connected = True
+        self.api_latency = api_latency
+        self.bandwidth = bandwidth
+        self.chunk_latency = chunk_latency
+        self.flood_rate = flood_rate
+        self.flood_seconds = flood_seconds
+        self.calls = Counter()
+        self.flood_waits = 0
+        self.bytes_sent = 0
+        self._floods = {}
+        self._random = random.Random(seed)
+        self._ids = itertools.count(1)
+        self._files = itertools.count(1)
+        # Incoming messages, for get_messages
+        self._messages = {}
+
+    async def fetch_peers(self, peers):
+        # Answers carry no users or chats to store
+        return False
+
+    def flood_next(self, chat_id, seconds):
+        """Makes the next Bot API call in chat_id fail with FloodWait(seconds)."""
+        self._floods[chat_id] = seconds
+
+    def new_message(self, chat_id, kind="photo", size=MB, media_group_id=None, forwarded=True, text=None):
+        """Creates an incoming message with a fresh file of size bytes (kind: photo, video, document or text)."""
+        file_id = f"f{next(self._files)}"
+        media = {}
+        if kind == "photo":
+            media["photo"] = FakeMedia(file_id, size)
+        elif kind == "video":
+            media["video"] = FakeMedia(file_id, size, f"{file_id}.mp4", "video/mp4")
+        elif kind == "document":
+            media["document"] = FakeMedia(file_id, size, f"{file_id}.zip", "application/zip")
+        message = FakeMessage(self, chat_id, next(self._ids), text=text, media_group_id=media_group_id,
+                              forwarded=forwarded, **media)
+        self._messages[(chat_id, message.id)] = message
+        return message
+
+    def _peer(self, chat_id):
+        if chat_id > 0:
+            return raw.types.InputPeerUser(user_id=chat_id, access_hash=0)
+        return raw.types.InputPeerChat(chat_id=-chat_id)
+
+    async def send_text(self, chat_id, text):
+        await self.invoke(raw.functions.messages.SendMessage(
+            peer=self._peer(chat_id), message=text, random_id=self.rnd_id()
+        ))
+        return FakeMessage(self, chat_id, next(self._ids), text=text)
+
+    async def edit_text(self, chat_id, message_id, text):
+        await self.invoke(raw.functions.messages.EditMessage(peer=self._peer(chat_id), id=message_id, message=text))
+
+    async def get_messages(self, chat_id, message_ids):
+        await asyncio.sleep(self.api_latency)
+        self.calls["GetMessages"] += 1
+        if isinstance(message_ids, int):
+            return self._messages.get((chat_id, message_ids))
+        return [self._messages.get((chat_id, message_id)) for message_id in message_ids]
+
+    async def stream_media(self, message, limit=0, offset=0):
+        """Yields the file in 1 MB chunks, each after chunk_latency plus its transfer time."""
+        if isinstance(message, FakeMessage):
+            media = message.video or message.document or message.photo
+            file_id, size = media.file_id, media.file_size
+        else:
+            file_id, size = message, self._file_size(message)
+        chunks = -(-size // TELEGRAM_CHUNK_SIZE)
+        last = min(chunks, offset + limit) if limit else chunks
+        shift = zlib.crc32(file_id.encode()) % TELEGRAM_CHUNK_SIZE
+        async with self.get_file_semaphore:
+            for index in range(offset, last):
+                length = min(TELEGRAM_CHUNK_SIZE, size - index * TELEGRAM_CHUNK_SIZE)
+                await asyncio.sleep(self.chunk_latency + length / self.bandwidth)
+                self.bytes_sent += length
+                yield (PATTERN[shift:] + PATTERN[:shift])[:length]
+
+    def _file_size(self, file_id):
+        for message in self._messages.values():
+            media = message.video or message.document or message.photo
+            if media and media.file_id == file_id:
+                return media.file_size
+        raise ValueError(f"Unknown file {file_id}")
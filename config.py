@@ -11,9 +11,72 @@ BASE_DOWNLOAD_FOLDER = os.path.join(os.path.expanduser("~"), "Downloads")
 CHUNK_SIZE = 1024 * 1024 * 10  # 10 MB chunks for faster downloads
 MAX_RETRIES = 5  # Retry attempts for large file downloads
 EXTRACT_FOLDER = os.path.join(BASE_DOWNLOAD_FOLDER, "extracted")  # Folder for extracted files
+PARTIAL_FOLDER = os.path.join(BASE_DOWNLOAD_FOLDER, ".partial")  # Resumable .part files and their metadata, and archives being extracted
+STATE_FOLDER = os.path.join(os.path.expanduser("~"), ".telegram_downloader")  # Bot databases, kept out of the upload folder
 MAX_FILE_SIZE = 1024 * 1024 * 1024 * 10  # 10GB maximum file size for downloads
+# Archive extraction limits (zip bomb protection)
+EXTRACT_MAX_TOTAL_SIZE = 1024 * 1024 * 1024 * 20  # 20GB uncompressed per archive
+EXTRACT_MAX_MEMBERS = 10000  # Files per archive
+EXTRACT_WORKERS = 4  # Threads extracting zip members in parallel
+STREAM_EXTRACT_TAR = True  # Extract .tar/.tar.gz URLs while they download
+KEEP_STREAMED_ARCHIVE = False  # Also save the streamed archive itself
+TELEGRAM_CHUNK_SIZE = 1024 * 1024  # MTProto file chunk size (fixed by Telegram)
+HASH_BLOCK_SIZE = 1024 * 1024 * 4  # Block size of the content hash used for deduplication
+WRITE_QUEUE_SIZE = 4  # Chunks buffered per file before the network reader is throttled
+WRITER_THREADS = 4  # Threads doing blocking file writes
 # Concurrency limits
 MAX_CONCURRENT_DOWNLOADS = 10
+DOWNLOAD_WORKERS = MAX_CONCURRENT_DOWNLOADS  # Worker tasks draining the job queue
+PROGRESS_INTERVAL = 3  # Seconds between progress edits of a chat's status message
+# Outgoing Bot API calls (sends, edits, deletes), matched to Telegram's published limits
+BOT_API_GLOBAL_RATE = 30  # Messages per second across all chats
+BOT_API_GLOBAL_BURST = 30
+BOT_API_CHAT_RATE = 1  # Messages per second in a private chat
+BOT_API_CHAT_BURST = 3
+BOT_API_GROUP_RATE = 20 / 60  # 20 messages per minute in a group or channel
+BOT_API_GROUP_BURST = 3
+# Albums (media groups) are collected into one batch job
+ALBUM_WINDOW = 1.5  # Seconds to wait for the rest of an album after its last message
+ALBUM_CONCURRENCY = 4  # Album members downloaded at the same time
+# Size-aware scheduling: big downloads can't take every worker
+SMALL_FILE_LIMIT = 1024 * 1024 * 50  # Jobs under 50 MB go to the small lane
+LARGE_LANE_SLOTS = 7  # Workers that may run large or unknown-size jobs at once
+SCHEDULER_AGING_RATE = 1024 * 1024  # Bytes of priority a queued job gains per second of waiting
+# Fair sharing of the workers between chats
+DEFAULT_CHAT_WEIGHT = 1
+CHAT_WEIGHTS = {}  # {chat_id: weight}, e.g. {123456789: 2} gives that chat twice the share
+PROBE_TIMEOUT = 10  # Seconds for a HEAD request used to learn a URL's size
+# Shared HTTP session (connection pooling for URL downloads)
+HTTP_MAX_CONNECTIONS = 100  # Total pooled connections
+HTTP_MAX_CONNECTIONS_PER_HOST = 8  # Connections per host
+HTTP_DNS_CACHE_TTL = 300  # Seconds to cache DNS lookups
+HTTP_KEEPALIVE_TIMEOUT = 60  # Seconds to keep idle connections open
+HTTP_TIMEOUT = 3600  # 1 hour total timeout per request
+# Concurrent downloads of media links scraped from HTML pages
+URL_FANOUT_CONCURRENCY = 16
+URL_FANOUT_PER_HOST = 4
+# Parallel HTTP Range downloads for large direct files
+RANGE_SEGMENTS = 4  # Byte ranges fetched in parallel per file
+RANGE_MIN_SIZE = 1024 * 1024 * 64  # Only split files of 64 MB or more
+RCLONE_STATS_INTERVAL = 2  # Seconds between rclone stats lines while /upload runs
+UPLOAD_RETRY_BATCH_SIZE = 100  # Failed files per rclone run in /retry_upload
+UPLOAD_RETRY_CONCURRENCY = 4  # rclone runs at the same time in /retry_upload
+# Streaming upload pipeline: every finished download goes straight to a long-running rclone rcd
+UPLOAD_PIPELINE = False  # Off: files wait for /upload
+UPLOAD_CONCURRENCY = 4  # Files uploaded at the same time
+RCLONE_RC_ADDR = "127.0.0.1:5572"  # Where rclone rcd listens (local only)
+RCLONE_RC_POLL_INTERVAL = 1  # Seconds between upload job status checks
+RCLONE_RC_START_TIMEOUT = 15  # Seconds to wait for rclone rcd to answer
+# Parallel offset ranges for large Telegram files (each range is its own MTProto transfer)
+TELEGRAM_SEGMENTS = 4  # Ranges fetched in parallel per file
+TELEGRAM_SEGMENT_MIN_SIZE = 1024 * 1024 * 64  # Only split files of 64 MB or more
+MAX_CONCURRENT_TRANSMISSIONS = 16  # MTProto transfers at once across all downloads (Pyrogram's limit)
+# Prometheus metrics
+METRICS_ENABLED = False  # Off: no HTTP endpoint, counters are still kept in memory
+METRICS_ADDR = "127.0.0.1:9101"  # Where /metrics is served (local only)
+# Background system sampler behind /status
+SYSTEM_SAMPLE_INTERVAL = 5  # Seconds between CPU/RAM/disk/network samples
+SYSTEM_SAMPLE_WINDOW = 15 * 60  # Seconds of samples kept (for the 1/5/15 minute averages)
 
 # Supported media types by extension
 SUPPORTED_MEDIA_TYPES = {
@@ -25,6 +88,10 @@ SUPPORTED_MEDIA_TYPES = {
 # Create download folder if it doesn't exist
 if not os.path.exists(BASE_DOWNLOAD_FOLDER):
     os.makedirs(BASE_DOWNLOAD_FOLDER)
+if not os.path.exists(PARTIAL_FOLDER):
+    os.makedirs(PARTIAL_FOLDER)
+if not os.path.exists(STATE_FOLDER):
+    os.makedirs(STATE_FOLDER)
 
 # Set up logging
 logging.basicConfig(
@@ -0,0 +1,128 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+from config import HASH_BLOCK_SIZE
+from state_db import get_db
+
+logger = logging.getLogger(__name__)
+
+class BlockHasher:
+    """
+    Content hash computed while a file is being written, so large files are never
+    read a second time: sha256 over the sha256 digests of each HASH_BLOCK_SIZE block.
+    Blocks are independent, so parallel range segments can each hash their own
+    blocks as their bytes arrive.
+    """
+
+    def __init__(self, blocks=None):
+        # Finished block index -> hex digest (persisted with resume metadata)
+        self.blocks = {int(idx): digest for idx, digest in (blocks or {}).items()}
+        # Block index -> (sha256 object, next expected offset)
+        self._open = {}
+        self._lock = threading.Lock()
+
+    def update(self, offset, data, file=None):
+        """
+        Feeds data written at offset. If a block is entered mid-way (a resumed
+        download), its first bytes are read back from file; at most one block.
+        """
+        view = memoryview(data)
+        while view:
+            idx = offset // HASH_BLOCK_SIZE
+            block_start = idx * HASH_BLOCK_SIZE
+            size = min(len(view), block_start + HASH_BLOCK_SIZE - offset)
+            with self._lock:
+                entry = self._open.pop(idx, None)
+            if entry and entry[1] == offset:
+                block_hash = entry[0]
+            else:
+                block_hash = hashlib.sha256()
+                if offset > block_start:
+                    if file is None:
+                        raise ValueError(f"Can't hash block {idx} without reading back its start")
+                    file.seek(block_start)
+                    block_hash.update(file.read(offset - block_start))
+            block_hash.update(view[:size])
+            offset += size
+            view = view[size:]
+            with self._lock:
+                if offset == block_start + HASH_BLOCK_SIZE:
+                    self.blocks[idx] = block_hash.hexdigest()
+                else:
+                    self._open[idx] = (block_hash, offset)
+
+    def snapshot(self):
+        """Returns a copy of the finished block digests, safe to serialize."""
+        with self._lock:
+            return dict(self.blocks)
+
+    def hexdigest(self, total_size):
+        """Returns the content hash of a complete file of total_size bytes, or None if blocks are missing."""
+        with self._lock:
+            blocks = dict(self.blocks)
+            for idx, (block_hash, offset) in self._open.items():
+                # Only the last block may be short
+                if offset == total_size:
+                    blocks[idx] = block_hash.hexdigest()
+        block_count = -(-total_size // HASH_BLOCK_SIZE)
+        content_hash = hashlib.sha256()
+        for idx in range(block_count):
+            if idx not in blocks:
+                return None
+            content_hash.update(bytes.fromhex(blocks[idx]))
+        return content_hash.hexdigest()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS content (
+    hash TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    created REAL NOT NULL,
+    uploaded INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+_migrated = False
+
+def _db():
+    global _migrated
+    conn = get_db("content_index.db", SCHEMA)
+    if not _migrated:
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(content)")}
+        if "uploaded" not in columns:
+            conn.execute("ALTER TABLE content ADD COLUMN uploaded INTEGER NOT NULL DEFAULT 0")
+        conn.execute("CREATE INDEX IF NOT EXISTS content_path ON content (path)")
+        conn.commit()
+        _migrated = True
+    return conn
+
+def dedup_file(file_path, content_hash, size):
+    """
+    Checks a freshly downloaded file against the content index.
+    If the same bytes were already uploaded, or still exist locally, the new copy
+    is deleted and the earlier path is returned (it no longer exists once the
+    earlier copy was uploaded), so the file is stored and uploaded only once.
+    Otherwise the file is recorded in the index and file_path is returned.
+    """
+    if content_hash is None:
+        return file_path
+    conn = _db()
+    row = conn.execute("SELECT path, size, uploaded FROM content WHERE hash = ?", (content_hash,)).fetchone()
+    if row and row[1] == size and (row[2] or (row[0] != file_path and os.path.exists(row[0]))):
+        os.remove(file_path)
+        logger.info(f"Duplicate of {row[0]} ({'uploaded' if row[2] else 'on disk'}) skipped: {file_path}")
+        return row[0]
+    conn.execute(
+        "INSERT OR REPLACE INTO content (hash, size, path, created, uploaded) VALUES (?, ?, ?, ?, 0)",
+        (content_hash, size, file_path, time.time())
+    )
+    conn.commit()
+    return file_path
+
+def mark_files_uploaded(paths):
+    """Marks the indexed content at paths as uploaded, so later copies are skipped after the file is deleted."""
+    conn = _db()
+    conn.executemany("UPDATE content SET uploaded = 1 WHERE path = ?", [(path,) for path in paths])
+    conn.commit()
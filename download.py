@@ -4,15 +4,25 @@ import uuid
 import mimetypes
 import asyncio
 import aiohttp
-import zipfile
+from urllib.parse import urljoin, urlparse
 from bs4 import BeautifulSoup
 from pyrogram import errors
-from config import BASE_DOWNLOAD_FOLDER, CHUNK_SIZE, SUPPORTED_MEDIA_TYPES, MAX_CONCURRENT_DOWNLOADS, MAX_RETRIES, EXTRACT_FOLDER, MAX_FILE_SIZE
-from progress import progress_callback
+from config import BASE_DOWNLOAD_FOLDER, CHUNK_SIZE, SUPPORTED_MEDIA_TYPES, MAX_CONCURRENT_DOWNLOADS, MAX_RETRIES, EXTRACT_FOLDER, MAX_FILE_SIZE, URL_FANOUT_CONCURRENCY, URL_FANOUT_PER_HOST, RANGE_MIN_SIZE, PROBE_TIMEOUT, TELEGRAM_CHUNK_SIZE, TELEGRAM_SEGMENTS, TELEGRAM_SEGMENT_MIN_SIZE, STREAM_EXTRACT_TAR, KEEP_STREAMED_ARCHIVE, ALBUM_CONCURRENCY
+from progress import progress_service
+from rate_limit import low_priority
 from flood_control import handle_flood_wait
 from pyrogram import Client
-import patoolib
 from media_type_detection import get_media_type, MediaInfo
+from http_session import get_session
+from range_download import supports_ranges, get_validator, split_ranges, download_ranges, RangeNotSatisfiedError
+from telegram_ranges import download_telegram_ranges
+from upload_pipeline import submit_upload
+from file_writer import FileWriter
+from extract import extract_archive, stream_extract_tar, is_tar_name, ARCHIVE_EXTENSIONS
+from dedup import BlockHasher, dedup_file
+import media_index
+import metrics
+from resume import http_key, telegram_key, part_path, load_state, save_state, discard, finish
 import logging
 
 # Constants that should be defined
@@ -21,9 +31,13 @@ retry_delay = 30  # Retry delay in seconds
 logger = logging.getLogger(__name__)
 # Semaphore to limit concurrent downloads
 download_semaphore = asyncio.Semaphore(MAX_CONCURRENT_DOWNLOADS)
+# Limits for links scraped from HTML pages (global and per host)
+url_fanout_semaphore = asyncio.Semaphore(URL_FANOUT_CONCURRENCY)
+host_semaphores = {}
+# Downloads running, by resume key: two requests for the same file must not share a .part file.
+# {"task", "waiters"}: the download and how many callers await it
+_in_flight = {}
 
-# Global list for tracking failed downloads
-failed_files = []
 class DownloadError(Exception):
     """Custom exception for download-related errors."""
     pass
@@ -34,141 +48,521 @@ async def download_from_url(message, url):
       - HTML pages with media links (including Telegra.ph).
       - Direct file downloads.
       - If a .zip file is downloaded, it will automatically extract it.
+    Reports failures in the chat and returns False for them (True on success),
+    so the job queue keeps them for /retry_download.
     """
+    session = get_session()
+    try:
+        async with session.get(url) as response:
+            content_type = response.headers.get("Content-Type", "").lower()
+            # If HTML, parse for media
+            if response.status == 200 and "html" in content_type:
+                html_content = await response.text()
+                soup = BeautifulSoup(html_content, "html.parser")
+
+                # Handle Telegra.ph specifically
+                if "telegra.ph" in url:
+                    media_links = [tag["src"] for tag in soup.find_all("img", src=True)]
+                    if not media_links:
+                        await message.reply("No images found on Telegra.ph URL.")
+                        return False
+                    media_links = [
+                        f"https://telegra.ph{link}" if link.startswith("/") else link
+                        for link in media_links
+                    ]
+                    return await download_media_links(message, media_links, "files from Telegra.ph", "Completed Telegra.ph download")
+
+                # For other HTML pages, try to extract media links
+                media_links = [tag["src"] for tag in soup.find_all(["img", "video"], src=True)]
+                if media_links:
+                    media_links = [
+                        link if link.startswith("http") else urljoin(url, link)
+                        for link in media_links
+                    ]
+                    return await download_media_links(message, media_links, "media files", "Completed media download")
+                else:
+                    await message.reply("No media found in the provided URL.")
+                    return False
+
+            # Handle server errors
+            if response.status == 500:
+                await message.reply(f"Server error (500) for URL: {url}. Try again later.")
+                return False
+            if response.status != 200:
+                await message.reply(f"Failed to download from URL: {url}\nStatus code: {response.status}")
+                return False
+
+            # Tar archives can be extracted while they download
+            file_name = response_file_name(response)
+            url_name = os.path.basename(urlparse(url).path)
+            if is_tar_name(url_name) and not is_tar_name(file_name):
+                file_name = url_name
+            if STREAM_EXTRACT_TAR and is_tar_name(file_name):
+                title = f"Downloading and extracting {file_name}..."
+                status_msg = await message.reply(title)
+                keep_path = os.path.join(BASE_DOWNLOAD_FOLDER, file_name) if KEEP_STREAMED_ARCHIVE else None
+                count, files = await stream_extract_tar(response.content.iter_chunked(CHUNK_SIZE), title, status_msg, keep_path)
+                for path in files + ([keep_path] if keep_path else []):
+                    submit_upload(path)
+                await status_msg.edit_text(f"✅ Downloaded and extracted {count} files from URL: {url}\nInto: {EXTRACT_FOLDER}")
+                return True
+
+            # Direct file download
+            status_msg = await message.reply("Starting file download...")
+            file_path = await save_response(response, status_msg)
+            if not os.path.exists(file_path):
+                # Same content as a file uploaded earlier
+                await status_msg.edit_text(f"✅ File from URL: {url}\nAlready uploaded as: {os.path.basename(file_path)}")
+                return True
+            await status_msg.edit_text(f"✅ Downloaded file from URL: {url}\nSaved at: {file_path}")
+
+            extracted = True
+            # --- NEW: If file is a compressed file, extract its contents ---
+            if file_path.lower().endswith(ARCHIVE_EXTENSIONS):
+                try:
+                    extract_msg = await message.reply(f"Extracting {os.path.basename(file_path)}...")
+                    start = time.monotonic()
+                    count, files = await extract_archive(file_path, extract_msg)
+                    for path in files:
+                        submit_upload(path)
+                    metrics.stage_duration.observe(time.monotonic() - start, ("extract",))
+                    await extract_msg.edit_text(f"✅ Compressed file extracted into {EXTRACT_FOLDER} ({count} files)")
+                except Exception as extract_err:
+                    await message.reply(f"❌ Error extracting compressed file: {extract_err}")
+                    extracted = False
+            # Only after extraction, which reads the archive
+            submit_upload(file_path)
+            return extracted
+
+    except errors.FloodWait:
+        # The worker pauses the chat and queues the download again
+        raise
+    except aiohttp.ClientError as e:
+        await message.reply(f"Connection error while downloading: {str(e)}")
+    except Exception as e:
+        await message.reply(f"Error while downloading from URL: {str(e)}")
+    return False
+
+def response_file_name(response):
+    """Returns the file name from Content-Disposition, or a random name with an extension guessed from Content-Type."""
+    content_type = response.headers.get("Content-Type", "").lower()
+    content_disp = response.headers.get("Content-Disposition", "")
+    if "filename=" in content_disp:
+        return content_disp.split("filename=")[-1].strip('"')
+    ext = mimetypes.guess_extension(content_type.split(";")[0]) or ""
+    return f"{uuid.uuid4().hex}{ext}"
+
+async def _single_flight(key, start):
+    """
+    Runs the download start() returns for a resume key, unless one for the same
+    key is already running; then its result (or error) is shared instead.
+    A cancelled caller only stops waiting: the download is cancelled when its
+    last waiter leaves.
+    """
+    entry = _in_flight.get(key)
+    if entry is None:
+        entry = _in_flight[key] = {"task": asyncio.ensure_future(start()), "waiters": 0}
+        entry["task"].add_done_callback(lambda t: _in_flight.pop(key, None))
+    entry["waiters"] += 1
+    try:
+        return await asyncio.shield(entry["task"])
+    finally:
+        entry["waiters"] -= 1
+        if entry["waiters"] == 0 and not entry["task"].done():
+            entry["task"].cancel()
+
+async def save_response(response, status_msg=None):
+    """
+    Streams a successful response body into BASE_DOWNLOAD_FOLDER through a .part file.
+    When the server supports byte ranges, resume metadata is kept next to the
+    .part file so a failed or interrupted download continues from the last
+    written byte on the next attempt (including after a restart).
+    Edits status_msg with progress when given. Returns the saved file path.
+    If the same URL is already downloading, waits for that download instead.
+    """
+    url = str(response.url)
+    # Key partial downloads on the URL the user asked for, not the redirect target
+    origin_url = str(response.history[0].url) if response.history else url
+    key = http_key(origin_url)
+    if key in _in_flight:
+        response.close()
+    return await _single_flight(key, lambda: _save_response(response, url, origin_url, key, status_msg))
+
+async def _save_response(response, url, origin_url, key, status_msg):
+    total_size = int(response.headers.get('Content-Length', 0))
+    validator = get_validator(response)
+    resumable = supports_ranges(response)
+
+    state = load_state(key)
+    if state and not (resumable and state["size"] == total_size and state["validator"] == validator):
+        # The file changed on the server (or lost range support); start over
+        discard(key)
+        state = None
+
+    if state:
+        file_path = state["file_path"]
+        logger.info(f"Resuming {origin_url} into {file_path}")
+        hasher = BlockHasher(state.get("blocks"))
+    else:
+        file_path = os.path.join(BASE_DOWNLOAD_FOLDER, response_file_name(response))
+        if resumable:
+            ranges = split_ranges(total_size) if total_size >= RANGE_MIN_SIZE else [[0, total_size - 1]]
+            state = {
+                "url": origin_url,
+                "file_path": file_path,
+                "size": total_size,
+                "validator": validator,
+                "ranges": ranges
+            }
+            with open(part_path(key), "wb") as f:
+                f.truncate(total_size)
+            save_state(key, state)
+        hasher = BlockHasher()
+
+    if state and (len(state["ranges"]) > 1 or state["ranges"][0][0] > 0):
+        # Segmented or resumed download: drop the single-stream body and fetch the missing ranges
+        response.close()
+        try:
+            await _save_ranges(url, key, state, hasher, status_msg, os.path.basename(file_path))
+            return _finish_download(key, file_path, hasher)
+        except RangeNotSatisfiedError as e:
+            logger.warning(f"Range download failed for {url}, falling back to a single stream: {e}")
+            discard(key)
+            state = None
+            hasher = BlockHasher()
+        async with get_session().get(url) as response:
+            if response.status != 200:
+                raise DownloadError(f"Status code: {response.status}")
+            await _save_stream(response, key, total_size, hasher, None, status_msg, os.path.basename(file_path))
+        return _finish_download(key, file_path, hasher)
+
+    await _save_stream(response, key, total_size, hasher, state, status_msg, os.path.basename(file_path))
+    return _finish_download(key, file_path, hasher)
+
+def _finish_download(key, file_path, hasher):
+    """
+    Moves a completed .part file into place. If the same content was downloaded
+    before and is still on disk or already uploaded, the new copy is dropped and
+    the earlier path returned.
+    """
+    start = time.monotonic()
+    finish(key, file_path)
+    file_path = dedup_file(file_path, hasher.hexdigest(os.path.getsize(file_path)), os.path.getsize(file_path))
+    metrics.stage_duration.observe(time.monotonic() - start, ("finish",))
+    return file_path
+
+async def _save_stream(response, key, total_size, hasher, state=None, status_msg=None, title="file"):
+    """
+    Writes the response body to the .part file for key as a single sequential stream.
+    Disk writes (and content hashing) happen off the event loop; with state, the
+    written offset is persisted after every chunk reaches the disk.
+    """
+    downloaded_size = 0
+    start = time.monotonic()
+
+    def on_written(size):
+        state["ranges"][0][0] += size
+        state["blocks"] = hasher.snapshot()
+        save_state(key, state)
+
+    async with progress_service.job(status_msg, title, total_size) as progress, \
+            FileWriter(part_path(key), "r+b" if state else "wb", hasher=hasher) as writer:
+        async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+            if chunk:
+                # Waits here when the disk falls behind, throttling the download
+                await writer.write(chunk, on_written=on_written if state else None)
+                downloaded_size += len(chunk)
+                progress.update(downloaded_size)
+                metrics.downloaded_bytes.inc(("http",), len(chunk))
+
+    # Verify file integrity
+    if total_size and downloaded_size != total_size:
+        raise ValueError(f"Incomplete download: expected {total_size} bytes, got {downloaded_size} bytes")
+    metrics.stage_duration.observe(time.monotonic() - start, ("http_transfer",))
+
+async def _save_ranges(url, key, state, hasher, status_msg=None, title="file"):
+    """
+    Downloads the missing ranges of the .part file for key in parallel,
+    persisting progress after every chunk and showing it in status_msg.
+    """
+    total_size = state["size"]
+    downloaded_size = total_size - sum(end - position + 1 for position, end in state["ranges"])
+    start = time.monotonic()
+
+    async with progress_service.job(status_msg, f"{title} ({len(state['ranges'])} segments)", total_size, downloaded_size) as progress:
+        def on_chunk(size):
+            progress.add(size)
+            metrics.downloaded_bytes.inc(("http",), size)
+            state["blocks"] = hasher.snapshot()
+            save_state(key, state)
+
+        await download_ranges(url, part_path(key), state["ranges"], state["validator"], on_chunk, hasher)
+    metrics.stage_duration.observe(time.monotonic() - start, ("http_transfer",))
+
+def _host_semaphore(url):
+    """Returns the semaphore limiting concurrent link downloads for the URL's host."""
+    host = urlparse(url).netloc
+    if host not in host_semaphores:
+        host_semaphores[host] = asyncio.Semaphore(URL_FANOUT_PER_HOST)
+    return host_semaphores[host]
+
+async def probe_size(url):
+    """
+    Returns the size of the file at url from a HEAD request, or None if it is unknown
+    (no Content-Length, an HTML page, or the request failed).
+    """
+    try:
+        timeout = aiohttp.ClientTimeout(total=PROBE_TIMEOUT)
+        async with get_session().head(url, allow_redirects=True, timeout=timeout) as response:
+            if response.status != 200 or "text/html" in response.headers.get("Content-Type", ""):
+                return None
+            return response.content_length
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        return None
+
+# Both take the host's slot before a global one, so links queued behind a busy
+# host don't hold global slots that other hosts could use
+async def _probe_link(media_url):
+    async with metrics.acquire(_host_semaphore(media_url), "url_host"), metrics.acquire(url_fanout_semaphore, "url_fanout"):
+        return await probe_size(media_url)
+
+async def _fetch_media_link(media_url):
+    """
+    Downloads one link scraped from an HTML page without posting its own messages.
+    Raises on failure so the caller can report it.
+    """
+    async with metrics.acquire(_host_semaphore(media_url), "url_host"), metrics.acquire(url_fanout_semaphore, "url_fanout"):
+        async with get_session().get(media_url) as response:
+            if response.status != 200:
+                raise DownloadError(f"Status code: {response.status}")
+            return await save_response(response)
+
+async def download_media_links(message, media_links, label, summary_title):
+    """
+    Downloads links scraped from an HTML page concurrently, bounded by
+    URL_FANOUT_CONCURRENCY overall and URL_FANOUT_PER_HOST per host.
+    When there are more links than slots, their sizes are probed with parallel
+    HEAD requests first and the smallest start first (unknown sizes last).
+    Keeps a single status message and reports failed links at the end.
+    Returns False if no link could be downloaded.
+    """
+    # A page often links the same image more than once
+    media_links = list(dict.fromkeys(media_links))
+    total_files = len(media_links)
     failed_downloads = []
-    connector = aiohttp.TCPConnector(limit=50, force_close=True)
-    timeout = aiohttp.ClientTimeout(total=3600)  # 1 hour timeout
+    done = 0
+    last_edit = time.time()
+    status_msg = await message.reply(f"Downloading {total_files} {label}...")
+
+    if total_files > URL_FANOUT_CONCURRENCY:
+        sizes = await asyncio.gather(*(_probe_link(media_url) for media_url in media_links))
+        # Semaphore waiters are served in order, so the sorted order is the start order
+        media_links = [
+            media_url for size, media_url
+            in sorted(zip(sizes, media_links), key=lambda item: (item[0] is None, item[0] or 0))
+        ]
 
-    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+    async def fetch(media_url):
+        nonlocal done, last_edit
         try:
-            async with session.get(url) as response:
-                content_type = response.headers.get("Content-Type", "").lower()
-                # If HTML, parse for media
-                if response.status == 200 and "html" in content_type:
-                    html_content = await response.text()
-                    soup = BeautifulSoup(html_content, "html.parser")
-
-                    # Handle Telegra.ph specifically
-                    if "telegra.ph" in url:
-                        media_links = [tag["src"] for tag in soup.find_all("img", src=True)]
-                        if not media_links:
-                            await message.reply("No images found on Telegra.ph URL.")
-                            return
-                        total_files = len(media_links)
-                        status_msg = await message.reply(f"Downloading {total_files} files from Telegra.ph...")
-                        for idx, media_url in enumerate(media_links, 1):
-                            try:
-                                if (media_url.startswith("/")):
-                                    media_url = f"https://telegra.ph{media_url}"
-                                await download_from_url(message, media_url)
-                                if idx % 5 == 0:
-                                    await status_msg.edit_text(f"Downloaded {idx}/{total_files} files from Telegra.ph...")
-                            except errors.FloodWait as e:
-                                await handle_flood_wait(e, message)
-                            except Exception as e:
-                                failed_downloads.append((media_url, str(e)))
-                        success_count = total_files - len(failed_downloads)
-                        await status_msg.edit_text(
-                            f"Completed Telegra.ph download:\n✅ Success: {success_count}\n❌ Failed: {len(failed_downloads)}"
-                        )
-                        return
-
-                    # For other HTML pages, try to extract media links
-                    media_links = [tag["src"] for tag in soup.find_all(["img", "video"], src=True)]
-                    if media_links:
-                        total_files = len(media_links)
-                        status_msg = await message.reply(f"Downloading {total_files} media files...")
-                        for idx, media_url in enumerate(media_links, 1):
-                            try:
-                                if not media_url.startswith("http"):
-                                    media_url = os.path.join(os.path.dirname(url), media_url)
-                                await download_from_url(message, media_url)
-                                if idx % 5 == 0:
-                                    await status_msg.edit_text(f"Downloaded {idx}/{total_files} media files...")
-                            except errors.FloodWait as e:
-                                await handle_flood_wait(e, message)
-                            except Exception as e:
-                                failed_downloads.append((media_url, str(e)))
-                        success_count = total_files - len(failed_downloads)
-                        await status_msg.edit_text(
-                            f"Completed media download:\n✅ Success: {success_count}\n❌ Failed: {len(failed_downloads)}"
-                        )
-                        return
-                    else:
-                        await message.reply("No media found in the provided URL.")
-                        return
-
-                # Handle server errors
-                if response.status == 500:
-                    await message.reply(f"Server error (500) for URL: {url}. Try again later.")
-                    return
-                if response.status != 200:
-                    await message.reply(f"Failed to download from URL: {url}\nStatus code: {response.status}")
-                    return
-
-                # Direct file download
-                content_disp = response.headers.get("Content-Disposition", "")
-                if "filename=" in content_disp:
-                    file_name = content_disp.split("filename=")[-1].strip('"')
-                else:
-                    ext = mimetypes.guess_extension(content_type.split(";")[0]) or ""
-                    file_name = f"{uuid.uuid4().hex}{ext}"
-                file_path = os.path.join(BASE_DOWNLOAD_FOLDER, file_name)
-
-                total_size = int(response.headers.get('Content-Length', 0))
-                downloaded_size = 0
-                start_time = time.time()
-                status_msg = await message.reply("Starting file download...")
-                with open(file_path, "wb") as f:
-                    async for chunk in response.content.iter_chunked(CHUNK_SIZE):
-                        if chunk:
-                            f.write(chunk)
-                            downloaded_size += len(chunk)
-                            current_time = time.time()
-                            # Update progress every few seconds or on completion
-                            if total_size > 0 and (downloaded_size / total_size * 100 % 5 == 0 or current_time - start_time >= 3):
-                                progress = (downloaded_size / total_size * 100)
-                                speed = downloaded_size / (current_time - start_time)
-                                await status_msg.edit_text(
-                                    f"Downloading file: {progress:.1f}%\nSpeed: {speed:.1f} bytes/s\nDownloaded: {downloaded_size} MB"
-                                )
-                await status_msg.edit_text(f"✅ Downloaded file from URL: {url}\nSaved at: {file_path}")
-                
-                # Verify file integrity
-                if downloaded_size != total_size:
-                    raise ValueError(f"Incomplete download: expected {total_size} bytes, got {downloaded_size} bytes")
-
-                # --- NEW: If file is a compressed file, extract its contents ---
-                if file_path.lower().endswith(('.zip', '.rar', '.tar', '.gz', '.7z')):
-                    try:
-                        if file_path.lower().endswith(".zip"):
-                            with zipfile.ZipFile(file_path, "r") as zip_ref:
-                                if len(zip_ref.namelist()) == 0:
-                                    await message.reply(f"❌ The .zip file is empty: {file_path}")
-                                else:
-                                    zip_ref.extractall(EXTRACT_FOLDER)
-                        else:
-                            patoolib.extract_archive(file_path, outdir=EXTRACT_FOLDER)
-                        await message.reply(f"✅ Compressed file extracted into {EXTRACT_FOLDER}")
-                    except Exception as extract_err:
-                        await message.reply(f"❌ Error extracting compressed file: {extract_err}")
-
-        except errors.FloodWait as e:
-            await handle_flood_wait(e, message)
-        except aiohttp.ClientError as e:
-            await message.reply(f"Connection error while downloading: {str(e)}")
+            submit_upload(await _fetch_media_link(media_url))
         except Exception as e:
-            await message.reply(f"Error while downloading from URL: {str(e)}")
-        if failed_downloads:
-            error_report = "Failed downloads:\n"
-            for link, err in failed_downloads:
-                error_report += f"- {link}: {err}\n"
-            await message.reply(error_report)
+            failed_downloads.append((media_url, str(e)))
+        done += 1
+        # Throttle progress edits so a large page doesn't flood the chat
+        if done < total_files and time.time() - last_edit >= 3:
+            last_edit = time.time()
+            try:
+                with low_priority():
+                    await status_msg.edit_text(f"Downloaded {done}/{total_files} {label}...")
+            except Exception:
+                pass
+
+    await asyncio.gather(*(fetch(media_url) for media_url in media_links))
+
+    success_count = total_files - len(failed_downloads)
+    try:
+        await status_msg.edit_text(
+            f"{summary_title}:\n✅ Success: {success_count}\n❌ Failed: {len(failed_downloads)}"
+        )
+    except errors.FloodWait as e:
+        await handle_flood_wait(e, message)
+    if failed_downloads:
+        error_report = "Failed downloads:\n"
+        for link, err in failed_downloads:
+            error_report += f"- {link}: {err}\n"
+        await message.reply(error_report)
+    return success_count > 0
+
+async def _download_telegram_part(client, media, key, state, hasher, progress):
+    """
+    Streams a Telegram file into the .part file for key, continuing from the
+    last complete MTProto chunk already on disk. media is a Message or a file_id.
+    Chunks are written and hashed off the event loop; progress (a JobProgress
+    that started at state["offset"]) is advanced by the bytes received.
+    Pyrogram logs and swallows transfer errors, ending the stream early, so a
+    short stream is requested again from where it stopped (up to MAX_RETRIES times).
+    Returns the number of bytes in the .part file.
+    """
+    path = part_path(key)
+    existing = os.path.getsize(path) if os.path.exists(path) else 0
+    # stream_media resumes in whole chunks; drop any trailing partial chunk
+    current = existing // TELEGRAM_CHUNK_SIZE * TELEGRAM_CHUNK_SIZE
+    last_save = time.time()
+
+    def on_written(size):
+        nonlocal last_save
+        state["offset"] += size
+        if time.time() - last_save >= 1:
+            state["blocks"] = hasher.snapshot()
+            save_state(key, state)
+            last_save = time.time()
+
+    with open(path, "r+b" if existing else "wb") as f:
+        f.truncate(current)
+    progress.add(current - state["offset"])
+    state["offset"] = current
+    try:
+        async with FileWriter(path, "r+b", hasher=hasher) as writer:
+            for attempt in range(1, MAX_RETRIES + 1):
+                # Every chunk but the file's last is whole, so current stays chunk-aligned
+                async for chunk in client.stream_media(media, offset=current // TELEGRAM_CHUNK_SIZE):
+                    await writer.write(chunk, current, on_written)
+                    current += len(chunk)
+                    progress.add(len(chunk))
+                    metrics.downloaded_bytes.inc(("telegram",), len(chunk))
+                if current >= state["size"] or attempt == MAX_RETRIES:
+                    break
+                logger.warning(f"Stream of {key} stopped at {current}/{state['size']} bytes, attempt {attempt}; resuming")
+                await asyncio.sleep(attempt)
+    finally:
+        # Record how far we got, also when the transfer fails
+        state["blocks"] = hasher.snapshot()
+        save_state(key, state)
+    return state["offset"]
+
+async def _download_telegram_ranges(client, media, key, state, hasher, progress):
+    """
+    Fetches the missing ranges of a large Telegram file in parallel into its
+    preallocated .part file, persisting progress at most once a second.
+    state["offset"] counts the bytes on disk, as for single-stream downloads.
+    """
+    path = part_path(key)
+    if not os.path.exists(path):
+        with open(path, "wb") as f:
+            f.truncate(state["size"])
+    last_save = time.time()
+
+    def on_chunk(size):
+        nonlocal last_save
+        state["offset"] += size
+        progress.add(size)
+        metrics.downloaded_bytes.inc(("telegram",), size)
+        if time.time() - last_save >= 1:
+            state["blocks"] = hasher.snapshot()
+            save_state(key, state)
+            last_save = time.time()
+
+    try:
+        await download_telegram_ranges(client, media, path, state["ranges"], on_chunk, hasher)
+    finally:
+        state["blocks"] = hasher.snapshot()
+        save_state(key, state)
+    return state["offset"]
+
+async def _fetch_telegram(client, media, key, state, progress):
+    """
+    Downloads (or resumes) the Telegram file described by state, then verifies it,
+    moves it into place and records it in the media index.
+    Returns (file_path, file_size); file_path differs from state["file_path"]
+    when the same content was already on disk. If the same file is already
+    downloading, waits for that download and returns its result.
+    """
+    return await _single_flight(key, lambda: _fetch_telegram_once(client, media, key, state, progress))
+
+async def _fetch_telegram_once(client, media, key, state, progress):
+    hasher = BlockHasher(state.get("blocks"))
+    # Large files are split into ranges when first seen; older partials stay single-stream
+    download = _download_telegram_ranges if "ranges" in state else _download_telegram_part
+    start = time.monotonic()
+    try:
+        await asyncio.wait_for(
+            download(client, media, key, state, hasher, progress), timeout=DOWNLOAD_TIMEOUT
+        )
+    except asyncio.TimeoutError:
+        raise DownloadError("Download timed out")
+    metrics.stage_duration.observe(time.monotonic() - start, ("telegram_transfer",))
+    file_size = _verify_part(key, state["size"])
+    file_path = _finish_download(key, state["file_path"], hasher)
+    media_index.record(state.get("file_unique_id"), file_path, file_size)
+    if not os.path.exists(file_path):
+        # Same content as an uploaded file
+        media_index.mark_files_uploaded([file_path])
+    submit_upload(file_path)
+    return file_path, file_size
+
+def _telegram_state(media_info, media_type):
+    """Returns (key, state) for downloading media_info, continuing a saved partial download if there is one."""
+    key = telegram_key(media_info.file_unique_id or uuid.uuid4().hex)
+    state = load_state(key)
+    if state is None:
+        file_path = os.path.join(
+            BASE_DOWNLOAD_FOLDER,
+            f"{os.path.splitext(media_info.file_name)[0]}_{uuid.uuid4().hex[:8]}{os.path.splitext(media_info.file_name)[1]}"
+        )
+        state = {
+            "file_id": media_info.file_id,
+            "file_unique_id": media_info.file_unique_id,
+            "file_path": file_path,
+            "size": media_info.file_size,
+            "offset": 0,
+            "media_type": media_type
+        }
+        if media_info.file_size >= TELEGRAM_SEGMENT_MIN_SIZE:
+            state["ranges"] = split_ranges(media_info.file_size, TELEGRAM_SEGMENTS)
+        save_state(key, state)
+    return key, state
+
+def _verify_part(key, expected_size):
+    """
+    Checks a finished .part file. A short one (the stream ended early) is kept
+    with its sidecar so /retry_download resumes it; a larger one can't be
+    trusted and is discarded.
+    """
+    file_size = os.path.getsize(part_path(key))
+    if file_size > expected_size:
+        discard(key)
+        raise DownloadError(f"File size mismatch: expected {expected_size} bytes, got {file_size} bytes")
+    if file_size < expected_size:
+        raise DownloadError(f"Download stopped at {file_size} of {expected_size} bytes")
+    return file_size
+
+async def reply_if_known(message, media_info):
+    """
+    Answers straight away if the media's file_unique_id is in the media index.
+    Returns True if the message was handled.
+    """
+    known = media_index.lookup(media_info.file_unique_id)
+    if not known:
+        return False
+    where = "uploaded to Google Photos" if known["uploaded"] else f"saved at {known['path']}"
+    await message.reply(
+        f"✅ {media_info.type.capitalize()} already downloaded, {where}.\n"
+        f"📊 Size: {known['size']/(1024*1024):.1f} MB",
+        quote=True
+    )
+    return True
 
 async def download_with_progress(message, media_type, retry=False, max_retries=MAX_RETRIES):
-    """Enhanced download function with better media type detection"""
-    global failed_files
-    
+    """
+    Enhanced download function with better media type detection.
+    Bytes go to a .part file with resume metadata, so a retry (or a restarted
+    bot) continues from the last good offset instead of starting from zero.
+    """
+    file_path = None
+    status_message = None
+    key = None
+
     try:
         # Add debug print to verify the function is being called
         print("Starting download_with_progress")
@@ -182,94 +576,160 @@ async def download_with_progress(message, media_type, retry=False, max_retries=M
             print(f"Error in media type detection: {str(e)}")
             raise
             
+        # Already downloaded (or uploaded) under the same file_unique_id: answer without downloading
+        if await reply_if_known(message, media_info):
+            return True
+
         # Verify file size
         if not await verify_file_size(message):
             raise DownloadError("File size verification failed")
 
-        # Use detected media info
-        file_path = os.path.join(
-            BASE_DOWNLOAD_FOLDER,
-            f"{os.path.splitext(media_info.file_name)[0]}_{uuid.uuid4().hex[:8]}{os.path.splitext(media_info.file_name)[1]}"
-        )
+        key, state = _telegram_state(media_info, media_type)
 
-        async with download_semaphore:
+        async with metrics.acquire(download_semaphore, "download"):
             status_message = await message.reply(
-                f"Starting download of {media_info.type}...\n"
+                f"{'Resuming' if state['offset'] else 'Starting'} download of {media_info.type}...\n"
                 f"File name: {media_info.file_name}\n"
                 f"Size: {media_info.file_size/(1024*1024):.1f} MB"
             )
-            start_time = time.time()
 
             try:
-                # Enhanced download with chunked transfer
-                download_task = asyncio.create_task(
-                    message.download(
-                        file_name=file_path,
-                        progress=lambda current, total: asyncio.create_task(
-                            progress_callback(current, total, status_message, start_time, media_info.type)
-                        ),
-                        block=True
-                    )
+                title = f"{media_info.type} {os.path.basename(state['file_path'])}"
+                async with progress_service.job(status_message, title, state["size"], state["offset"]) as progress:
+                    file_path, file_size = await _fetch_telegram(message._client, message, key, state, progress)
+
+                # Update status message with success
+                duplicate_note = ""
+                if file_path != state["file_path"]:
+                    kept = "kept the existing copy" if os.path.exists(file_path) else "it is already uploaded"
+                    duplicate_note = f"\n♻️ Same content was already downloaded, {kept}"
+                await status_message.edit_text(
+                    f"✅ {media_info.type.capitalize()} downloaded successfully!\n"
+                    f"📁 File: {os.path.basename(file_path)}\n"
+                    f"📊 Size: {file_size/(1024*1024):.1f} MB"
+                    f"{duplicate_note}"
                 )
 
-                await asyncio.wait_for(download_task, timeout=DOWNLOAD_TIMEOUT)
-
-                # Verify downloaded file
-                if os.path.exists(file_path):
-                    file_size = os.path.getsize(file_path)
-                    if file_size == 0:
-                        raise DownloadError("Downloaded file is empty")
-                    # Add final file size verification
-                    if file_size != media_info.file_size:
-                        raise DownloadError(f"File size mismatch: expected {media_info.file_size} bytes, got {file_size} bytes")
-
-                    # Update status message with success
-                    await status_message.edit_text(
-                        f"✅ {media_info.type.capitalize()} downloaded successfully!\n"
-                        f"📁 File: {os.path.basename(file_path)}\n"
-                        f"📊 Size: {file_size/(1024*1024):.1f} MB"
-                    )
-
-                    # Remove from failed_files if this was a retry
-                    if retry:
-                        failed_files = [f for f in failed_files if f["file_path"] != file_path]
-
-                    return True
-
-            except asyncio.TimeoutError:
-                raise DownloadError("Download timed out")
-            except errors.FloodWait as e:
-                await handle_flood_wait(e, message)
+                return True
+
+            except (errors.FloodWait, DownloadError):
                 raise
             except Exception as e:
                 raise DownloadError(f"Download error: {str(e)}")
 
+    except errors.FloodWait:
+        # The worker pauses the chat and queues the download again; the .part file is kept
+        raise
     except Exception as e:
         error_msg = f"❌ Error downloading {media_type}: {str(e)}"
         logger.error(error_msg)
         
-        if not retry:
-            failed_files.append({
-                "file_path": file_path,
-                "message": message,
-                "media_type": media_type,
-                "error": str(e)
-            })
-            
         try:
             if status_message:
                 await status_message.edit_text(
                     f"{error_msg}\n"
-                    "Use /retry_download to attempt retry."
+                    "Use /retry_download to resume the download."
                 )
         except Exception as edit_error:
             logger.error(f"Error updating status message: {str(edit_error)}")
 
-        if file_path and os.path.exists(file_path):
-            os.remove(file_path)
-            
+        # The .part file is kept so /retry_download can resume from its offset
         return False
 
+async def resume_partial_download(client, message, key, state):
+    """
+    Resumes a partial download found on disk (e.g. after a restart), reporting to message.
+    URL downloads go back through download_from_url, which picks up the saved ranges.
+    Telegram downloads continue from the saved file_id.
+    """
+    if "url" in state:
+        await download_from_url(message, state["url"])
+        return load_state(key) is None
+
+    status_message = await message.reply(
+        f"Resuming download of {os.path.basename(state['file_path'])} "
+        f"from {state['offset']/(1024*1024):.1f} MB..."
+    )
+    try:
+        title = f"{state['media_type']} {os.path.basename(state['file_path'])}"
+        async with metrics.acquire(download_semaphore, "download"), \
+                progress_service.job(status_message, title, state["size"], state["offset"]) as progress:
+            file_path, file_size = await _fetch_telegram(client, state["file_id"], key, state, progress)
+        await status_message.edit_text(
+            f"✅ Resumed download completed!\n"
+            f"📁 File: {os.path.basename(file_path)}\n"
+            f"📊 Size: {file_size/(1024*1024):.1f} MB"
+        )
+        return True
+    except errors.FloodWait:
+        raise
+    except Exception as e:
+        await status_message.edit_text(f"❌ Error resuming {os.path.basename(state['file_path'])}: {str(e)}")
+        return False
+
+async def download_album(messages):
+    """
+    Downloads the members of a media group (album) concurrently, at most
+    ALBUM_CONCURRENCY at a time, under one status message with one summary.
+    Members already in the media index are skipped, so a retried album only
+    fetches what is missing. Returns True when every member is on disk.
+    """
+    items = []
+    skipped = 0
+    failed = []
+    for message in messages:
+        media_info = get_media_type(message)
+        if not media_info:
+            continue
+        if media_index.lookup(media_info.file_unique_id):
+            skipped += 1
+        elif media_info.file_size > MAX_FILE_SIZE:
+            failed.append((media_info.file_name, "exceeds the maximum file size"))
+        else:
+            items.append((message, media_info, *_telegram_state(media_info, media_info.type)))
+
+    status_message = await messages[0].reply(f"Downloading album of {len(messages)} items...")
+    total_size = sum(state["size"] for _, _, _, state in items)
+    limit = asyncio.Semaphore(ALBUM_CONCURRENCY)
+    downloaded = 0
+    duplicates = 0
+
+    async def fetch(message, media_info, key, state, progress):
+        nonlocal downloaded, duplicates
+        async with limit, metrics.acquire(download_semaphore, "download"):
+            try:
+                file_path, _ = await _fetch_telegram(message._client, message, key, state, progress)
+                downloaded += 1
+                duplicates += file_path != state["file_path"]
+            except errors.FloodWait:
+                raise
+            except Exception as e:
+                logger.error(f"Album member {media_info.file_name} failed: {e}")
+                failed.append((media_info.file_name, str(e)))
+
+    current = sum(state["offset"] for _, _, _, state in items)
+    async with progress_service.job(status_message, f"album ({len(items)} items)", total_size, current) as progress:
+        tasks = [asyncio.create_task(fetch(*item, progress)) for item in items]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            # Stop the other members too; the worker requeues the whole album and .part files resume
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    summary = f"✅ Album downloaded: {downloaded}/{len(messages)} items"
+    if skipped:
+        summary += f"\n♻️ Already downloaded before: {skipped}"
+    if duplicates:
+        summary += f"\n♻️ Same content already on disk, kept the existing copy: {duplicates}"
+    if failed:
+        summary += f"\n❌ Failed: {len(failed)}\n" + "\n".join(f"- {name}: {error}" for name, error in failed)
+        summary += "\nUse /retry_download to retry the missing items."
+    await status_message.edit_text(summary)
+    return not failed
+
 async def verify_file_size(message):
     """
     Verifies the file size of the media in the message.
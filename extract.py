@@ -0,0 +1,376 @@
+import io
+import os
+import gzip
+import time
+import shutil
+import asyncio
+import logging
+import tarfile
+import zipfile
+import tempfile
+import subprocess
+import threading
+from contextlib import AsyncExitStack
+from concurrent.futures import ThreadPoolExecutor
+import patoolib
+import humanize
+from config import EXTRACT_FOLDER, PARTIAL_FOLDER, EXTRACT_WORKERS, EXTRACT_MAX_TOTAL_SIZE, EXTRACT_MAX_MEMBERS, WRITE_QUEUE_SIZE
+from file_writer import FileWriter
+from rate_limit import low_priority
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_EXTENSIONS = ('.zip', '.rar', '.tar', '.gz', '.7z')
+TAR_EXTENSIONS = ('.tar', '.tar.gz', '.tgz')
+COPY_BLOCK_SIZE = 1024 * 1024
+# Archives are extracted into PARTIAL_FOLDER/extract-*, which scan and /upload skip
+STAGING_PREFIX = "extract-"
+# 7-Zip builds that can list .7z and .rar archives
+SEVEN_ZIP_BINARIES = ("7z", "7zz", "7za")
+
+# Shared pool so extraction never runs on the event loop
+extract_executor = ThreadPoolExecutor(max_workers=EXTRACT_WORKERS, thread_name_prefix="extract")
+
+class ExtractionError(Exception):
+    """Raised when an archive is empty, unsafe or exceeds the extraction limits."""
+    pass
+
+def _check_limits(member_count, total_size):
+    """Rejects archives that would fill EXTRACT_FOLDER (e.g. zip bombs)."""
+    if member_count == 0:
+        raise ExtractionError("The archive is empty")
+    if member_count > EXTRACT_MAX_MEMBERS:
+        raise ExtractionError(f"Archive has {member_count} members, limit is {EXTRACT_MAX_MEMBERS}")
+    if total_size > EXTRACT_MAX_TOTAL_SIZE:
+        raise ExtractionError(
+            f"Archive expands to {humanize.naturalsize(total_size)}, "
+            f"limit is {humanize.naturalsize(EXTRACT_MAX_TOTAL_SIZE)}"
+        )
+
+def _safe_target(dest, name):
+    """Returns the path for member name inside dest, refusing paths that escape it."""
+    target = os.path.realpath(os.path.join(dest, name))
+    if os.path.commonpath([target, os.path.realpath(dest)]) != os.path.realpath(dest):
+        raise ExtractionError(f"Unsafe path in archive: {name}")
+    return target
+
+def _extract_zip_members(file_path, infos, dest, on_member):
+    """Extracts a group of zip members using this thread's own ZipFile handle."""
+    with zipfile.ZipFile(file_path, "r") as zip_ref:
+        for info in infos:
+            target = _safe_target(dest, info.filename)
+            if info.is_dir():
+                os.makedirs(target, exist_ok=True)
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            # ZipExtFile stops at the declared size and checks the CRC
+            with zip_ref.open(info) as src, open(target, "wb") as dst:
+                while block := src.read(COPY_BLOCK_SIZE):
+                    dst.write(block)
+            on_member(info.filename, info.file_size)
+
+async def _extract_zip(file_path, dest, on_member):
+    with zipfile.ZipFile(file_path, "r") as zip_ref:
+        infos = zip_ref.infolist()
+    _check_limits(len(infos), sum(info.file_size for info in infos))
+
+    # Spread members across workers, largest first, so the groups finish together
+    groups = [[] for _ in range(EXTRACT_WORKERS)]
+    group_sizes = [0] * EXTRACT_WORKERS
+    for info in sorted(infos, key=lambda i: i.file_size, reverse=True):
+        idx = group_sizes.index(min(group_sizes))
+        groups[idx].append(info)
+        group_sizes[idx] += info.file_size
+
+    loop = asyncio.get_running_loop()
+    await asyncio.gather(*(
+        loop.run_in_executor(extract_executor, _extract_zip_members, file_path, group, dest, on_member)
+        for group in groups if group
+    ))
+    return len(infos)
+
+def _extract_tar(file_path, dest, on_member):
+    with tarfile.open(file_path, "r:*") as tar:
+        members = tar.getmembers()
+        _check_limits(len(members), sum(m.size for m in members if m.isfile()))
+        for member in members:
+            _safe_target(dest, member.name)
+            if hasattr(tarfile, "data_filter"):
+                tar.extract(member, dest, filter="data")
+            else:
+                tar.extract(member, dest)
+            on_member(member.name, member.size)
+    return len(members)
+
+def _staging_dir():
+    os.makedirs(PARTIAL_FOLDER, exist_ok=True)
+    return tempfile.mkdtemp(prefix=STAGING_PREFIX, dir=PARTIAL_FOLDER)
+
+def _publish(staging, dest):
+    """
+    Moves everything extracted into staging to the same relative paths in dest,
+    one os.replace per file. Returns the paths of the regular files published.
+    """
+    published = []
+    for root, dirs, files in os.walk(staging):
+        target_root = os.path.normpath(os.path.join(dest, os.path.relpath(root, staging)))
+        os.makedirs(target_root, exist_ok=True)
+        # os.walk doesn't descend into symlinked directories; move the links themselves
+        links = [name for name in dirs if os.path.islink(os.path.join(root, name))]
+        dirs[:] = [name for name in dirs if name not in links]
+        for name in files + links:
+            source = os.path.join(root, name)
+            regular = os.path.isfile(source) and not os.path.islink(source)
+            os.replace(source, os.path.join(target_root, name))
+            if regular:
+                published.append(os.path.join(target_root, name))
+    return published
+
+def remove_stale_staging():
+    """Deletes staging directories left by extractions interrupted by a crash or restart. Call once at startup."""
+    if not os.path.isdir(PARTIAL_FOLDER):
+        return
+    for name in os.listdir(PARTIAL_FOLDER):
+        if name.startswith(STAGING_PREFIX):
+            shutil.rmtree(os.path.join(PARTIAL_FOLDER, name), ignore_errors=True)
+            logger.info(f"Removed unfinished extraction {name}")
+
+def _is_gzip(file_path):
+    with open(file_path, "rb") as f:
+        return f.read(2) == b"\x1f\x8b"
+
+def _extract_gzip(file_path, dest, on_member):
+    """Decompresses a plain .gz file (not a tarball) into dest, stopping at EXTRACT_MAX_TOTAL_SIZE."""
+    name = os.path.basename(file_path)
+    name = name[:-3] if name.lower().endswith(".gz") and len(name) > 3 else f"{name}.out"
+    target = _safe_target(dest, name)
+    written = 0
+    with gzip.open(file_path, "rb") as src, open(target, "wb") as dst:
+        while block := src.read(COPY_BLOCK_SIZE):
+            written += len(block)
+            if written > EXTRACT_MAX_TOTAL_SIZE:
+                _check_limits(1, written)
+            dst.write(block)
+    on_member(name, written)
+    return 1
+
+def _list_7z(file_path):
+    """
+    Returns (members, total_size) from `7z l -slt`, which reads .rar as well as
+    .7z, or None when no 7-Zip is installed or it can't read the archive.
+    """
+    binary = next(filter(None, map(shutil.which, SEVEN_ZIP_BINARIES)), None)
+    if binary is None:
+        return None
+    result = subprocess.run(
+        [binary, "l", "-slt", "--", file_path], stdin=subprocess.DEVNULL, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        return None
+    # Entries follow the dashed line, one "Key = value" block each
+    _, _, listing = result.stdout.partition("\n----------\n")
+    members = 0
+    total_size = 0
+    for block in listing.split("\n\n"):
+        fields = dict(line.split(" = ", 1) for line in block.splitlines() if " = " in line)
+        if "Path" in fields:
+            members += 1
+            total_size += int(fields.get("Size") or 0)
+    return members, total_size
+
+def _count_extracted(dest):
+    """Returns (files, total_size) of what was extracted into dest."""
+    members = 0
+    total_size = 0
+    for root, _, files in os.walk(dest):
+        members += len(files)
+        total_size += sum(os.lstat(os.path.join(root, name)).st_size for name in files)
+    return members, total_size
+
+def _extract_other(file_path, dest):
+    """
+    Extracts .rar/.7z through patoolib and the tool it finds. With 7-Zip installed
+    the limits are checked on its listing before anything is written; either way
+    they are checked on what actually landed in dest (the staging directory).
+    Returns the number of files extracted.
+    """
+    listing = _list_7z(file_path)
+    if listing is not None:
+        _check_limits(*listing)
+    else:
+        logger.warning(f"Can't list {file_path} without 7-Zip, checking the extraction limits afterwards")
+    patoolib.extract_archive(file_path, outdir=dest)
+    members, total_size = _count_extracted(dest)
+    _check_limits(members, total_size)
+    return members
+
+class _ExtractProgress:
+    """Per-member progress shared between extraction threads and the status reporter."""
+
+    def __init__(self):
+        self.members = 0
+        self.bytes = 0
+        self.last = ""
+        self._lock = threading.Lock()
+
+    def on_member(self, name, size):
+        with self._lock:
+            self.members += 1
+            self.bytes += size
+            self.last = name
+
+    async def report(self, status_msg, title):
+        while True:
+            await asyncio.sleep(3)
+            try:
+                with low_priority():
+                    await status_msg.edit_text(
+                        f"{title}\n"
+                        f"Members done: {self.members}\n"
+                        f"Extracted: {humanize.naturalsize(self.bytes)}\n"
+                        f"Last: {self.last}"
+                    )
+            except Exception:
+                pass
+
+async def extract_archive(file_path, status_msg=None, dest=EXTRACT_FOLDER):
+    """
+    Extracts file_path into dest without blocking the event loop.
+    Zip members are extracted in parallel by EXTRACT_WORKERS threads; tar archives
+    are extracted member by member in one thread; plain .gz files are decompressed
+    in one thread; .rar/.7z go through patoolib.
+    Zip and tar archives (and .rar/.7z when 7-Zip can list them) are checked
+    against EXTRACT_MAX_MEMBERS and EXTRACT_MAX_TOTAL_SIZE before anything is
+    written; .gz output stops at EXTRACT_MAX_TOTAL_SIZE.
+    Members go to a staging directory under PARTIAL_FOLDER and are moved into
+    dest only once the whole archive succeeded, so scan and /upload never see
+    half-written files and a failed extraction leaves nothing in dest.
+    Edits status_msg with per-member progress. Returns (number of members,
+    paths of the files published into dest).
+    """
+    os.makedirs(dest, exist_ok=True)
+    loop = asyncio.get_running_loop()
+    progress = _ExtractProgress()
+    title = f"Extracting {os.path.basename(file_path)}..."
+    reporter = asyncio.create_task(progress.report(status_msg, title)) if status_msg else None
+    start_time = time.time()
+    staging = _staging_dir()
+    try:
+        if zipfile.is_zipfile(file_path):
+            count = await _extract_zip(file_path, staging, progress.on_member)
+        elif tarfile.is_tarfile(file_path):
+            count = await loop.run_in_executor(extract_executor, _extract_tar, file_path, staging, progress.on_member)
+        elif _is_gzip(file_path):
+            count = await loop.run_in_executor(extract_executor, _extract_gzip, file_path, staging, progress.on_member)
+        else:
+            count = await loop.run_in_executor(extract_executor, _extract_other, file_path, staging)
+        files = await loop.run_in_executor(extract_executor, _publish, staging, dest)
+    finally:
+        if reporter:
+            reporter.cancel()
+        await loop.run_in_executor(extract_executor, shutil.rmtree, staging, True)
+    logger.info(f"Extracted {count} members from {file_path} in {time.time() - start_time:.1f}s")
+    return count, files
+
+def is_tar_name(file_name):
+    """Returns True for names that stream_extract_tar can handle."""
+    return file_name.lower().endswith(TAR_EXTENSIONS)
+
+class _ChunkStream(io.RawIOBase):
+    """
+    Read-only file object for a worker thread, fed with chunks from the event loop
+    through a bounded asyncio.Queue. None marks the end of the stream.
+    """
+
+    def __init__(self, queue, loop):
+        self._queue = queue
+        self._loop = loop
+        self._buffer = memoryview(b"")
+        self._eof = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buffer:
+            if self._eof:
+                return 0
+            chunk = asyncio.run_coroutine_threadsafe(self._queue.get(), self._loop).result()
+            if chunk is None:
+                self._eof = True
+                return 0
+            self._buffer = memoryview(chunk)
+        size = min(len(b), len(self._buffer))
+        b[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+def _extract_tar_stream(stream, dest, on_member):
+    """Extracts members as they arrive, enforcing the limits incrementally."""
+    members = 0
+    total_size = 0
+    with tarfile.open(fileobj=stream, mode="r|*") as tar:
+        for member in tar:
+            members += 1
+            total_size += member.size if member.isfile() else 0
+            if members > EXTRACT_MAX_MEMBERS or total_size > EXTRACT_MAX_TOTAL_SIZE:
+                _check_limits(members, total_size)
+            _safe_target(dest, member.name)
+            if hasattr(tarfile, "data_filter"):
+                tar.extract(member, dest, filter="data")
+            else:
+                tar.extract(member, dest)
+            on_member(member.name, member.size)
+    if members == 0:
+        raise ExtractionError("The archive is empty")
+    return members
+
+async def stream_extract_tar(chunks, title, status_msg=None, keep_path=None, dest=EXTRACT_FOLDER):
+    """
+    Extracts a .tar/.tar.gz while it downloads: chunks (an async iterator of bytes)
+    are fed straight into a streaming tar reader running in a worker thread, so
+    members land in dest as the bytes arrive. The archive itself is only written
+    to keep_path if given. Limits are enforced as members are read.
+    Like extract_archive, members are staged under PARTIAL_FOLDER and moved into
+    dest once the whole archive has been read. Returns (number of members, paths
+    of the files published into dest).
+    """
+    os.makedirs(dest, exist_ok=True)
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=WRITE_QUEUE_SIZE)
+    progress = _ExtractProgress()
+    reporter = asyncio.create_task(progress.report(status_msg, title)) if status_msg else None
+    staging = _staging_dir()
+    extractor = loop.run_in_executor(
+        extract_executor, _extract_tar_stream, _ChunkStream(queue, loop), staging, progress.on_member
+    )
+    try:
+        async with AsyncExitStack() as stack:
+            writer = await stack.enter_async_context(FileWriter(keep_path, "wb")) if keep_path else None
+            async for chunk in chunks:
+                if writer:
+                    await writer.write(chunk)
+                # Stop feeding as soon as the reader fails (e.g. a limit was hit)
+                put = asyncio.ensure_future(queue.put(chunk))
+                await asyncio.wait({put, extractor}, return_when=asyncio.FIRST_COMPLETED)
+                if extractor.done():
+                    put.cancel()
+                    break
+        if not extractor.done():
+            await queue.put(None)
+        count = await extractor
+        files = await loop.run_in_executor(extract_executor, _publish, staging, dest)
+        return count, files
+    except BaseException:
+        if not extractor.done():
+            # Unblock the reader so the worker thread exits
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(None)
+        raise
+    finally:
+        if reporter:
+            reporter.cancel()
+        # The reader thread has been unblocked; let it stop writing before the cleanup
+        await asyncio.gather(extractor, return_exceptions=True)
+        await loop.run_in_executor(extract_executor, shutil.rmtree, staging, True)
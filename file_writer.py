@@ -0,0 +1,83 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from config import WRITE_QUEUE_SIZE, WRITER_THREADS
+
+# Shared pool for all blocking file writes
+write_executor = ThreadPoolExecutor(max_workers=WRITER_THREADS, thread_name_prefix="file-writer")
+
+class FileWriter:
+    """
+    Writes chunks to a file from a thread pool so slow disks never block the event loop.
+    Chunks pass through a bounded queue: when the disk falls behind, write() waits
+    for a free slot, which throttles the network reader feeding it.
+
+    An optional BlockHasher is fed every chunk as it is written.
+
+    Usage:
+        async with FileWriter(path, "wb") as writer:
+            await writer.write(chunk)
+    """
+
+    def __init__(self, file_path, mode="wb", queue_size=WRITE_QUEUE_SIZE, hasher=None):
+        self.file_path = file_path
+        self.mode = mode
+        self.hasher = hasher
+        self.written = 0
+        self._position = 0
+        self._queue = asyncio.Queue(maxsize=queue_size)
+        self._file = None
+        self._task = None
+        self._error = None
+
+    async def __aenter__(self):
+        loop = asyncio.get_running_loop()
+        self._file = await loop.run_in_executor(write_executor, open, self.file_path, self.mode)
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        # Drain what was already queued so resume metadata matches the bytes on disk
+        await self._queue.put(None)
+        await self._task
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(write_executor, self._file.close)
+        if self._error and exc is None:
+            raise self._error
+
+    async def write(self, data, offset=None, on_written=None):
+        """
+        Queues data for writing (at offset, if given). on_written(len(data)) is
+        called once the bytes are on disk. Waits while the queue is full.
+        """
+        if self._error:
+            raise self._error
+        await self._queue.put((data, offset, on_written))
+
+    def _write_sync(self, data, offset):
+        if offset is None:
+            offset = self._position
+        self._file.seek(offset)
+        self._file.write(data)
+        self._file.flush()
+        self._position = offset + len(data)
+        if self.hasher:
+            # Hash in the writer thread while the chunk is still in memory
+            self.hasher.update(offset, data, self._file if self._file.readable() else None)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            if self._error:
+                continue
+            data, offset, on_written = item
+            try:
+                await loop.run_in_executor(write_executor, self._write_sync, data, offset)
+            except Exception as e:
+                self._error = e
+                continue
+            self.written += len(data)
+            if on_written:
+                on_written(len(data))
@@ -1,50 +1,83 @@
 import asyncio
+import logging
 from datetime import datetime, timedelta
+from rate_limit import low_priority
+
+logger = logging.getLogger(__name__)
 
 # Global dictionary to track flood wait status per chat
 flood_wait_status = {}
+# One "resumed" notice task per paused chat
+_notices = {}
+# Called with the chat id when a pause ends (e.g. to wake the download workers)
+_resume_listeners = []
 
-async def handle_flood_wait(error, message):
+def add_resume_listener(callback):
+    """Registers callback(chat_id), called when a chat's FloodWait pause ends."""
+    _resume_listeners.append(callback)
+
+def pause_chat(chat_id, wait_time, message=None):
     """
-    Handles Telegram FloodWait errors with notifications.
+    Pauses a chat until its FloodWait is over, without blocking the caller.
+    Queued work for the chat is skipped until then (see paused_chats); a timer
+    ends the pause. With message, the chat is told once the pause is over;
+    nothing is posted while its Bot API bucket is paused.
+    A second FloodWait while paused only extends the deadline.
+    """
+    now = datetime.now()
+    end_time = now + timedelta(seconds=wait_time)
+    current = flood_wait_status.get(chat_id)
+    if current and current['end_time'] >= end_time:
+        return
+    flood_wait_status[chat_id] = {
+        'end_time': end_time,
+        'wait_time': wait_time,
+        'start_time': current['start_time'] if current else now
+    }
+    logger.warning(f"Chat {chat_id} paused for {wait_time}s by FloodWait")
+    asyncio.get_running_loop().call_later(wait_time, _end_pause, chat_id)
+    if message is not None and chat_id not in _notices:
+        _notices[chat_id] = asyncio.create_task(_notify_resumed(chat_id, message))
+
+def _remaining(chat_id):
+    status = flood_wait_status.get(chat_id)
+    return (status['end_time'] - datetime.now()).total_seconds() if status else 0
+
+def _end_pause(chat_id):
+    if _remaining(chat_id) > 0:
+        # Extended by a later FloodWait; that one's timer ends it
+        return
+    flood_wait_status.pop(chat_id, None)
+    for callback in _resume_listeners:
+        callback(chat_id)
+
+def paused_chats():
+    """Returns the ids of the chats currently paused by a FloodWait."""
+    return {chat_id for chat_id in flood_wait_status if _remaining(chat_id) > 0}
+
+async def _notify_resumed(chat_id, message):
+    """
+    Sends one message when the chat's pause is over. Anything sent earlier would
+    only wait in the chat's paused Bot API bucket, so no countdown is kept.
     """
     try:
-        wait_time = error.value
-        chat_id = message.chat.id
-        end_time = datetime.now() + timedelta(seconds=wait_time)
-        
-        # Store flood wait status
-        flood_wait_status[chat_id] = {
-            'end_time': end_time,
-            'wait_time': wait_time,
-            'start_time': datetime.now()
-        }
-        
-        status_message = await message.reply(
-            f"⚠️ FloodWait activated!\n"
-            f"⏳ Please wait {wait_time} seconds.\n"
-            f"⏰ Resuming at: {end_time.strftime('%H:%M:%S')}"
-        )
-        
-        # Update the countdown every second
-        while datetime.now() < end_time:
-            remaining = (end_time - datetime.now()).total_seconds()
-            await asyncio.sleep(1)
-            # Optionally, update every 10 seconds
-            if int(remaining) % 10 == 0:
-                await status_message.edit_text(
-                    f"⚠️ FloodWait active!\n"
-                    f"⏳ Remaining: {int(remaining)} seconds\n"
-                    f"⏰ Resuming at: {end_time.strftime('%H:%M:%S')}"
-                )
-        
-        # Remove flood wait status
-        flood_wait_status.pop(chat_id, None)
-        await status_message.edit_text("✅ FloodWait period ended. Resuming operations.")
-        
+        start_time = flood_wait_status[chat_id]['start_time']
+        # A later FloodWait may extend the pause while we sleep
+        while (remaining := _remaining(chat_id)) > 0:
+            await asyncio.sleep(remaining)
+        paused = int((datetime.now() - start_time).total_seconds())
+        with low_priority():
+            await message.reply(f"✅ Downloads in this chat were paused for {paused} seconds by a FloodWait and have resumed.")
     except Exception as e:
-        print(f"Error in flood wait handler: {e}")
-        flood_wait_status.pop(message.chat.id, None)
+        logger.error(f"Error sending the FloodWait notice for chat {chat_id}: {e}")
+    finally:
+        _notices.pop(chat_id, None)
+
+async def handle_flood_wait(error, message):
+    """
+    Handles Telegram FloodWait errors: pauses the chat and returns straight away.
+    """
+    pause_chat(message.chat.id, error.value, message)
 
 async def check_flood_wait_status(chat_id):
     """
@@ -1,25 +1,32 @@
 import os
 import asyncio
-from pyrogram import Client, filters, errors
-from config import API_ID, API_HASH, BOT_TOKEN, BASE_DOWNLOAD_FOLDER
+from pyrogram import filters, errors
+from config import API_ID, API_HASH, BOT_TOKEN, BASE_DOWNLOAD_FOLDER, MAX_CONCURRENT_TRANSMISSIONS
 from system_monitor import get_system_stats
-from download import download_from_url, download_with_progress, failed_files
+from download import reply_if_known
+from workers import job_queue, enqueue_download, enqueue_url, retry_failed
 from upload import upload_to_google_photos, retry_upload_command
+from upload_pipeline import pending_uploads
+import upload_manifest
 from flood_control import handle_flood_wait, check_flood_wait_status
 from media_type_detection import get_media_type
+from rate_limit import RateLimitedClient
+from album import collect_album_message
 
 # Global state flags
 downloading = False
 uploading = False
 
-# Initialize the bot client
-app = Client(
+# Initialize the bot client; replies and edits are rate limited to avoid FloodWait,
+# and their FloodWait is raised to the caller (which pauses the chat). Other calls
+# (sign-in, lookups, file transfers) still sleep through waits up to sleep_threshold
+app = RateLimitedClient(
     "telegram_downloader",
     api_id=API_ID,
     api_hash=API_HASH,
     bot_token=BOT_TOKEN,
     sleep_threshold=100,
-    max_concurrent_transmissions=10
+    max_concurrent_transmissions=MAX_CONCURRENT_TRANSMISSIONS
 )
 # /start command handler
 @app.on_message(filters.command("start"))
@@ -46,19 +53,31 @@ async def status_command(client, message):
         stats = await get_system_stats()
         is_waiting, remaining_time = await check_flood_wait_status(message.chat.id)
         flood_status = f"⚠️ FloodWait active: {int(remaining_time)}s" if is_waiting else "✅ Normal"
-        active_downloads = 0  # Placeholder for active downloads count
-        try:
-            active_downloads = len(app.get_active_connections())
-        except AttributeError:
-            pass
+        jobs = job_queue.counts()
+        active_downloads = jobs.get("running", 0)
+        queued_lanes = job_queue.lane_counts()
+        queued_chats = job_queue.chat_counts()
+        upload_failures = upload_manifest.failure_counts()
+        failure_classes = ", ".join(f"{name}: {count}" for name, count in sorted(upload_failures.items()))
+        chat_depths = "".join(
+            f"\n  {'this chat' if chat_id == message.chat.id else chat_id}: {count}"
+            for chat_id, count in list(queued_chats.items())[:5]
+        )
         await message.reply(
             f"📊 System Status:\n"
             f"CPU: {stats['cpu_usage']}\n"
             f"RAM: {stats['ram_usage']}\n"
             f"Disk: {stats['disk_space']}\n"
+            f"Network: {stats['network']}\n"
+            f"Disk I/O: {stats['disk_io']}\n"
             f"Bot status: {flood_status}\n"
             f"Active downloads: {active_downloads}\n"
-            f"Failed downloads: {len(failed_files)}"
+            f"Queued downloads: {jobs.get('queued', 0)} "
+            f"(small: {queued_lanes.get('small', 0)}, large: {queued_lanes.get('large', 0)})\n"
+            f"Failed downloads: {jobs.get('failed', 0)}\n"
+            f"Pending uploads: {pending_uploads()}\n"
+            f"Failed uploads: {sum(upload_failures.values())}{f' ({failure_classes})' if failure_classes else ''}\n"
+            f"Queued per chat ({len(queued_chats)} chats):{chat_depths or ' none'}"
         )
     except Exception as e:
         await message.reply(f"Error retrieving system status: {str(e)}")
@@ -73,7 +92,7 @@ async def download_command(client, message):
         if len(args) > 1:
             url = args[1].strip()
             if url.startswith("http"):
-                await download_from_url(message, url)
+                enqueue_url(url, message)
             else:
                 await message.reply("Invalid URL. Please provide a valid URL.")
             return
@@ -138,41 +157,12 @@ async def retry_upload_handler(client, message):
 @app.on_message(filters.command("retry_download"))
 async def retry_download_command(client, message):
     try:
-        if not failed_files:
+        retries = retry_failed(message)
+        if not retries:
             await message.reply("No failed downloads to retry.")
             return
-
-        status_message = await message.reply(f"Retrying {len(failed_files)} failed downloads...")
-        retry_failed = []
-        successful_retries = 0
-
-        for file_info in failed_files[:]:
-            file_path = file_info["file_path"]
-            try:
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-                # Retry download using the original message and media type
-                await download_with_progress(file_info["message"], file_info["media_type"], retry=True)
-                failed_files.remove(file_info)
-                successful_retries += 1
-                if successful_retries % 5 == 0:
-                    await status_message.edit_text(
-                        f"Retried {successful_retries} downloads..."
-                    )
-            except errors.FloodWait as e:
-                await handle_flood_wait(e, message)
-            except Exception as e:
-                retry_failed.append({"file": file_path, "error": str(e)})
-        summary = (
-            f"Retry summary:\n"
-            f"✅ Successful: {successful_retries}\n"
-            f"❌ Failed: {len(retry_failed)}"
-        )
-        if retry_failed:
-            summary += "\n\nErrors:"
-            for fail in retry_failed:
-                summary += f"\n- {fail['file']}: {fail['error']}"
-        await status_message.edit_text(summary)
+        # Failed downloads continue from their .part files in the worker pool
+        await message.reply(f"Retrying {retries} failed downloads in the background...")
     except errors.FloodWait as e:
         await handle_flood_wait(e, message)
     except Exception as e:
@@ -208,12 +198,26 @@ async def handle_forwarded_message(client, message):
 
 async def process_forwarded_message(client, message):
     try:
+        # Album items are queued together as one batch job
+        if message.media_group_id:
+            collect_album_message(message)
+            return
+
         media_info = get_media_type(message)
         if not media_info:
             await message.reply("No valid media found in forwarded message.")
             return
 
-        await download_with_progress(message, media_info.type)
+        # Skip the download entirely for media we already have
+        if await reply_if_known(message, media_info):
+            return
+
+        enqueue_download(
+            "telegram",
+            {"media_type": media_info.type, "file_unique_id": media_info.file_unique_id},
+            message,
+            media_info.file_size
+        )
     except errors.FloodWait as e:
         await handle_flood_wait(e, message)
     except Exception as e:
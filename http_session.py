@@ -0,0 +1,37 @@
+import aiohttp
+import logging
+from config import HTTP_MAX_CONNECTIONS, HTTP_MAX_CONNECTIONS_PER_HOST, HTTP_DNS_CACHE_TTL, HTTP_KEEPALIVE_TIMEOUT, HTTP_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+# Process-wide session shared by every URL download
+_session = None
+
+def get_session():
+    """
+    Returns the shared aiohttp session, creating it on first use.
+    Connections are kept alive and DNS lookups are cached, so repeated
+    requests to the same host reuse the existing TCP/TLS connection.
+    """
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=HTTP_MAX_CONNECTIONS,
+            limit_per_host=HTTP_MAX_CONNECTIONS_PER_HOST,
+            ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+            keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT
+        )
+        timeout = aiohttp.ClientTimeout(total=HTTP_TIMEOUT)
+        _session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        logger.info("Created shared HTTP session")
+    return _session
+
+async def close_session():
+    """
+    Closes the shared session. Called once on bot shutdown.
+    """
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+        logger.info("Closed shared HTTP session")
+    _session = None
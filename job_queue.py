@@ -0,0 +1,279 @@
+import json
+import time
+import sqlite3
+import logging
+from collections import Counter
+from dataclasses import dataclass
+from config import SMALL_FILE_LIMIT, LARGE_LANE_SLOTS, SCHEDULER_AGING_RATE, CHAT_WEIGHTS, DEFAULT_CHAT_WEIGHT
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    chat_id INTEGER,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    size INTEGER,
+    lane TEXT NOT NULL DEFAULT 'large',
+    priority REAL
+);
+"""
+
+# Created after _migrate() so older databases get the columns first
+INDEXES = """
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id);
+CREATE INDEX IF NOT EXISTS jobs_lane ON jobs (status, lane, id);
+CREATE INDEX IF NOT EXISTS jobs_chat ON jobs (status, chat_id, priority);
+CREATE INDEX IF NOT EXISTS jobs_chat_lane ON jobs (status, chat_id, lane, priority);
+CREATE INDEX IF NOT EXISTS jobs_priority ON jobs (status, priority);
+CREATE INDEX IF NOT EXISTS jobs_lane_priority ON jobs (status, lane, priority);
+"""
+
+@dataclass
+class Job:
+    """A unit of work taken from the queue."""
+    id: int
+    kind: str
+    payload: dict
+    chat_id: int
+    attempts: int
+    created: float = None
+
+class JobQueue:
+    """
+    Durable job queue in a WAL-mode SQLite database.
+    Every state change is committed, so after a crash or restart the queue
+    continues exactly where it stopped: jobs that were running are queued again.
+
+    Scheduling is size-aware. Jobs smaller than small_file_limit are "small";
+    bigger jobs and jobs of unknown size are "large", and at most large_lane_slots
+    large jobs run at once, so a few huge videos can't take every worker while
+    small photos wait behind them. Among the jobs allowed to run, the shortest
+    goes first (shortest_first), with aging_rate bytes taken off a job's size
+    for every second it has waited so big jobs still get their turn.
+    With shortest_first=False jobs are claimed in arrival order.
+
+    With fair=True chats share the workers by weighted fair queuing: each chat
+    is charged the bytes of the jobs it starts divided by its weight (weights,
+    default_weight), and the next job comes from the waiting chat charged least.
+    A chat forwarding a 500-message album only delays itself; a chat that starts
+    waiting joins at the lowest charge, so it can't bank credit while idle.
+    Charges live in memory and start even after a restart, as do the queued job
+    counts per chat and lane that pick the waiting chats without scanning the queue.
+    Used from the event loop thread only.
+    """
+
+    def __init__(self, db_path, small_file_limit=SMALL_FILE_LIMIT, large_lane_slots=LARGE_LANE_SLOTS,
+                 shortest_first=True, aging_rate=SCHEDULER_AGING_RATE, fair=True,
+                 weights=CHAT_WEIGHTS, default_weight=DEFAULT_CHAT_WEIGHT, clock=time.time):
+        self.db_path = db_path
+        self.small_file_limit = small_file_limit
+        self.large_lane_slots = large_lane_slots
+        self.shortest_first = shortest_first
+        self.aging_rate = aging_rate
+        self.fair = fair
+        self.weights = weights
+        self.default_weight = default_weight
+        self._clock = clock
+        # Weighted bytes started per waiting chat
+        self._charged = {}
+        self._conn = sqlite3.connect(db_path, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._migrate()
+        self._conn.executescript(INDEXES)
+        # Queued jobs by (chat_id, lane); zero counts are dropped
+        self._queued = Counter()
+        self._count_queued()
+
+    def _count_queued(self):
+        self._queued = Counter({
+            (chat_id, lane): count for chat_id, lane, count in self._conn.execute(
+                "SELECT chat_id, lane, COUNT(*) FROM jobs WHERE status = 'queued' GROUP BY chat_id, lane"
+            )
+        })
+
+    def _migrate(self):
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        if "size" not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN size INTEGER")
+        if "lane" not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN lane TEXT NOT NULL DEFAULT 'large'")
+        if "priority" not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN priority REAL")
+            self._conn.execute(
+                "UPDATE jobs SET priority = COALESCE(size, ?) + created * ?", (self.small_file_limit, self.aging_rate)
+            )
+
+    def lane_for(self, size):
+        """Returns the lane for a job of size bytes (None if unknown)."""
+        return "small" if size is not None and size < self.small_file_limit else "large"
+
+    def priority_for(self, size, created):
+        """
+        Shortest-first rank with aging: a job's size minus aging_rate for every second it
+        has waited. The "now" term is the same for every job, so ranking by
+        size + created * aging_rate gives the same order and can be stored and indexed.
+        Unknown sizes rank like a file just over the small lane limit.
+        """
+        return (size if size is not None else self.small_file_limit) + created * self.aging_rate
+
+    def enqueue(self, kind, payload, chat_id=None, size=None):
+        """Adds a job and returns its id. size is the expected download size in bytes, if known."""
+        now = self._clock()
+        lane = self.lane_for(size)
+        cursor = self._conn.execute(
+            "INSERT INTO jobs (kind, payload, chat_id, created, updated, size, lane, priority) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (kind, json.dumps(payload), chat_id, now, now, size, lane, self.priority_for(size, now))
+        )
+        self._queued[chat_id, lane] += 1
+        return cursor.lastrowid
+
+    def resize(self, job_id, size):
+        """
+        Sets the size of a job that is still queued (e.g. once a URL has been probed),
+        moving it to the matching lane and rank. Returns False if it was already claimed.
+        """
+        row = self._conn.execute(
+            "SELECT chat_id, lane, created FROM jobs WHERE id = ? AND status = 'queued'", (job_id,)
+        ).fetchone()
+        if row is None:
+            return False
+        chat_id, old_lane, created = row
+        lane = self.lane_for(size)
+        self._conn.execute(
+            "UPDATE jobs SET size = ?, lane = ?, priority = ? WHERE id = ?",
+            (size, lane, self.priority_for(size, created), job_id)
+        )
+        self._uncount(chat_id, old_lane)
+        self._queued[chat_id, lane] += 1
+        return True
+
+    def claim(self, exclude_chats=()):
+        """
+        Marks the next job as running and returns it, or None if nothing can run now
+        (the queue is empty, or only large jobs are queued and the large lane is full).
+        Jobs of the chats in exclude_chats (e.g. paused by a FloodWait) stay queued.
+        """
+        now = self._clock()
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            running_large = self._conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = 'running' AND lane = 'large'"
+            ).fetchone()[0]
+            small_only = running_large >= self.large_lane_slots
+            lane_filter = "AND lane = 'small'" if small_only else ""
+            chat_filter, params = "", []
+            if self.fair:
+                chat_id = self._next_chat(small_only, exclude_chats)
+                chat_filter, params = "AND chat_id IS ?", [chat_id]
+            elif exclude_chats:
+                chat_filter = f"AND chat_id NOT IN ({', '.join('?' for _ in exclude_chats)})"
+                params = list(exclude_chats)
+            order = "priority, id" if self.shortest_first else "id"
+            row = self._conn.execute(
+                f"SELECT id, kind, payload, chat_id, attempts, size, created, lane FROM jobs "
+                f"WHERE status = 'queued' {lane_filter} {chat_filter} ORDER BY {order} LIMIT 1",
+                params
+            ).fetchone()
+            if row is None:
+                self._conn.execute("COMMIT")
+                return None
+            self._conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, updated = ? WHERE id = ?",
+                (now, row[0])
+            )
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._uncount(row[3], row[7])
+        if self.fair:
+            size = row[5] if row[5] is not None else self.small_file_limit
+            self._charged[row[3]] += size / self.weights.get(row[3], self.default_weight)
+        return Job(id=row[0], kind=row[1], payload=json.loads(row[2]), chat_id=row[3], attempts=row[4] + 1, created=row[6])
+
+    def _uncount(self, chat_id, lane):
+        self._queued[chat_id, lane] -= 1
+        if self._queued[chat_id, lane] <= 0:
+            del self._queued[chat_id, lane]
+
+    def _next_chat(self, small_only, exclude_chats=()):
+        """Returns the waiting chat with the lowest charge that has a job allowed to run now."""
+        waiting = {chat for chat, _ in self._queued}
+        # Forget chats that stopped waiting; newcomers start level with the lowest charge
+        floor = min((self._charged[chat] for chat in waiting if chat in self._charged), default=0)
+        self._charged = {chat: self._charged.get(chat, floor) for chat in waiting}
+        if small_only:
+            waiting = {chat for chat, lane in self._queued if lane == "small"}
+        waiting = [chat for chat in waiting if chat not in exclude_chats]
+        return min(waiting, key=self._charged.__getitem__, default=None)
+
+    def complete(self, job_id):
+        """Removes a finished job."""
+        self._conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def release(self, job_id):
+        """Puts a running job back in the queue without counting it as failed."""
+        row = self._conn.execute(
+            "UPDATE jobs SET status = 'queued', updated = ? WHERE id = ? AND status = 'running' RETURNING chat_id, lane",
+            (self._clock(), job_id)
+        ).fetchone()
+        if row is not None:
+            self._queued[row[0], row[1]] += 1
+
+    def fail(self, job_id, error):
+        """Keeps a failed job so /retry_download can queue it again."""
+        self._conn.execute(
+            "UPDATE jobs SET status = 'failed', error = ?, updated = ? WHERE id = ?",
+            (str(error), self._clock(), job_id)
+        )
+
+    def requeue(self, status):
+        """Moves every job with the given status back to the queue. Returns how many."""
+        cursor = self._conn.execute(
+            "UPDATE jobs SET status = 'queued', updated = ? WHERE status = ?", (self._clock(), status)
+        )
+        if cursor.rowcount:
+            self._count_queued()
+        return cursor.rowcount
+
+    def recover(self):
+        """Requeues jobs left running by a crash or restart. Call once at startup."""
+        count = self.requeue("running")
+        if count:
+            logger.info(f"Requeued {count} jobs interrupted by the last shutdown")
+        return count
+
+    def counts(self):
+        """Returns {status: number of jobs}."""
+        return dict(self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+    def chat_counts(self, status="queued"):
+        """Returns {chat_id: number of jobs} for jobs with the given status, deepest first."""
+        return dict(self._conn.execute(
+            "SELECT chat_id, COUNT(*) FROM jobs WHERE status = ? GROUP BY chat_id ORDER BY COUNT(*) DESC", (status,)
+        ).fetchall())
+
+    def lane_counts(self, status="queued"):
+        """Returns {lane: number of jobs} for jobs with the given status."""
+        return dict(self._conn.execute(
+            "SELECT lane, COUNT(*) FROM jobs WHERE status = ? GROUP BY lane", (status,)
+        ).fetchall())
+
+    def payloads(self, statuses=("queued", "running", "failed")):
+        """Returns the payloads of all jobs in the given statuses."""
+        placeholders = ", ".join("?" for _ in statuses)
+        rows = self._conn.execute(f"SELECT payload FROM jobs WHERE status IN ({placeholders})", statuses)
+        return [json.loads(row[0]) for row in rows]
+
+    def close(self):
+        self._conn.close()
@@ -1,11 +1,42 @@
 from handlers import app
 import os
-from config import BASE_DOWNLOAD_FOLDER
+from pyrogram import idle
+from config import BASE_DOWNLOAD_FOLDER, UPLOAD_PIPELINE, METRICS_ENABLED
 from handlers import delete_command
+from http_session import close_session
+from workers import start_workers, stop_workers
+from upload_pipeline import start_pipeline, stop_pipeline
+from metrics import start_metrics_server, stop_metrics_server
+from system_monitor import start_sampler, stop_sampler
+from extract import remove_stale_staging
+
+async def main():
+    await app.start()
+    # Staging directories of extractions cut off by the last shutdown
+    remove_stale_staging()
+    # /status reads CPU, RAM and I/O trends from here instead of measuring on demand
+    start_sampler()
+    if METRICS_ENABLED:
+        await start_metrics_server()
+    if UPLOAD_PIPELINE:
+        # Upload each download as soon as it finishes instead of waiting for /upload
+        await start_pipeline()
+    # Drain the durable download queue, including jobs left over from the last run
+    start_workers(app)
+    try:
+        await idle()
+    finally:
+        await stop_workers()
+        await app.stop()
+        await stop_pipeline()
+        await stop_metrics_server()
+        await stop_sampler()
+        # Release pooled HTTP connections
+        await close_session()
 
 if __name__ == "__main__":
     print("Bot is starting...")
     # Ensure download folder exists
     if not os.path.exists(BASE_DOWNLOAD_FOLDER):
         os.makedirs(BASE_DOWNLOAD_FOLDER)
-    app.run()
+    app.run(main())
@@ -0,0 +1,64 @@
+import os
+import time
+import logging
+from state_db import get_db
+
+logger = logging.getLogger(__name__)
+
+# Telegram gives every file a file_unique_id that stays the same across forwards,
+# so it identifies media we already have before any byte is downloaded.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS media (
+    file_unique_id TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    uploaded INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS media_path ON media (path);
+"""
+
+def _db():
+    return get_db("media_index.db", SCHEMA)
+
+def lookup(file_unique_id):
+    """
+    Returns {"path", "size", "uploaded"} for media we already have (on disk or
+    uploaded), or None. Entries whose file vanished without being uploaded are dropped.
+    Primary-key lookup, so the cost doesn't grow with the index.
+    """
+    if not file_unique_id:
+        return None
+    row = _db().execute(
+        "SELECT path, size, uploaded FROM media WHERE file_unique_id = ?", (file_unique_id,)
+    ).fetchone()
+    if row is None:
+        return None
+    path, size, uploaded = row
+    if uploaded or (os.path.exists(path) and os.path.getsize(path) == size):
+        return {"path": path, "size": size, "uploaded": bool(uploaded)}
+    forget(file_unique_id)
+    return None
+
+def record(file_unique_id, path, size):
+    """Records a completed download."""
+    if not file_unique_id:
+        return
+    conn = _db()
+    conn.execute(
+        "INSERT OR REPLACE INTO media (file_unique_id, path, size, uploaded, created) VALUES (?, ?, ?, 0, ?)",
+        (file_unique_id, path, size, time.time())
+    )
+    conn.commit()
+
+def forget(file_unique_id):
+    """Removes an entry so the media is downloaded again next time."""
+    conn = _db()
+    conn.execute("DELETE FROM media WHERE file_unique_id = ?", (file_unique_id,))
+    conn.commit()
+
+def mark_files_uploaded(paths):
+    """Marks the indexed files at paths as uploaded."""
+    conn = _db()
+    conn.executemany("UPDATE media SET uploaded = 1 WHERE path = ?", [(path,) for path in paths])
+    conn.commit()
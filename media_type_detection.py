@@ -11,6 +11,8 @@ class MediaInfo:
     mime_type: Optional[str] = None
     width: Optional[int] = None
     height: Optional[int] = None
+    file_id: Optional[str] = None
+    file_unique_id: Optional[str] = None
 
 def get_media_type(message) -> Optional[MediaInfo]:
     """
@@ -26,6 +28,8 @@ def get_media_type(message) -> Optional[MediaInfo]:
                 type="photo",
                 file_name=file_name,
                 file_size=photo.file_size,
+                file_id=photo.file_id,
+                file_unique_id=photo.file_unique_id,
                 mime_type="image/jpeg",
                 width=photo.width,
                 height=photo.height
@@ -39,6 +43,8 @@ def get_media_type(message) -> Optional[MediaInfo]:
                 type="video",
                 file_name=file_name,
                 file_size=video.file_size,
+                file_id=video.file_id,
+                file_unique_id=video.file_unique_id,
                 mime_type=video.mime_type,
                 width=video.width,
                 height=video.height
@@ -52,6 +58,8 @@ def get_media_type(message) -> Optional[MediaInfo]:
                 type="document",
                 file_name=file_name,
                 file_size=doc.file_size,
+                file_id=doc.file_id,
+                file_unique_id=doc.file_unique_id,
                 mime_type=doc.mime_type
             )
         # Handle forwarded photo
@@ -63,6 +71,8 @@ def get_media_type(message) -> Optional[MediaInfo]:
                 type="photo",
                 file_name=file_name,
                 file_size=photo.file_size,
+                file_id=photo.file_id,
+                file_unique_id=photo.file_unique_id,
                 mime_type="image/jpeg",
                 width=photo.width,
                 height=photo.height
@@ -76,6 +86,8 @@ def get_media_type(message) -> Optional[MediaInfo]:
                 type="video",
                 file_name=file_name,
                 file_size=video.file_size,
+                file_id=video.file_id,
+                file_unique_id=video.file_unique_id,
                 mime_type=video.mime_type,
                 width=video.width,
                 height=video.height
@@ -89,6 +101,8 @@ def get_media_type(message) -> Optional[MediaInfo]:
                 type="document",
                 file_name=file_name,
                 file_size=doc.file_size,
+                file_id=doc.file_id,
+                file_unique_id=doc.file_unique_id,
                 mime_type=doc.mime_type
             )
 
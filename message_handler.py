@@ -1,10 +1,10 @@
 # message_handler.py
 
 import os
-import asyncio
 from pyrogram import Client, filters, errors
 from config import BASE_DOWNLOAD_FOLDER, SUPPORTED_MEDIA_TYPES, logger
-from download import download_from_url, download_with_progress
+from workers import enqueue_download, enqueue_url
+from album import collect_album_message
 from flood_control import handle_flood_wait
 from media_type_detection import get_media_type
 from handlers import app
@@ -30,18 +30,23 @@ async def handle_message(client, message):
         # Nếu tin nhắn có text bắt đầu bằng http -> xử lý download từ URL
         if message.text and message.text.strip().startswith("http"):
             url = message.text.strip()
-            await download_from_url(message, url)
+            enqueue_url(url, message)
             return
 
-        tasks = []
+        # Tin nhắn thuộc album: gom cả album thành một job tải xuống
+        if message.media_group_id:
+            collect_album_message(message)
+            return
+
+        media_type = None
         # Nếu tin nhắn có ảnh
         if message.photo:
             print("Processing photo...")
-            tasks.append(download_with_progress(message, "ảnh"))
+            media_type = "ảnh"
         # Nếu tin nhắn có video
         elif message.video:
             print("Processing video...")
-            tasks.append(download_with_progress(message, "video"))
+            media_type = "video"
         # Nếu tin nhắn có file (document)
         elif message.document:
             # Kiểm tra định dạng file có thuộc SUPPORTED_MEDIA_TYPES không
@@ -49,16 +54,22 @@ async def handle_message(client, message):
             allowed_exts = sum(SUPPORTED_MEDIA_TYPES.values(), [])
             if file_ext in allowed_exts:
                 print("Processing document...")
-                tasks.append(download_with_progress(message, "file"))
+                media_type = "file"
             else:
                 await message.reply(f"Định dạng file {file_ext} không được hỗ trợ.")
         else:
             # Nếu tin nhắn không chứa media hay URL, thông báo
             await message.reply("Tin nhắn này không chứa ảnh, video, document, hoặc URL hợp lệ.")
 
-        if tasks:
-            # Chạy song song các tác vụ tải xuống nếu có
-            await asyncio.gather(*tasks)
+        if media_type:
+            # Đưa vào hàng đợi tải xuống, worker sẽ xử lý song song
+            media_info = get_media_type(message)
+            enqueue_download(
+                "telegram",
+                {"media_type": media_type, "file_unique_id": media_info.file_unique_id if media_info else None},
+                message,
+                media_info.file_size if media_info else None
+            )
 
     except errors.FloodWait as e:
         await handle_flood_wait(e, message)
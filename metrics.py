@@ -0,0 +1,148 @@
+import time
+import logging
+from bisect import bisect_left
+from contextlib import asynccontextmanager
+from aiohttp import web
+from config import METRICS_ADDR
+
+logger = logging.getLogger(__name__)
+
+# In-memory counters and histograms, served in the Prometheus text format on
+# /metrics. Everything is updated from the event loop thread, so an update is a
+# plain dict operation: no locks, no I/O. Gauges that mirror state kept elsewhere
+# (queued jobs, pending uploads) are read only when scraped.
+
+PREFIX = "telegram_downloader_"
+# Seconds; wide enough for both a semaphore wait and a multi-GB download
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600)
+
+_metrics = []
+_runner = None
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Counter:
+    """A value that only goes up, per combination of label values."""
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = PREFIX + name
+        self.help = help
+        self.labelnames = labelnames
+        self.values = {}
+        _metrics.append(self)
+
+    def inc(self, labels=(), amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_labels(self.labelnames, labels)} {value}" for labels, value in self.values.items()]
+        return lines
+
+class Gauge:
+    """A value read from collect() at scrape time; collect returns {label values: value}."""
+
+    def __init__(self, name, help, labelnames, collect):
+        self.name = PREFIX + name
+        self.help = help
+        self.labelnames = labelnames
+        self.collect = collect
+        _metrics.append(self)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        try:
+            values = self.collect()
+        except Exception as e:
+            logger.error(f"Could not collect {self.name}: {e}")
+            return lines
+        lines += [f"{self.name}{_labels(self.labelnames, labels)} {value}" for labels, value in values.items()]
+        return lines
+
+class Histogram:
+    """Counts observations into buckets; only the observation's own bucket is touched, cumulative counts are built when scraped."""
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = PREFIX + name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # labels: [count per bucket (last one is +Inf), sum]
+        self.values = {}
+        _metrics.append(self)
+
+    def observe(self, value, labels=()):
+        entry = self.values.get(labels)
+        if entry is None:
+            entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+downloaded_bytes = Counter("downloaded_bytes_total", "Bytes received, by source.", ("source",))
+uploaded_bytes = Counter("uploaded_bytes_total", "Bytes of files confirmed uploaded, by upload path.", ("source",))
+api_calls = Counter("api_calls_total", "Telegram API calls made through the client, by method.", ("method",))
+flood_waits = Counter("flood_waits_total", "FloodWait errors received, by method.", ("method",))
+flood_wait_seconds = Counter("flood_wait_seconds_total", "Seconds of FloodWait imposed, by method.", ("method",))
+semaphore_wait = Histogram("semaphore_wait_seconds", "Time spent waiting for a concurrency slot.", ("semaphore",))
+stage_duration = Histogram("stage_duration_seconds", "Duration of download and upload stages.", ("stage",))
+
+@asynccontextmanager
+async def acquire(semaphore, name):
+    """async with semaphore, recording the wait in semaphore_wait under name."""
+    start = time.monotonic()
+    async with semaphore:
+        semaphore_wait.observe(time.monotonic() - start, (name,))
+        yield
+
+def render():
+    """Returns all metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in _metrics:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+async def _serve_metrics(request):
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8",
+                        headers={"X-Content-Type-Options": "nosniff"})
+
+async def start_metrics_server(addr=METRICS_ADDR):
+    """Serves /metrics on addr ("host:port"). Returns False if the port can't be bound."""
+    global _runner
+    host, port = addr.rsplit(":", 1)
+    app = web.Application()
+    app.router.add_get("/metrics", _serve_metrics)
+    _runner = web.AppRunner(app, access_log=None)
+    await _runner.setup()
+    try:
+        await web.TCPSite(_runner, host, int(port)).start()
+    except OSError as e:
+        logger.error(f"Could not serve metrics on {addr}: {e}")
+        await stop_metrics_server()
+        return False
+    logger.info(f"Serving metrics on http://{addr}/metrics")
+    return True
+
+async def stop_metrics_server():
+    global _runner
+    if _runner is not None:
+        await _runner.cleanup()
+        _runner = None
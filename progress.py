@@ -1,33 +1,189 @@
 import time
+import asyncio
+import logging
 from datetime import timedelta
 import humanize
+from pyrogram import errors
+from config import PROGRESS_INTERVAL
+from rate_limit import low_priority
 
-async def progress_callback(current, total, message, start_time, file_type):
+logger = logging.getLogger(__name__)
+
+class JobProgress:
     """
-    Provides progress updates for downloads.
+    Byte counts of one download, kept in memory. Updating them is free;
+    the progress service decides when (and where) they are shown.
+    Use as an async context manager around the download.
     """
-    try:
-        if total == 0:
-            return
 
-        now = time.time()
-        elapsed = now - start_time
+    def __init__(self, service, status_msg, title, total, current=0):
+        self.service = service
+        self.status_msg = status_msg
+        self.title = title
+        self.total = total
+        self.current = current
+        self.start_time = time.time()
+        self.start_bytes = current
 
-        # Update only if more than 2 seconds elapsed or download finished
-        if elapsed > 2 or current == total:
-            percentage = (current / total) * 100
-            speed = current / elapsed if elapsed > 0 else 0
+    def update(self, current):
+        self.current = current
 
-            # Estimate remaining time
-            eta = (total - current) / speed if speed > 0 else 0
+    def add(self, size):
+        self.current += size
 
-            progress_text = (
-                f"Downloading {file_type}: {percentage:.1f}%\n"
-                f"Downloaded: {humanize.naturalsize(current)}/{humanize.naturalsize(total)}\n"
-                f"Speed: {humanize.naturalsize(speed)}/s\n"
-                f"ETA: {str(timedelta(seconds=int(eta)))}"
+    def render(self):
+        elapsed = time.time() - self.start_time
+        speed = (self.current - self.start_bytes) / elapsed if elapsed > 0 else 0
+        eta = (self.total - self.current) / speed if speed > 0 else 0
+        if not self.total:
+            # Size unknown (no Content-Length)
+            return (
+                f"Downloading {self.title}...\n"
+                f"Downloaded: {humanize.naturalsize(self.current)}\n"
+                f"Speed: {humanize.naturalsize(speed)}/s"
             )
-            await message.edit_text(progress_text)
-    except Exception:
-        # If editing fails, just skip updating
-        pass
+        return (
+            f"Downloading {self.title}: {self.current / self.total * 100:.1f}%\n"
+            f"Downloaded: {humanize.naturalsize(self.current)}/{humanize.naturalsize(self.total)}\n"
+            f"Speed: {humanize.naturalsize(speed)}/s\n"
+            f"ETA: {str(timedelta(seconds=int(eta)))}"
+        )
+
+    def render_line(self):
+        if not self.total:
+            return f"• {self.title}: {humanize.naturalsize(self.current)}"
+        return f"• {self.title}: {self.current / self.total * 100:.1f}% of {humanize.naturalsize(self.total)}"
+
+    async def __aenter__(self):
+        if self.status_msg:
+            self.service.track(self)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if self.status_msg:
+            await self.service.untrack(self)
+
+class _ChatProgress:
+    """Downloads running in one chat and the dashboard message showing them."""
+
+    def __init__(self):
+        self.jobs = []
+        self.dashboard = None
+        self.paused_until = 0
+        # Message to answer with the dashboard while the chat's downloads are only queued
+        self.anchor = None
+
+class ProgressService:
+    """
+    Shows download progress without flooding Telegram. Downloads only record
+    their byte counts; a single flusher task edits at most one message per chat
+    every interval seconds, and only when the text changed.
+    A chat with one download sees progress in that download's status message.
+    Once several run at the same time they share one dashboard message, which
+    stays until the chat has no downloads left. Uploads use the same service
+    (see upload.UploadProgress).
+    Downloads waiting in the job queue are counted on the dashboard too (from
+    queued_counts, {chat_id: queued jobs}), so queueing a job never sends a
+    message of its own.
+    """
+
+    def __init__(self, interval=PROGRESS_INTERVAL):
+        self.interval = interval
+        self.queued_counts = None
+        self._chats = {}
+        self._last_text = {}
+        self._locks = {}
+        self._flusher = None
+
+    def job(self, status_msg, title, total, current=0):
+        """Returns the JobProgress for a download; status_msg may be None for silent downloads."""
+        return JobProgress(self, status_msg, title, total, current)
+
+    def track(self, job):
+        chat = self._chats.setdefault(job.status_msg.chat.id, _ChatProgress())
+        chat.jobs.append(job)
+        self._start_flusher()
+
+    def note_queued(self, message):
+        """Shows the chat's queued downloads on its dashboard (answering message) until they have started."""
+        chat = self._chats.setdefault(message.chat.id, _ChatProgress())
+        chat.anchor = message
+        self._start_flusher()
+
+    def _start_flusher(self):
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._run())
+
+    async def untrack(self, job):
+        """Stops showing job and waits for an edit of its message already in flight,
+        so the caller's final edit can't be overwritten by a late progress edit."""
+        chat = self._chats.get(job.status_msg.chat.id)
+        if chat and job in chat.jobs:
+            chat.jobs.remove(job)
+        key = (job.status_msg.chat.id, job.status_msg.id)
+        lock = self._locks.get(key)
+        if lock:
+            async with lock:
+                pass
+        self._locks.pop(key, None)
+        self._last_text.pop(key, None)
+
+    async def _run(self):
+        with low_priority():
+            while self._chats:
+                await asyncio.sleep(self.interval)
+                try:
+                    queued_counts = self.queued_counts() if self.queued_counts else {}
+                except Exception as e:
+                    logger.warning(f"Could not count queued downloads: {e}")
+                    queued_counts = {}
+                for chat_id, chat in list(self._chats.items()):
+                    try:
+                        await self._flush_chat(chat_id, chat, queued_counts.get(chat_id, 0))
+                    except Exception as e:
+                        logger.warning(f"Progress update for chat {chat_id} failed: {e}")
+
+    async def _flush_chat(self, chat_id, chat, queued=0):
+        if time.time() < chat.paused_until:
+            return
+        if not chat.jobs and not queued:
+            del self._chats[chat_id]
+            if chat.dashboard:
+                await self._edit(chat, chat.dashboard, "✅ All transfers in this chat have finished.")
+                self._last_text.pop((chat_id, chat.dashboard.id), None)
+                self._locks.pop((chat_id, chat.dashboard.id), None)
+            return
+        if len(chat.jobs) == 1 and not queued and not chat.dashboard:
+            job = chat.jobs[0]
+            await self._edit(chat, job.status_msg, job.render())
+            return
+        text = f"📥 {len(chat.jobs)} transfers in progress"
+        if queued:
+            text += f", {queued} queued"
+        text += "".join(f"\n{job.render_line()}" for job in chat.jobs)
+        if chat.dashboard is None:
+            try:
+                chat.dashboard = await (chat.jobs[0].status_msg if chat.jobs else chat.anchor).reply(text)
+                self._last_text[(chat_id, chat.dashboard.id)] = text
+            except errors.FloodWait as e:
+                chat.paused_until = time.time() + e.value
+        else:
+            await self._edit(chat, chat.dashboard, text)
+
+    async def _edit(self, chat, target, text):
+        key = (target.chat.id, target.id)
+        if self._last_text.get(key) == text:
+            return
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            try:
+                await target.edit_text(text)
+                self._last_text[key] = text
+            except errors.FloodWait as e:
+                # Leave the chat alone until Telegram allows edits again
+                chat.paused_until = time.time() + e.value
+            except errors.MessageNotModified:
+                self._last_text[key] = text
+
+# Shared by every download
+progress_service = ProgressService()
@@ -0,0 +1,101 @@
+import asyncio
+import logging
+from http_session import get_session
+from file_writer import FileWriter
+from config import CHUNK_SIZE, MAX_RETRIES, RANGE_SEGMENTS, HASH_BLOCK_SIZE
+
+logger = logging.getLogger(__name__)
+
+class RangeDownloadError(Exception):
+    """Raised when a segmented download can't be completed."""
+    pass
+
+class RangeNotSatisfiedError(RangeDownloadError):
+    """Raised when the server ignores a Range request or the file changed (If-Range)."""
+    pass
+
+def supports_ranges(response):
+    """
+    Returns True if the server advertises byte ranges and a known size.
+    """
+    accept_ranges = response.headers.get("Accept-Ranges", "").lower()
+    return accept_ranges == "bytes" and int(response.headers.get("Content-Length", 0)) > 0
+
+def get_validator(response):
+    """
+    Returns the value to send as If-Range: a strong ETag, else Last-Modified.
+    """
+    etag = response.headers.get("ETag")
+    if etag and not etag.startswith("W/"):
+        return etag
+    return response.headers.get("Last-Modified")
+
+def split_ranges(total_size, segments=RANGE_SEGMENTS):
+    """
+    Splits [0, total_size) into contiguous [start, end] byte ranges, end inclusive.
+    Boundaries fall on HASH_BLOCK_SIZE multiples so each segment hashes whole blocks.
+    """
+    segment_size = -(-total_size // segments)
+    segment_size = -(-segment_size // HASH_BLOCK_SIZE) * HASH_BLOCK_SIZE
+    return [
+        [start, min(start + segment_size, total_size) - 1]
+        for start in range(0, total_size, segment_size)
+    ]
+
+async def _download_segment(url, file_path, segment, validator, on_chunk, hasher):
+    """
+    Fetches segment = [position, end] into file_path at its offset.
+    segment[0] advances as bytes are written, so a dropped connection
+    (or a later resume) continues from the last written byte.
+    """
+    end = segment[1]
+
+    def on_written(size):
+        segment[0] += size
+        on_chunk(size)
+
+    for attempt in range(1, MAX_RETRIES + 1):
+        headers = {"Range": f"bytes={segment[0]}-{end}"}
+        if validator:
+            # Server must answer 200 (full body) instead of 206 if the file changed
+            headers["If-Range"] = validator
+        try:
+            async with get_session().get(url, headers=headers) as response:
+                if response.status != 206:
+                    raise RangeNotSatisfiedError(f"Range request returned status {response.status}")
+                async with FileWriter(file_path, "r+b", hasher=hasher) as writer:
+                    offset = segment[0]
+                    async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                        await writer.write(chunk, offset, on_written)
+                        offset += len(chunk)
+            if segment[0] == end + 1:
+                return
+            raise RangeDownloadError(f"Segment ending at {end} stopped at byte {segment[0]}")
+        except RangeDownloadError:
+            raise
+        except Exception as e:
+            if attempt == MAX_RETRIES:
+                raise RangeDownloadError(f"Segment ending at {end} failed: {e}")
+            logger.warning(f"Segment ending at {end} attempt {attempt} failed: {e}")
+            await asyncio.sleep(attempt)
+
+async def download_ranges(url, file_path, ranges, validator=None, on_chunk=lambda size: None, hasher=None):
+    """
+    Downloads the remaining byte ranges of url into file_path in parallel.
+    file_path must already exist (preallocated or partially written).
+    ranges is a list of [position, end] pairs updated in place as bytes arrive.
+    validator is the ETag or Last-Modified value sent as If-Range.
+    on_chunk is called with the size of every chunk once it is on disk.
+    hasher (a BlockHasher) is fed every chunk as it is written.
+    """
+    tasks = [
+        asyncio.create_task(_download_segment(url, file_path, segment, validator, on_chunk, hasher))
+        for segment in ranges if segment[0] <= segment[1]
+    ]
+    try:
+        await asyncio.gather(*tasks)
+    except Exception:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
@@ -0,0 +1,251 @@
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pyrogram import Client, errors, raw
+from pyrogram.session import Session
+import metrics
+from config import (
+    BOT_API_GLOBAL_RATE, BOT_API_GLOBAL_BURST, BOT_API_CHAT_RATE, BOT_API_CHAT_BURST,
+    BOT_API_GROUP_RATE, BOT_API_GROUP_BURST
+)
+
+logger = logging.getLogger(__name__)
+
+# Lower numbers go first
+PRIORITY_HIGH = 0  # Command replies and final results
+PRIORITY_LOW = 1  # Progress edits, countdowns
+
+outbound_priority = ContextVar("outbound_priority", default=PRIORITY_HIGH)
+
+@contextmanager
+def low_priority():
+    """Marks the Bot API calls made inside the block as progress updates."""
+    token = outbound_priority.set(PRIORITY_LOW)
+    try:
+        yield
+    finally:
+        outbound_priority.reset(token)
+
+# Calls that count against Telegram's message limits; everything else (file parts,
+# lookups) is not throttled here
+LIMITED_QUERIES = (
+    raw.functions.messages.SendMessage,
+    raw.functions.messages.SendMedia,
+    raw.functions.messages.SendMultiMedia,
+    raw.functions.messages.EditMessage,
+    raw.functions.messages.ForwardMessages,
+    raw.functions.messages.DeleteMessages
+)
+
+class TokenBucket:
+    """Allows rate calls per second on average, with bursts of up to burst calls."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        """Seconds until a token is available (0 if one is available now)."""
+        self._refill(now)
+        return max(self.paused_until - now, (1 - self.tokens) / self.rate, 0)
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def pause(self, seconds):
+        """Stops handing out tokens for seconds (after a FloodWait)."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+class _Call:
+    def __init__(self, priority, seq, send, merge_key):
+        self.priority = priority
+        self.seq = seq
+        self.send = send
+        self.merge_key = merge_key
+        self.future = asyncio.get_running_loop().create_future()
+        self.merged = False
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+class OutboundLimiter:
+    """
+    Sends outgoing Bot API calls through a global token bucket and one bucket per
+    chat, so we stay under Telegram's limits instead of reacting to FloodWait.
+    A single dispatcher starts the waiting call with the best priority whose chat
+    has a token; final results therefore overtake queued progress edits.
+    A low-priority edit of a message that already has an edit waiting replaces it:
+    both callers get the result of the newer edit, so stale progress is never sent.
+    """
+
+    def __init__(self):
+        self.global_bucket = TokenBucket(BOT_API_GLOBAL_RATE, BOT_API_GLOBAL_BURST)
+        self._buckets = {}
+        self._pending = {}
+        self._merge = {}
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._dispatcher = None
+
+    def bucket(self, chat_key):
+        if chat_key not in self._buckets:
+            private = chat_key is not None and chat_key[0] == "user"
+            self._buckets[chat_key] = TokenBucket(
+                BOT_API_CHAT_RATE if private else BOT_API_GROUP_RATE,
+                BOT_API_CHAT_BURST if private else BOT_API_GROUP_BURST
+            )
+        return self._buckets[chat_key]
+
+    async def submit(self, chat_key, send, priority=PRIORITY_HIGH, merge_key=None):
+        """Waits for a token, then awaits send() and returns its result."""
+        if merge_key is not None and merge_key in self._merge:
+            # Replace the queued edit; its caller gets this edit's result
+            stale = self._merge[merge_key]
+            stale.merged = True
+            # Keep the stale edit's place in line
+            call = self._queue(chat_key, send, priority, merge_key, stale.seq)
+            call.future.add_done_callback(lambda f: _copy_result(f, stale.future))
+        else:
+            call = self._queue(chat_key, send, priority, merge_key)
+        return await call.future
+
+    def _queue(self, chat_key, send, priority, merge_key, seq=None):
+        call = _Call(priority, next(self._seq) if seq is None else seq, send, merge_key)
+        heapq.heappush(self._pending.setdefault(chat_key, []), call)
+        if merge_key is not None:
+            self._merge[merge_key] = call
+        self._wakeup.set()
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        return call
+
+    async def _dispatch(self):
+        while self._pending:
+            now = time.monotonic()
+            best = None
+            wait = None
+            for chat_key, calls in list(self._pending.items()):
+                while calls and calls[0].merged:
+                    heapq.heappop(calls)
+                if not calls:
+                    del self._pending[chat_key]
+                    continue
+                chat_wait = self.bucket(chat_key).wait_time(now) if chat_key is not None else 0
+                if chat_wait == 0:
+                    if best is None or calls[0] < self._pending[best][0]:
+                        best = chat_key
+                else:
+                    wait = chat_wait if wait is None else min(wait, chat_wait)
+            if best is not None:
+                global_wait = self.global_bucket.wait_time(now)
+                if global_wait == 0:
+                    self._start(best, heapq.heappop(self._pending[best]), now)
+                    continue
+                wait = global_wait if wait is None else min(wait, global_wait)
+            if wait is None:
+                continue
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+        self._prune()
+
+    def _start(self, chat_key, call, now):
+        self.global_bucket.take(now)
+        if chat_key is not None:
+            self.bucket(chat_key).take(now)
+        if call.merge_key is not None and self._merge.get(call.merge_key) is call:
+            del self._merge[call.merge_key]
+        task = asyncio.create_task(call.send())
+        task.add_done_callback(lambda t: _copy_result(t, call.future))
+
+    def _prune(self):
+        """Forgets idle chats whose buckets are full again."""
+        now = time.monotonic()
+        for chat_key, bucket in list(self._buckets.items()):
+            if chat_key not in self._pending and bucket.wait_time(now) == 0 and bucket.tokens >= bucket.burst:
+                del self._buckets[chat_key]
+
+def _copy_result(source, target):
+    if target.done():
+        return
+    if source.cancelled():
+        target.cancel()
+    elif source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
+
+def peer_key(peer):
+    """Returns a hashable chat key for a raw input peer (None if unknown)."""
+    if isinstance(peer, raw.types.InputPeerUser):
+        return ("user", peer.user_id)
+    if isinstance(peer, raw.types.InputPeerChat):
+        return ("chat", peer.chat_id)
+    if isinstance(peer, raw.types.InputPeerChannel):
+        return ("channel", peer.channel_id)
+    return None
+
+def _count_flood_wait(method, seconds):
+    metrics.flood_waits.inc((method,))
+    metrics.flood_wait_seconds.inc((method,), seconds)
+
+# Shared by every client in the process
+outbound_limiter = OutboundLimiter()
+
+class RateLimitedClient(Client):
+    """
+    Pyrogram client whose message sends and edits go through outbound_limiter.
+    Every reply/edit_text in the bot ends up in invoke(), so no call site has to
+    change; code sending progress updates wraps them in low_priority().
+    A FloodWait on those calls is always raised (sleep_threshold 0) instead of
+    being slept through inside Pyrogram's Session, which would hold the calling
+    handler or worker for the whole wait; raised, it pauses the chat's bucket here
+    and the chat in flood_control, and other chats carry on. Every other call
+    keeps the caller's or the client's sleep_threshold, so e.g. sign-in during
+    start() still waits out a FloodWait instead of failing.
+    """
+
+    async def invoke(self, query, retries=Session.MAX_RETRIES, timeout=Session.WAIT_TIMEOUT, sleep_threshold=None):
+        method = type(query).__name__
+        metrics.api_calls.inc((method,))
+        if not isinstance(query, LIMITED_QUERIES):
+            try:
+                return await super().invoke(query, retries, timeout, sleep_threshold)
+            except errors.FloodWait as e:
+                _count_flood_wait(method, e.value)
+                raise
+        chat_key = peer_key(getattr(query, "peer", None) or getattr(query, "to_peer", None))
+        priority = outbound_priority.get()
+        merge_key = None
+        if priority == PRIORITY_LOW and isinstance(query, raw.functions.messages.EditMessage):
+            merge_key = (chat_key, query.id)
+        parent_invoke = super().invoke
+        args = (retries, timeout, 0)
+
+        async def send():
+            try:
+                return await parent_invoke(query, *args)
+            except errors.FloodWait as e:
+                _count_flood_wait(method, e.value)
+                # Our limits were too generous for this chat; back off before anything else goes out
+                logger.warning(f"FloodWait of {e.value}s for {chat_key}")
+                if chat_key is not None:
+                    outbound_limiter.bucket(chat_key).pause(e.value)
+                raise
+
+        return await outbound_limiter.submit(chat_key, send, priority, merge_key)
@@ -0,0 +1,83 @@
+import os
+import json
+import hashlib
+import logging
+from config import PARTIAL_FOLDER
+
+logger = logging.getLogger(__name__)
+
+# Partial downloads live in PARTIAL_FOLDER as <key>.part with a <key>.part.json sidecar
+
+def http_key(url):
+    """Returns the partial-download key for a URL."""
+    return "url_" + hashlib.sha1(url.encode("utf-8")).hexdigest()
+
+def telegram_key(file_unique_id):
+    """Returns the partial-download key for a Telegram file."""
+    return f"tg_{file_unique_id}"
+
+def part_path(key):
+    """Returns the path of the .part file holding the bytes downloaded so far."""
+    return os.path.join(PARTIAL_FOLDER, f"{key}.part")
+
+def _state_path(key):
+    return os.path.join(PARTIAL_FOLDER, f"{key}.part.json")
+
+def load_state(key):
+    """
+    Returns the saved resume metadata for key, or None if there is no usable partial download.
+    """
+    try:
+        with open(_state_path(key), "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not os.path.exists(part_path(key)):
+        clear_state(key)
+        return None
+    return state
+
+def save_state(key, state):
+    """
+    Atomically writes resume metadata so a crash never leaves a half-written sidecar.
+    """
+    os.makedirs(PARTIAL_FOLDER, exist_ok=True)
+    tmp_path = _state_path(key) + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, _state_path(key))
+
+def clear_state(key):
+    """Removes the sidecar (not the .part file) for key."""
+    try:
+        os.remove(_state_path(key))
+    except OSError:
+        pass
+
+def discard(key):
+    """Removes both the .part file and its sidecar."""
+    clear_state(key)
+    try:
+        os.remove(part_path(key))
+    except OSError:
+        pass
+
+def finish(key, file_path):
+    """Moves a completed .part file to its final path and drops the sidecar."""
+    os.replace(part_path(key), file_path)
+    clear_state(key)
+
+def list_states():
+    """
+    Returns (key, state) for every partial download on disk, e.g. after a restart.
+    """
+    if not os.path.isdir(PARTIAL_FOLDER):
+        return []
+    states = []
+    for name in sorted(os.listdir(PARTIAL_FOLDER)):
+        if name.endswith(".part.json"):
+            key = name[:-len(".part.json")]
+            state = load_state(key)
+            if state:
+                states.append((key, state))
+    return states
@@ -0,0 +1,25 @@
+import os
+import sqlite3
+import threading
+from config import STATE_FOLDER
+
+_local = threading.local()
+
+def get_db(name, schema):
+    """
+    Returns this thread's connection to the SQLite database STATE_FOLDER/<name>,
+    creating its schema on first use. WAL mode lets readers and a writer work concurrently.
+    """
+    conns = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = {}
+    conn = conns.get(name)
+    if conn is None:
+        os.makedirs(STATE_FOLDER, exist_ok=True)
+        conn = sqlite3.connect(os.path.join(STATE_FOLDER, name))
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(schema)
+        conn.commit()
+        conns[name] = conn
+    return conn
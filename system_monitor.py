@@ -1,14 +1,117 @@
+import time
+import asyncio
+import logging
+from collections import deque
+from dataclasses import dataclass
+from typing import Optional
 import psutil
 import humanize
+from config import BASE_DOWNLOAD_FOLDER, SYSTEM_SAMPLE_INTERVAL, SYSTEM_SAMPLE_WINDOW
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class Sample:
+    """One reading of the machine; rates are bytes per second since the previous sample."""
+    time: float
+    cpu: float
+    ram: float
+    disk_free: int
+    net_recv: Optional[float]
+    net_sent: Optional[float]
+    disk_read: Optional[float]
+    disk_write: Optional[float]
+
+# Ring buffer of the last SYSTEM_SAMPLE_WINDOW seconds of samples
+_samples = deque(maxlen=SYSTEM_SAMPLE_WINDOW // SYSTEM_SAMPLE_INTERVAL)
+_sampler = None
+_last_counters = None
+# The first cpu_percent(None) only starts the measurement; later ones cover the time since
+psutil.cpu_percent(interval=None)
+
+def take_sample():
+    """
+    Reads CPU, RAM, disk and I/O counters without blocking: cpu_percent(None)
+    measures since the previous call, and rates come from counter deltas.
+    """
+    global _last_counters
+    now = time.monotonic()
+    net = psutil.net_io_counters()
+    disk_io = psutil.disk_io_counters()
+    rates = [None, None, None, None]
+    if _last_counters is not None:
+        last_time, last_net, last_disk_io = _last_counters
+        elapsed = max(now - last_time, 1e-6)
+        rates[0] = (net.bytes_recv - last_net.bytes_recv) / elapsed
+        rates[1] = (net.bytes_sent - last_net.bytes_sent) / elapsed
+        # Not available in some containers
+        if disk_io and last_disk_io:
+            rates[2] = (disk_io.read_bytes - last_disk_io.read_bytes) / elapsed
+            rates[3] = (disk_io.write_bytes - last_disk_io.write_bytes) / elapsed
+    _last_counters = (now, net, disk_io)
+    sample = Sample(
+        now, psutil.cpu_percent(interval=None), psutil.virtual_memory().percent,
+        psutil.disk_usage(BASE_DOWNLOAD_FOLDER).free, *rates
+    )
+    _samples.append(sample)
+    return sample
+
+async def _run_sampler():
+    while True:
+        try:
+            take_sample()
+        except Exception as e:
+            logger.error(f"System sample failed: {e}")
+        await asyncio.sleep(SYSTEM_SAMPLE_INTERVAL)
+
+def start_sampler():
+    """Starts sampling every SYSTEM_SAMPLE_INTERVAL seconds in the background."""
+    global _sampler
+    if _sampler is None or _sampler.done():
+        _sampler = asyncio.create_task(_run_sampler())
+
+async def stop_sampler():
+    global _sampler
+    if _sampler is not None:
+        _sampler.cancel()
+        await asyncio.gather(_sampler, return_exceptions=True)
+        _sampler = None
+
+def _average(field, seconds):
+    """Mean of field over the samples of the last seconds (None when there are none)."""
+    cutoff = time.monotonic() - seconds
+    values = [getattr(s, field) for s in _samples if s.time >= cutoff and getattr(s, field) is not None]
+    return sum(values) / len(values) if values else None
+
+def _trend(field):
+    averages = [_average(field, minutes * 60) for minutes in (1, 5, 15)]
+    return "/".join(f"{value:.0f}%" if value is not None else "-" for value in averages)
+
+def _free_change():
+    """How much free disk space changed over the buffered window."""
+    change = _samples[-1].disk_free - _samples[0].disk_free
+    minutes = (_samples[-1].time - _samples[0].time) / 60
+    sign = "-" if change < 0 else "+"
+    return f"{sign}{humanize.naturalsize(abs(change))} in {minutes:.0f} min"
+
+def _rate(value):
+    return f"{humanize.naturalsize(value)}/s" if value is not None else "n/a"
 
 async def get_system_stats():
-    cpu_percent = psutil.cpu_percent(interval=1)
+    """
+    Returns display strings for /status from the sampler's ring buffer, straight
+    away. Without a running sampler, one sample is taken on the spot (its CPU
+    figure then covers the time since the previous call).
+    """
+    latest = _samples[-1] if _samples else take_sample()
     memory = psutil.virtual_memory()
-    disk = psutil.disk_usage('/')
-    
+    disk = psutil.disk_usage(BASE_DOWNLOAD_FOLDER)
+
     stats = {
-        'cpu_usage': f"{cpu_percent}%",
-        'ram_usage': f"{memory.percent}% (Used: {humanize.naturalsize(memory.used)}/{humanize.naturalsize(memory.total)})",
-        'disk_space': f"Free: {humanize.naturalsize(disk.free)}/{humanize.naturalsize(disk.total)} ({disk.percent}% used)"
+        'cpu_usage': f"{latest.cpu}% (1/5/15 min: {_trend('cpu')})",
+        'ram_usage': f"{memory.percent}% (Used: {humanize.naturalsize(memory.used)}/{humanize.naturalsize(memory.total)}; 1/5/15 min: {_trend('ram')})",
+        'disk_space': f"Free: {humanize.naturalsize(disk.free)}/{humanize.naturalsize(disk.total)} ({disk.percent}% used; {_free_change()})",
+        'network': f"↓ {_rate(latest.net_recv)} ↑ {_rate(latest.net_sent)} (1 min: ↓ {_rate(_average('net_recv', 60))} ↑ {_rate(_average('net_sent', 60))})",
+        'disk_io': f"read {_rate(latest.disk_read)}, write {_rate(latest.disk_write)}"
     }
     return stats
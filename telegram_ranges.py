@@ -0,0 +1,67 @@
+import asyncio
+import logging
+from file_writer import FileWriter
+from config import TELEGRAM_CHUNK_SIZE, MAX_RETRIES
+
+logger = logging.getLogger(__name__)
+
+class TelegramRangeError(Exception):
+    """Raised when a segmented Telegram download can't be completed."""
+    pass
+
+async def _download_segment(client, media, file_path, segment, on_chunk, hasher):
+    """
+    Fetches segment = [position, end] of a Telegram file into file_path at its offset.
+    stream_media works in whole MTProto chunks, so the transfer starts at the chunk
+    holding position; segment[0] advances as bytes are written.
+    Pyrogram logs and swallows transfer errors, ending the stream early, so a
+    short segment is retried from where it stopped.
+    """
+    end = segment[1]
+
+    def on_written(size):
+        segment[0] += size
+        on_chunk(size)
+
+    for attempt in range(1, MAX_RETRIES + 1):
+        first_chunk = segment[0] // TELEGRAM_CHUNK_SIZE
+        chunks = -(-(end + 1 - first_chunk * TELEGRAM_CHUNK_SIZE) // TELEGRAM_CHUNK_SIZE)
+        try:
+            async with FileWriter(file_path, "r+b", hasher=hasher) as writer:
+                offset = first_chunk * TELEGRAM_CHUNK_SIZE
+                async for chunk in client.stream_media(media, limit=chunks, offset=first_chunk):
+                    # Skip bytes already on disk and anything past the segment
+                    data = chunk[max(segment[0] - offset, 0):end + 1 - offset]
+                    if data:
+                        await writer.write(data, max(offset, segment[0]), on_written)
+                    offset += len(chunk)
+            if segment[0] == end + 1:
+                return
+            raise TelegramRangeError(f"Segment ending at {end} stopped at byte {segment[0]}")
+        except Exception as e:
+            if attempt == MAX_RETRIES:
+                raise TelegramRangeError(f"Segment ending at {end} failed: {e}")
+            logger.warning(f"Segment ending at {end} attempt {attempt} failed: {e}")
+            await asyncio.sleep(attempt)
+
+async def download_telegram_ranges(client, media, file_path, ranges, on_chunk=lambda size: None, hasher=None):
+    """
+    Downloads the remaining byte ranges of a Telegram file into file_path in parallel,
+    one stream_media transfer per range. media is a Message or a file_id.
+    file_path must already exist (preallocated or partially written).
+    ranges is a list of [position, end] pairs updated in place as bytes arrive;
+    split_ranges boundaries fall on whole MTProto chunks, so no bytes are fetched twice.
+    on_chunk is called with the size of every chunk once it is on disk.
+    hasher (a BlockHasher) is fed every chunk as it is written.
+    """
+    tasks = [
+        asyncio.create_task(_download_segment(client, media, file_path, segment, on_chunk, hasher))
+        for segment in ranges if segment[0] <= segment[1]
+    ]
+    try:
+        await asyncio.gather(*tasks)
+    except Exception:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
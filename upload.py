@@ -1,107 +1,348 @@
 import os
-import subprocess
-from config import BASE_DOWNLOAD_FOLDER
+import json
+import asyncio
+import logging
+from datetime import timedelta
+import humanize
+from config import BASE_DOWNLOAD_FOLDER, PARTIAL_FOLDER, STATE_FOLDER, RCLONE_STATS_INTERVAL, UPLOAD_RETRY_BATCH_SIZE, UPLOAD_RETRY_CONCURRENCY
 from pyrogram import errors
+from media_index import mark_files_uploaded
+import dedup
+import upload_manifest
+import metrics
+from progress import JobProgress, progress_service
+
+logger = logging.getLogger(__name__)
+
+class UploadError(Exception):
+    """Raised when rclone rejects or fails an upload."""
+    pass
 
 # Đường dẫn đầy đủ đến rclone.exe, cập nhật đường dẫn cho phù hợp với hệ thống của bạn
 RCLONE_PATH = "C:\\rclone\\rclone.exe"  # <-- Chỉnh sửa đường dẫn nếu cần
 
-# File to store upload errors (each line is a filepath that failed)
+# rclone remote (and path) the downloads are uploaded to
+UPLOAD_REMOTE = "GG PHOTO:album/ONLYFAN"
+
+# Old text log of failed uploads (each line a folder or file); /retry_upload imports it once
 UPLOAD_ERROR_LOG = os.path.join(BASE_DOWNLOAD_FOLDER, "upload_errors.txt")
 
-async def upload_to_google_photos(message):
+# Bot files kept in the download folder, never uploaded
+UPLOAD_SKIP_FILES = {"rclone_log.txt", "rclone_retry_log.txt", "upload_errors.txt"}
+
+# API requests per second allowed to all rclone processes together
+RCLONE_TPS_LIMIT = 20
+
+# Flags shared by every batch copy to UPLOAD_REMOTE, apart from the request rate
+RCLONE_BASE_FLAGS = [
+    "--transfers=32", "--drive-chunk-size=128M",
+    "--exclude", f"{os.path.basename(PARTIAL_FOLDER)}/**"
+]
+# A single rclone run gets the whole request rate
+RCLONE_COPY_FLAGS = [*RCLONE_BASE_FLAGS, f"--tpslimit={RCLONE_TPS_LIMIT}"]
+
+class UploadProgress(JobProgress):
     """
-    Uses rclone to upload files from the download folder to a Google Photos album.
-    After a successful upload, cleans up local files.
-    On error, logs file paths into UPLOAD_ERROR_LOG.
+    Progress of one rclone run, read from its JSON log: the latest stats
+    (bytes, speed, ETA, file counts) plus the files copied and the errors seen.
+    Shown through the progress service like a download. on_copied(name) is
+    called for every file as rclone reports it copied.
     """
+
+    def __init__(self, service, status_msg, title, on_copied=None):
+        super().__init__(service, status_msg, title, 0)
+        self.on_copied = on_copied
+        self.speed = 0
+        self.eta = None
+        self.transfers = 0
+        self.total_transfers = 0
+        self.copied = []
+        self.errors = []
+
+    def feed(self, entry):
+        """Takes one decoded --use-json-log entry."""
+        stats = entry.get("stats")
+        if stats:
+            self.current = stats.get("bytes", 0)
+            self.total = stats.get("totalBytes", 0)
+            self.speed = stats.get("speed", 0)
+            self.eta = stats.get("eta")
+            self.transfers = stats.get("transfers", 0)
+            self.total_transfers = stats.get("totalTransfers", 0)
+        elif entry.get("level") in ("error", "critical"):
+            self.errors.append((entry.get("object", ""), entry.get("msg", "").strip()))
+        elif entry.get("object") and entry.get("msg", "").startswith("Copied"):
+            self.copied.append(entry["object"])
+            if self.on_copied:
+                self.on_copied(entry["object"])
+
+    def render(self):
+        if self.total:
+            text = (
+                f"Uploading {self.title}: {self.current / self.total * 100:.1f}%\n"
+                f"Uploaded: {humanize.naturalsize(self.current)}/{humanize.naturalsize(self.total)}\n"
+            )
+        else:
+            text = f"Uploading {self.title}...\nUploaded: {humanize.naturalsize(self.current)}\n"
+        text += (
+            f"Files: {self.transfers}/{self.total_transfers}\n"
+            f"Speed: {humanize.naturalsize(self.speed)}/s"
+        )
+        if self.eta is not None:
+            text += f"\nETA: {str(timedelta(seconds=int(self.eta)))}"
+        if self.errors:
+            text += f"\nErrors: {len(self.errors)}"
+        return text
+
+    def render_line(self):
+        return f"• upload {self.title}: {self.transfers}/{self.total_transfers} files, {humanize.naturalsize(self.speed)}/s"
+
+def parse_rclone_log(line):
+    """Returns the entry of one --use-json-log line, or None if the line isn't JSON."""
+    try:
+        entry = json.loads(line)
+    except ValueError:
+        return None
+    return entry if isinstance(entry, dict) else None
+
+async def run_rclone(args, progress, log_file_path):
+    """
+    Runs rclone without blocking the event loop. Its JSON log is copied to
+    log_file_path and fed to progress as it arrives. Returns the exit code.
+    """
+    process = await asyncio.create_subprocess_exec(
+        RCLONE_PATH, *args, "--use-json-log", "-v", f"--stats={RCLONE_STATS_INTERVAL}s",
+        stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE,
+        # Stats lines list every running transfer
+        limit=1024 * 1024
+    )
     try:
-        album_name = "ONLYFAN"  # Change as needed
-        log_file_path = os.path.join(BASE_DOWNLOAD_FOLDER, "rclone_log.txt")
-        
         with open(log_file_path, "w", encoding="utf-8") as log_file:
-            result = subprocess.run(
-                [
-                    RCLONE_PATH, "copy", BASE_DOWNLOAD_FOLDER, f"GG PHOTO:album/{album_name}",
-                    "--transfers=32", "--drive-chunk-size=128M", "--tpslimit=20", "-P"
-                ],
-                stdout=log_file, stderr=log_file, text=True, encoding="utf-8"
+            async for line in process.stderr:
+                line = line.decode("utf-8", "replace")
+                log_file.write(line)
+                entry = parse_rclone_log(line)
+                if entry:
+                    progress.feed(entry)
+        return await process.wait()
+    except BaseException:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        raise
+
+def upload_summary(progress):
+    """Final status text for an rclone run."""
+    text = f"Files copied: {len(progress.copied)} ({humanize.naturalsize(progress.current)})"
+    if progress.errors:
+        text += f"\nErrors: {len(progress.errors)}\n" + "\n".join(
+            f"- {name or 'rclone'}: {error}" for name, error in progress.errors[:10]
+        )
+    return text
+
+# Substrings of rclone error messages and the error class recorded for them, checked in order
+ERROR_CLASSES = [
+    ("rate_limit", ("ratelimitexceeded", "quota", "too many requests", "429")),
+    ("auth", ("unauthorized", "invalid_grant", "token", "401", "403")),
+    ("not_found", ("not found", "no such file", "doesn't exist")),
+    ("network", ("timeout", "connection", "eof", "no such host", "tls"))
+]
+
+def classify_error(error):
+    """Returns the error class of an rclone error message."""
+    error = error.lower()
+    for error_class, needles in ERROR_CLASSES:
+        if any(needle in error for needle in needles):
+            return error_class
+    return "other"
+
+def record_upload_failure(file_path, error):
+    """Records one failed upload (e.g. from the upload pipeline) for /retry_upload."""
+    message = str(error)
+    error_class = classify_error(message) if isinstance(error, UploadError) else type(error).__name__
+    upload_manifest.record_failures([(file_path, error_class, message)])
+
+def _remove_uploaded(entries):
+    """Deletes local files confirmed uploaded. Returns how many were removed."""
+    removed = 0
+    for path, _, _ in entries:
+        try:
+            os.remove(path)
+            removed += 1
+        except OSError as e:
+            logger.warning(f"Could not remove uploaded file {path}: {e}")
+    return removed
+
+def _rclone_name(path):
+    """Path relative to the download folder, as rclone names it in --files-from and its log."""
+    return os.path.relpath(path, BASE_DOWNLOAD_FOLDER).replace(os.sep, "/")
+
+def _confirm_uploads(entries):
+    """Records entries as uploaded (dropping any failure entry) and deletes them. Returns how many were deleted."""
+    upload_manifest.record(entries)
+    mark_files_uploaded([path for path, _, _ in entries])
+    dedup.mark_files_uploaded([path for path, _, _ in entries])
+    metrics.uploaded_bytes.inc(("sync",), sum(size for _, size, _ in entries))
+    return _remove_uploaded(entries)
+
+async def copy_files(entries, status_msg, title, log_file_path, list_path, flags=RCLONE_COPY_FLAGS):
+    """
+    Uploads entries, [(path, size, mtime)] of files under the download folder,
+    with one rclone run: only they are passed (--files-from), and --no-traverse
+    keeps rclone from listing the destination. Each file is confirmed, recorded
+    in the manifest and deleted as soon as rclone logs it as copied (all of them
+    on a clean exit); the others are recorded as failed with their error class.
+    Returns (progress, number confirmed, number deleted, number failed).
+    """
+    by_name = {_rclone_name(entry[0]): entry for entry in entries}
+    confirmed = set()
+    deleted = 0
+
+    def on_copied(name):
+        nonlocal deleted
+        entry = by_name.get(name)
+        if entry and name not in confirmed:
+            confirmed.add(name)
+            deleted += _confirm_uploads([entry])
+
+    with open(list_path, "w", encoding="utf-8") as list_file:
+        list_file.writelines(f"{name}\n" for name in by_name)
+    try:
+        async with UploadProgress(progress_service, status_msg, title, on_copied) as progress:
+            returncode = await run_rclone(
+                ["copy", BASE_DOWNLOAD_FOLDER, UPLOAD_REMOTE, "--files-from", list_path, "--no-traverse", *flags],
+                progress, log_file_path
             )
+    finally:
+        os.remove(list_path)
+
+    rest = [name for name in by_name if name not in confirmed]
+    if returncode == 0:
+        deleted += _confirm_uploads([by_name[name] for name in rest])
+        return progress, len(by_name), deleted, 0
+    errors_by_name = {name: error for name, error in progress.errors if name}
+    fallback = next((error for name, error in progress.errors if not name), f"rclone exited with code {returncode}")
+    upload_manifest.record_failures([
+        (by_name[name][0], classify_error(errors_by_name.get(name, fallback)), errors_by_name.get(name, fallback))
+        for name in rest
+    ])
+    return progress, len(confirmed), deleted, len(rest)
+
+async def upload_to_google_photos(message):
+    """
+    Uploads the files in the download folder that the upload manifest doesn't
+    have yet, in one rclone run (see copy_files), so a /upload with nothing new
+    costs nothing. Files rclone doesn't confirm stay on disk and are recorded as
+    failed uploads for /retry_upload.
+    """
+    new_files = []
+    try:
+        # Walks the whole download folder; kept off the event loop
+        new_files, uploaded_files = await asyncio.to_thread(
+            upload_manifest.scan, BASE_DOWNLOAD_FOLDER, {PARTIAL_FOLDER}, UPLOAD_SKIP_FILES
+        )
+        # Confirmed by an earlier run that stopped before deleting them
+        files_deleted = await asyncio.to_thread(_remove_uploaded, uploaded_files)
+        if not new_files:
+            await message.reply("Nothing new to upload." + (f" Cleaned up {files_deleted} uploaded files." if files_deleted else ""))
+            return
+
+        status_msg = await message.reply(f"Starting upload of {len(new_files)} new files to Google Photos...")
+        progress, _, deleted, failed = await copy_files(
+            new_files, status_msg, "to Google Photos",
+            os.path.join(BASE_DOWNLOAD_FOLDER, "rclone_log.txt"),
+            # Kept out of the download folder so it isn't uploaded itself
+            os.path.join(STATE_FOLDER, "upload_files.txt")
+        )
+        files_deleted += deleted
 
-        if result.returncode == 0:
-            await message.reply("✅ Upload to Google Photos completed successfully.")
+        if not failed:
+            await status_msg.edit_text(f"✅ Upload to Google Photos completed successfully.\n{upload_summary(progress)}")
         else:
-            # Log the error into UPLOAD_ERROR_LOG
-            with open(UPLOAD_ERROR_LOG, "a", encoding="utf-8") as error_log:
-                error_log.write(f"{BASE_DOWNLOAD_FOLDER}\n")
-            await message.reply(f"Upload failed. Check log: {log_file_path}\nFailed uploads recorded.")
-        
-        # Clean up local files (except error log files)
-        files_deleted = 0
-        for root, dirs, files in os.walk(BASE_DOWNLOAD_FOLDER):
-            for file in files:
-                if file not in {"rclone_log.txt", "upload_errors.txt"}:
-                    os.remove(os.path.join(root, file))
-                    files_deleted += 1
-        await message.reply(f"Cleaned up {files_deleted} files from local storage.")
+            await status_msg.edit_text(
+                f"❌ Upload to Google Photos failed for {failed} files.\n{upload_summary(progress)}\n"
+                "Use /retry_upload to retry them."
+            )
+        await message.reply(f"Cleaned up {files_deleted} uploaded files from local storage.")
 
     except errors.FloodWait as e:
         from flood_control import handle_flood_wait
         await handle_flood_wait(e, message)
     except Exception as e:
         await message.reply(f"❌ Upload error: {str(e)}")
-        # In case of exception, log all files for retry:
-        with open(UPLOAD_ERROR_LOG, "a", encoding="utf-8") as error_log:
-            error_log.write(f"{BASE_DOWNLOAD_FOLDER}\n")
+        # Keep every file of this run for /retry_upload
+        upload_manifest.record_failures([(path, type(e).__name__, str(e)) for path, _, _ in new_files])
 
+def _import_error_log():
+    """
+    Moves entries of the old text error log (folders or single files) into the
+    per-file failure table, then deletes the log.
+    """
+    if not os.path.exists(UPLOAD_ERROR_LOG):
+        return
+    with open(UPLOAD_ERROR_LOG, "r", encoding="utf-8") as error_log:
+        lines = [line.strip() for line in error_log if line.strip()]
+    failures = []
+    for path in dict.fromkeys(lines):
+        if os.path.isdir(path):
+            new_files, _ = upload_manifest.scan(path, {PARTIAL_FOLDER}, UPLOAD_SKIP_FILES)
+            failures += [(file_path, "unknown", None) for file_path, _, _ in new_files]
+        elif os.path.isfile(path):
+            failures.append((path, "unknown", None))
+    upload_manifest.record_failures(failures)
+    os.remove(UPLOAD_ERROR_LOG)
 
 async def retry_upload_command(client, message):
     """
-    Reads the upload error log and attempts to re-upload all files listed in it.
-    After completion, notifies the user and deletes the error log if successful.
+    Uploads the files recorded as failed again, in batches of UPLOAD_RETRY_BATCH_SIZE
+    that run as UPLOAD_RETRY_CONCURRENCY concurrent rclone processes (sharing the
+    request rate limit). Each file's failure entry is removed as soon as it is uploaded.
     """
     try:
-        if not os.path.exists(UPLOAD_ERROR_LOG):
-            await message.reply("No failed uploads recorded.")
-            return
-
-        # Read the list of folders (or file paths) to re-upload.
-        with open(UPLOAD_ERROR_LOG, "r", encoding="utf-8") as error_log:
-            lines = [line.strip() for line in error_log if line.strip()]
-        
-        if not lines:
+        await asyncio.to_thread(_import_error_log)
+        entries = []
+        for path, _, _, _ in upload_manifest.failed_uploads():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # Deleted (or uploaded by other means) since it failed
+                upload_manifest.forget_failure(path)
+                continue
+            entries.append((path, stat.st_size, stat.st_mtime))
+        if not entries:
             await message.reply("No failed uploads recorded.")
-            os.remove(UPLOAD_ERROR_LOG)
             return
 
-        summary_msg = await message.reply(f"Retrying upload for {len(lines)} entries from error log...")
-        total = len(lines)
-        success_count = 0
+        batches = [entries[i:i + UPLOAD_RETRY_BATCH_SIZE] for i in range(0, len(entries), UPLOAD_RETRY_BATCH_SIZE)]
+        summary_msg = await message.reply(f"Retrying upload of {len(entries)} files in {len(batches)} batches...")
+        limit = asyncio.Semaphore(UPLOAD_RETRY_CONCURRENCY)
+        # Concurrent batches split the request rate
+        flags = [*RCLONE_BASE_FLAGS, f"--tpslimit={max(1, RCLONE_TPS_LIMIT // UPLOAD_RETRY_CONCURRENCY)}"]
 
-        # Loop over each recorded folder or file path
-        for idx, path in enumerate(lines, 1):
-            try:
-                # In this example, we use rclone to upload the same folder
-                log_file_path = os.path.join(BASE_DOWNLOAD_FOLDER, "rclone_retry_log.txt")
-                with open(log_file_path, "w", encoding="utf-8") as log_file:
-                    result = subprocess.run(
-                        [
-                            RCLONE_PATH, "copy", path, f"GG PHOTO:album/ONLYFAN",
-                            "--transfers=32", "--drive-chunk-size=128M", "--tpslimit=20", "-P"
-                        ],
-                        stdout=log_file, stderr=log_file, text=True, encoding="utf-8"
+        async def retry_batch(index, batch):
+            async with limit:
+                try:
+                    _, confirmed, _, _ = await copy_files(
+                        batch, summary_msg, f"retry batch {index}/{len(batches)}",
+                        os.path.join(STATE_FOLDER, f"rclone_retry_{index}.log"),
+                        os.path.join(STATE_FOLDER, f"retry_files_{index}.txt"),
+                        flags
                     )
-                if result.returncode == 0:
-                    success_count += 1
-                await summary_msg.edit_text(f"Retry upload progress: {idx}/{total} completed.")
-            except Exception as e:
-                await message.reply(f"Error re-uploading {path}: {str(e)}")
-        # If all entries have been processed successfully, delete the error log.
-        if success_count == total:
-            os.remove(UPLOAD_ERROR_LOG)
-            await message.reply("All failed uploads retried and completed successfully. Error log deleted.")
+                    return confirmed
+                except Exception as e:
+                    logger.error(f"Retry batch {index} failed: {e}")
+                    upload_manifest.record_failures([(path, type(e).__name__, str(e)) for path, _, _ in batch])
+                    return 0
+
+        uploaded = sum(await asyncio.gather(*(retry_batch(i, batch) for i, batch in enumerate(batches, 1))))
+        remaining = upload_manifest.failure_counts()
+        if not remaining:
+            await summary_msg.edit_text(f"✅ All {uploaded} failed uploads retried successfully.")
         else:
-            await message.reply(f"Retry completed: {success_count} successful out of {total} entries. Please check the error log.")
+            await summary_msg.edit_text(
+                f"Retry completed: {uploaded} of {len(entries)} files uploaded.\n"
+                f"Still failing: " + ", ".join(f"{error_class} {count}" for error_class, count in sorted(remaining.items()))
+            )
 
     except Exception as e:
         await message.reply(f"Error during retry upload: {str(e)}")
@@ -0,0 +1,95 @@
+import os
+import time
+import logging
+from state_db import get_db
+
+logger = logging.getLogger(__name__)
+
+# Files confirmed uploaded, by absolute path. A file whose size or mtime changed
+# since then counts as new and is uploaded again.
+# Failed uploads are kept per file, with the class of their last error, until a retry succeeds.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS uploads (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    uploaded REAL NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS failed_uploads (
+    path TEXT PRIMARY KEY,
+    error_class TEXT NOT NULL,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 1,
+    failed REAL NOT NULL
+) WITHOUT ROWID;
+"""
+
+def _db():
+    return get_db("upload_manifest.db", SCHEMA)
+
+def is_uploaded(path, size, mtime):
+    """Returns True if this exact file (same size and mtime) was uploaded before."""
+    row = _db().execute("SELECT size, mtime FROM uploads WHERE path = ?", (path,)).fetchone()
+    return row is not None and row[0] == size and row[1] == mtime
+
+def record(entries):
+    """Records [(path, size, mtime)] as uploaded and drops their failure entries, in one transaction."""
+    conn = _db()
+    now = time.time()
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO uploads (path, size, mtime, uploaded) VALUES (?, ?, ?, ?)",
+            [(path, size, mtime, now) for path, size, mtime in entries]
+        )
+        conn.executemany("DELETE FROM failed_uploads WHERE path = ?", [(path,) for path, _, _ in entries])
+
+def record_failures(failures):
+    """Records [(path, error_class, error)] as failed; a file failing again has its attempts counted up."""
+    conn = _db()
+    now = time.time()
+    with conn:
+        conn.executemany(
+            "INSERT INTO failed_uploads (path, error_class, error, failed) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (path) DO UPDATE SET error_class = excluded.error_class, error = excluded.error, "
+            "attempts = attempts + 1, failed = excluded.failed",
+            [(path, error_class, error, now) for path, error_class, error in failures]
+        )
+
+def forget_failure(path):
+    """Drops the failure entry of a file that no longer needs uploading."""
+    conn = _db()
+    with conn:
+        conn.execute("DELETE FROM failed_uploads WHERE path = ?", (path,))
+
+def failed_uploads():
+    """Returns [(path, error_class, error, attempts)] for every failed upload, oldest first."""
+    return _db().execute(
+        "SELECT path, error_class, error, attempts FROM failed_uploads ORDER BY failed"
+    ).fetchall()
+
+def failure_counts():
+    """Returns {error_class: number of files}."""
+    return dict(_db().execute("SELECT error_class, COUNT(*) FROM failed_uploads GROUP BY error_class"))
+
+def scan(folder, skip_dirs=(), skip_files=()):
+    """
+    Returns (new, uploaded), two lists of (path, size, mtime) for the files under
+    folder: those still to upload and those the manifest already has (uploaded,
+    but not deleted yet). Costs one primary-key lookup per file on disk, so files
+    uploaded and deleted earlier cost nothing.
+    """
+    new = []
+    uploaded = []
+    for root, dirs, files in os.walk(folder):
+        dirs[:] = [name for name in dirs if os.path.join(root, name) not in skip_dirs]
+        for name in files:
+            if root == folder and name in skip_files:
+                continue
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entry = (path, stat.st_size, stat.st_mtime)
+            (uploaded if is_uploaded(*entry) else new).append(entry)
+    return new, uploaded
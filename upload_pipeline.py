@@ -0,0 +1,163 @@
+import os
+import time
+import asyncio
+import logging
+import secrets
+import aiohttp
+from config import BASE_DOWNLOAD_FOLDER, PARTIAL_FOLDER, UPLOAD_CONCURRENCY, RCLONE_RC_ADDR, RCLONE_RC_POLL_INTERVAL, RCLONE_RC_START_TIMEOUT
+from http_session import get_session
+from media_index import mark_files_uploaded
+import dedup
+import upload_manifest
+import metrics
+from upload import RCLONE_PATH, RCLONE_TPS_LIMIT, UPLOAD_REMOTE, UPLOAD_SKIP_FILES, UploadError, record_upload_failure, _remove_uploaded
+
+logger = logging.getLogger(__name__)
+
+# Finished downloads go to a long-running `rclone rcd` over its HTTP rc API:
+# operations/copyfile runs as an rclone job, job/status tells when it is done,
+# and only then is the local file deleted.
+
+_daemon = None
+_auth = None
+_remote = None
+_queue = None
+# Paths waiting or uploading, so a file submitted twice is uploaded once
+_queued = set()
+_uploaders = []
+metrics.Gauge("pending_uploads", "Files waiting for or in upload by the pipeline.", (), lambda: {(): len(_queued)})
+
+async def start_pipeline(remote=UPLOAD_REMOTE, concurrency=UPLOAD_CONCURRENCY, rclone_path=RCLONE_PATH):
+    """
+    Starts rclone rcd and the uploader tasks, and queues the files a previous
+    run left on disk without uploading them. Returns False if rclone can't be
+    started; downloads then stay on disk for /upload as before.
+    """
+    global _daemon, _auth, _remote, _queue
+    _auth = aiohttp.BasicAuth("bot", secrets.token_urlsafe(24))
+    # Credentials go through the environment so they don't show up in the process list
+    env = dict(os.environ, RCLONE_RC_USER=_auth.login, RCLONE_RC_PASS=_auth.password)
+    try:
+        _daemon = await asyncio.create_subprocess_exec(
+            rclone_path, "rcd", f"--rc-addr={RCLONE_RC_ADDR}", f"--tpslimit={RCLONE_TPS_LIMIT}", "--drive-chunk-size=128M",
+            env=env, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL
+        )
+    except OSError as e:
+        logger.error(f"Could not start rclone rcd: {e}")
+        return False
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + RCLONE_RC_START_TIMEOUT
+    while True:
+        try:
+            await _rc("rc/noop")
+            break
+        except (aiohttp.ClientError, UploadError) as e:
+            if _daemon.returncode is not None or loop.time() > deadline:
+                logger.error(f"rclone rcd did not come up: {e}")
+                await stop_pipeline()
+                return False
+            await asyncio.sleep(0.2)
+
+    _remote = remote
+    _queue = asyncio.Queue()
+    for uploader_id in range(concurrency):
+        _uploaders.append(asyncio.create_task(_uploader(uploader_id)))
+    logger.info(f"Upload pipeline started: {concurrency} uploaders to {remote}")
+    await _submit_leftovers()
+    return True
+
+async def _submit_leftovers():
+    """Queues finished files the manifest doesn't list as uploaded and deletes those it does."""
+    new_files, uploaded_files = await asyncio.to_thread(
+        upload_manifest.scan, BASE_DOWNLOAD_FOLDER, {PARTIAL_FOLDER}, UPLOAD_SKIP_FILES
+    )
+    removed = await asyncio.to_thread(_remove_uploaded, uploaded_files)
+    for path, _, _ in new_files:
+        submit_upload(path)
+    if new_files or removed:
+        logger.info(f"Upload pipeline: queued {len(new_files)} files left from the last run, removed {removed} already uploaded")
+
+async def stop_pipeline():
+    """
+    Stops the uploaders and rclone rcd. Files not confirmed uploaded stay on
+    disk (for /upload or the next pipeline run).
+    """
+    global _daemon, _queue
+    for task in _uploaders:
+        task.cancel()
+    await asyncio.gather(*_uploaders, return_exceptions=True)
+    _uploaders.clear()
+    _queue = None
+    _queued.clear()
+    if _daemon is not None and _daemon.returncode is None:
+        _daemon.terminate()
+        await _daemon.wait()
+    _daemon = None
+
+def submit_upload(file_path):
+    """
+    Queues a finished download for upload. Does nothing (and returns False)
+    when the pipeline is not running.
+    """
+    if _queue is None:
+        return False
+    if file_path not in _queued:
+        _queued.add(file_path)
+        _queue.put_nowait(file_path)
+    return True
+
+def pending_uploads():
+    """Returns the number of files waiting for or in upload."""
+    return len(_queued)
+
+async def _rc(command, **params):
+    url = f"http://{RCLONE_RC_ADDR}/{command}"
+    async with get_session().post(url, json=params, auth=_auth) as response:
+        result = await response.json(content_type=None)
+        if response.status != 200:
+            raise UploadError(result.get("error") or f"rc {command} returned status {response.status}")
+        return result
+
+async def upload_file(file_path):
+    """Uploads one file through rclone rcd and deletes it once rclone reports success."""
+    if not os.path.exists(file_path):
+        # Deleted, or uploaded by /upload meanwhile
+        return
+    name = os.path.basename(file_path)
+    stat = os.stat(file_path)
+    start = time.monotonic()
+    job = await _rc(
+        "operations/copyfile",
+        srcFs=os.path.dirname(file_path), srcRemote=name,
+        dstFs=_remote, dstRemote=name,
+        _async=True
+    )
+    while True:
+        await asyncio.sleep(RCLONE_RC_POLL_INTERVAL)
+        status = await _rc("job/status", jobid=job["jobid"])
+        if status.get("finished"):
+            break
+    if not status.get("success"):
+        raise UploadError(status.get("error") or "rclone reported a failed upload")
+    metrics.stage_duration.observe(time.monotonic() - start, ("upload",))
+    metrics.uploaded_bytes.inc(("pipeline",), stat.st_size)
+    upload_manifest.record([(file_path, stat.st_size, stat.st_mtime)])
+    mark_files_uploaded([file_path])
+    dedup.mark_files_uploaded([file_path])
+    os.remove(file_path)
+
+async def _uploader(uploader_id):
+    while True:
+        file_path = await _queue.get()
+        try:
+            await upload_file(file_path)
+            logger.info(f"Uploader {uploader_id} uploaded {file_path}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Uploader {uploader_id} failed {file_path}: {e}")
+            # Kept on disk; /retry_upload picks it up
+            record_upload_failure(file_path, e)
+        finally:
+            _queued.discard(file_path)
@@ -0,0 +1,184 @@
+import os
+import time
+import asyncio
+import logging
+from pyrogram import errors
+from config import STATE_FOLDER, DOWNLOAD_WORKERS
+from flood_control import pause_chat, paused_chats, add_resume_listener
+from job_queue import JobQueue
+from progress import progress_service
+from download import download_from_url, download_with_progress, download_album, resume_partial_download, probe_size, DownloadError
+from resume import http_key, telegram_key, load_state, list_states
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Durable queue shared by all handlers; downloads survive restarts
+job_queue = JobQueue(os.path.join(STATE_FOLDER, "jobs.db"))
+
+_job_available = asyncio.Event()
+_workers = []
+# Running URL size probes, referenced so they aren't garbage collected
+_probes = set()
+# Message objects for jobs submitted in this process, saves a get_messages call per job
+_messages = {}
+# Parked jobs of a chat become claimable again when its FloodWait pause ends
+add_resume_listener(lambda chat_id: _job_available.set())
+# Chats see how many of their downloads wait on their progress dashboard
+progress_service.queued_counts = job_queue.chat_counts
+metrics.Gauge("jobs", "Jobs in the download queue, by status.", ("status",),
+              lambda: {(status,): count for status, count in job_queue.counts().items()})
+
+def submit(kind, payload, message, size=None):
+    """
+    Queues a job for the worker pool and returns its id.
+    payload must be JSON-serializable; the chat/message ids are added so the
+    job can still reply to its message after a restart. size (bytes, if known)
+    picks the job's scheduling lane.
+    """
+    payload = dict(payload, chat_id=message.chat.id, message_id=message.id)
+    job_id = job_queue.enqueue(kind, payload, message.chat.id, size)
+    _messages[job_id] = message
+    _job_available.set()
+    return job_id
+
+def enqueue_download(kind, payload, message, size=None):
+    """
+    Queues a download and returns its job id straight away. A download that has
+    to wait for a free worker shows up as queued on the chat's progress dashboard,
+    so handlers never wait for a Bot API call here.
+    """
+    job_id = submit(kind, payload, message, size)
+    progress_service.note_queued(message)
+    return job_id
+
+def enqueue_url(url, message):
+    """
+    Queues a URL download without waiting for its size: the job starts in the
+    large lane and a HEAD request in the background moves it to its real lane
+    if a worker hasn't claimed it by then.
+    """
+    job_id = enqueue_download("url", {"url": url}, message)
+    probe = asyncio.create_task(_probe_job(job_id, url))
+    _probes.add(probe)
+    probe.add_done_callback(_probes.discard)
+    return job_id
+
+async def _probe_job(job_id, url):
+    size = await probe_size(url)
+    if size is not None and job_queue.resize(job_id, size):
+        # It may now fit the small lane while the large one is full
+        _job_available.set()
+
+def retry_failed(message):
+    """
+    Queues failed jobs again, plus partial downloads on disk that no job refers to
+    (e.g. left over from before the queue existed). Returns the number of retries.
+    """
+    requeued = job_queue.requeue("failed")
+    job_keys = set()
+    for payload in job_queue.payloads():
+        if payload.get("file_unique_id"):
+            job_keys.add(telegram_key(payload["file_unique_id"]))
+        elif "file_unique_ids" in payload:
+            job_keys.update(telegram_key(uid) for uid in payload["file_unique_ids"] if uid)
+        elif "url" in payload:
+            job_keys.add(http_key(payload["url"]))
+        elif "key" in payload:
+            job_keys.add(payload["key"])
+    orphans = [key for key, state in list_states() if key not in job_keys]
+    for key in orphans:
+        submit("resume", {"key": key}, message)
+    _job_available.set()
+    return requeued + len(orphans)
+
+def pending_jobs():
+    """Returns the number of jobs waiting for a worker."""
+    return job_queue.counts().get("queued", 0)
+
+async def _get_message(client, job):
+    message = _messages.pop(job.id, None)
+    if message is None:
+        message = await client.get_messages(job.payload["chat_id"], job.payload["message_id"])
+        if not message or message.empty:
+            raise DownloadError("The original message is no longer available")
+    return message
+
+async def _run_telegram(client, job, message):
+    return await download_with_progress(message, job.payload["media_type"], retry=job.attempts > 1)
+
+async def _run_album(client, job, message):
+    messages = await client.get_messages(job.payload["chat_id"], job.payload["message_ids"])
+    messages = [m for m in messages if m and not m.empty]
+    if not messages:
+        raise DownloadError("The album's messages are no longer available")
+    return await download_album(messages)
+
+async def _run_url(client, job, message):
+    # download_from_url reports its own errors in the chat and returns False for them
+    return await download_from_url(message, job.payload["url"])
+
+async def _run_resume(client, job, message):
+    key = job.payload["key"]
+    state = load_state(key)
+    if state is None:
+        return True
+    return await resume_partial_download(client, message, key, state)
+
+JOB_RUNNERS = {
+    "telegram": _run_telegram,
+    "album": _run_album,
+    "url": _run_url,
+    "resume": _run_resume
+}
+
+async def _worker(client, worker_id):
+    while True:
+        job = job_queue.claim(paused_chats())
+        if job is None:
+            _job_available.clear()
+            await _job_available.wait()
+            continue
+        # Includes time parked by a FloodWait and earlier failed attempts
+        metrics.stage_duration.observe(time.time() - job.created, ("queue_wait",))
+        message = None
+        try:
+            message = await _get_message(client, job)
+            if await JOB_RUNNERS[job.kind](client, job, message) is False:
+                job_queue.fail(job.id, "Download failed")
+            else:
+                job_queue.complete(job.id)
+        except asyncio.CancelledError:
+            # Left as running; recover() queues it again on the next start
+            raise
+        except errors.FloodWait as e:
+            # Park the job until the chat's pause ends and take work from other chats meanwhile;
+            # a partial download resumes from its .part file
+            pause_chat(job.chat_id, e.value, message)
+            job_queue.release(job.id)
+            if message is not None:
+                _messages[job.id] = message
+        except Exception as e:
+            logger.error(f"Worker {worker_id} failed job {job.id} ({job.kind}): {e}")
+            job_queue.fail(job.id, e)
+        # A finished large job may let an idle worker claim the next one
+        _job_available.set()
+
+def start_workers(client, count=DOWNLOAD_WORKERS):
+    """Starts the worker pool. Jobs interrupted by the last shutdown run again first."""
+    job_queue.recover()
+    for worker_id in range(count):
+        _workers.append(asyncio.create_task(_worker(client, worker_id)))
+    _job_available.set()
+    logger.info(f"Started {count} download workers")
+
+async def stop_workers():
+    """Cancels the workers; running jobs stay in the queue for the next start."""
+    for task in _workers:
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+    for probe in list(_probes):
+        probe.cancel()
+    await asyncio.gather(*_probes, return_exceptions=True)
+    job_queue.close()